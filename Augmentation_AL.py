@@ -1,69 +1,119 @@
 import os
 import cv2
+import numpy as np
+# 颜色变换由 BatchPhotometric 完成，这里只导入几何管道（含注释掉的可选项）用到的变换
 from albumentations import (
     Compose, HorizontalFlip, Rotate,
-    RGBShift, RandomBrightnessContrast,MotionBlur,VerticalFlip,HueSaturationValue,ElasticTransform,OpticalDistortion
+    MotionBlur,VerticalFlip,ElasticTransform,OpticalDistortion
 )
 from tqdm import tqdm
+from pipeline import run_pipeline
+from manifest import Manifest, PendingRecord, imwrite_or_raise
+from photometric_batch import BatchPhotometric
 
 # 配置参数
 input_dir = "../Datasets/9_dataset_3"        # 输入图片根目录（包含子文件夹）
 output_dir = "../Datasets/99_dataset"   # 输出图片根目录
 num_augments = 10-1                   # 每张图片生成多少个增强版本
 
-# 创建输出目录
-os.makedirs(output_dir, exist_ok=True)
-
 # 定义数据增强管道
+# 几何部分逐张调用 albumentations
 augmentation_pipeline = Compose([
     # HorizontalFlip(p=0.25),
     # VerticalFlip(p=0.25),
     ElasticTransform(p=0.35,alpha=1, sigma=20),
     # OpticalDistortion(p=0.35,distort_limit=0.2, shift_limit=0.2),
     # Rotate(limit=45, p=0.5),
-    RGBShift(r_shift_limit=10, g_shift_limit=10, b_shift_limit=10, p=0.25),
-    RandomBrightnessContrast(p=0.25,brightness_limit=(-0.25,0.25),contrast_limit=(-0.10,0.10)),
-    HueSaturationValue( hue_shift_limit = (-5, 5),
-                        sat_shift_limit = (-5, 5),
-                        val_shift_limit = (-5, 5),
-                        p=0.25),
     # MotionBlur(p=0.25,blur_limit = 3),
 ])
 
+# 颜色部分在几何变换之后执行，每张图片的 num_augments 个副本叠成一个图像堆批量处理（见 photometric_batch.py），
+# 参数与原 RGBShift / RandomBrightnessContrast / HueSaturationValue 相同
+color_pipeline = BatchPhotometric() \
+    .rgb_shift(r_shift_limit=10, g_shift_limit=10, b_shift_limit=10, p=0.25) \
+    .brightness_contrast(p=0.25,brightness_limit=(-0.25,0.25),contrast_limit=(-0.10,0.10)) \
+    .hue_saturation_value(hue_shift_limit = (-5, 5),
+                          sat_shift_limit = (-5, 5),
+                          val_shift_limit = (-5, 5),
+                          p=0.25)
+
+def augment_copies(image, num_augments):
+    """生成一张图片的 num_augments 个增强版本：逐张做几何变换，再对整个图像堆批量做颜色变换"""
+    if num_augments <= 0:
+        return []
+    copies = np.stack([augmentation_pipeline(image=image)['image'] for _ in range(num_augments)])
+    return list(color_pipeline(images=copies)['images'])
+
+def _write_output(job):
+    """写线程：编码失败时抛出异常，该图片的清单记录不会写入"""
+    output_path, image, pending = job
+    imwrite_or_raise(output_path, image)
+    pending.done()
+
 # 支持的图片格式
 extensions = ['.jpg', '.jpeg', '.png']
 
-# 使用os.walk递归遍历所有子目录
-for root, dirs, files in os.walk(input_dir):
-    # 计算相对路径以便重建输出目录结构
-    relative_path = os.path.relpath(root, input_dir)
-    current_output_dir = os.path.join(output_dir, relative_path)
-    
-    # 创建当前层级的输出目录
-    os.makedirs(current_output_dir, exist_ok=True)
-    
-    # 处理当前目录下的所有文件
-    for filename in tqdm(files, desc=f"Processing {relative_path}"):
+def augment_dir(input_dir, output_dir, num_augments, io_threads=4, resume=False):
+    """
+    递归遍历 input_dir，保存每张图片的原图和 num_augments 个增强版本，保持子目录结构
+    :param io_threads: 读取、写入线程数，读写与增强计算重叠执行（见 pipeline.py）；0 为串行
+    :param resume: 在 output_dir 下维护输出清单（见 manifest.py），跳过源图未变、增强配置相同且输出仍在的图片
+    """
+    # 创建输出目录
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = Manifest(output_dir) if resume else None
+    # 清单参数：增强数量 + 增强管道配置，任一变化都会重新生成
+    params = {'num_augments': num_augments, 'pipeline': repr(augmentation_pipeline), 'color': repr(color_pipeline)}
+
+    # 使用os.walk递归遍历所有子目录
+    for root, dirs, files in os.walk(input_dir):
+        # 计算相对路径以便重建输出目录结构
+        relative_path = os.path.relpath(root, input_dir)
+        current_output_dir = os.path.join(output_dir, relative_path)
+
+        # 创建当前层级的输出目录
+        os.makedirs(current_output_dir, exist_ok=True)
+
         # 过滤非图片文件
-        if not any(filename.lower().endswith(ext) for ext in extensions):
-            continue
-        
-        # 读取图片
-        img_path = os.path.join(root, filename)
-        image = cv2.imread(img_path)
-        
-        # 保存原始图片（可选）
-        original_output = os.path.join(current_output_dir, f"original_{filename}")
-        cv2.imwrite(original_output, image)
-        
-        # 生成多个增强版本
-        for i in range(num_augments):
-            augmented = augmentation_pipeline(image=image)
-            augmented_img = augmented['image']
-            
-            # 构建增强后的文件名
-            aug_filename = f"{os.path.splitext(filename)[0]}_aug{i+1}{os.path.splitext(filename)[1]}"
-            output_path = os.path.join(current_output_dir, aug_filename)
-            
-            # 保存增强后的图片
-            cv2.imwrite(output_path, augmented_img)
\ No newline at end of file
+        images = [f for f in files if any(f.lower().endswith(ext) for ext in extensions)]
+        if manifest is not None:
+            images = [f for f in images if not manifest.is_done([os.path.join(root, f)], params)]
+        pbar = tqdm(total=len(images), desc=f"Processing {relative_path}")
+
+        def compute(filename, image):
+            pbar.update(1)
+            if image is None:
+                print(f"无法读取文件: {os.path.join(root, filename)}")
+                return
+
+            # 全部输出由写线程写成功后才记入清单
+            pending = PendingRecord(manifest, [os.path.join(root, filename)], params)
+
+            # 保存原始图片（可选）
+            output_path = os.path.join(current_output_dir, f"original_{filename}")
+            pending.add(output_path)
+            yield output_path, image, pending
+
+            # 生成多个增强版本
+            for i, augmented_img in enumerate(augment_copies(image, num_augments)):
+                # 构建增强后的文件名
+                aug_filename = f"{os.path.splitext(filename)[0]}_aug{i+1}{os.path.splitext(filename)[1]}"
+                output_path = os.path.join(current_output_dir, aug_filename)
+                pending.add(output_path)
+                yield output_path, augmented_img, pending
+
+            pending.seal()
+
+        # 处理当前目录下的所有文件：读取、增强、保存三段流水线
+        run_pipeline(images,
+                     read=lambda filename: cv2.imread(os.path.join(root, filename)),
+                     compute=compute,
+                     write=_write_output,
+                     readers=io_threads, writers=io_threads)
+        pbar.close()
+
+    if manifest is not None:
+        manifest.close()
+
+if __name__ == "__main__":
+    augment_dir(input_dir, output_dir, num_augments, resume=True)
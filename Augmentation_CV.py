@@ -8,9 +8,17 @@
     6. 添加噪声（椒盐噪声，高斯噪声）
 '''
 import os
+import zlib
 import cv2
 import numpy as np
 from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from tqdm import tqdm
+from pipeline import run_pipeline
+from manifest import Manifest, PendingRecord, imwrite_or_raise
+from aug_cache import AugCache
+from telemetry import NULL_TELEMETRY, open_telemetry
 '''
 缩放
 '''
@@ -29,29 +37,12 @@ def Horizontal(image):
 def Vertical(image):
     return cv2.flip(image,0,dst=None) #垂直镜像
 
-def Horizontal_Vertical(rootpath,savepath):
-    save_loc = savepath
-    for a,b,c in os.walk(rootpath):
-        for file_i in c:
-            file_i_path = os.path.join(a,file_i)
-            print(file_i_path)
-            split = os.path.split(file_i_path)
-            dir_loc = os.path.split(split[0])[1]
-            save_path = os.path.join(save_loc,dir_loc)
-
-            if not os.path.exists(save_path):  # 先检查是否存在
-                os.makedirs(save_path)  # 创建多级目录
-                print(f"目录 {save_path} 创建成功！")
-            # else:
-            #     print(f"目录 {save_path} 已存在，无需创建。")
-
-            img_i = cv2.imread(file_i_path)
-
-            img_Hor = Horizontal(img_i)
-            cv2.imwrite(os.path.join(save_path, file_i[:-4] + "_Hor.jpg"), img_Hor)
+def _op_flip(img_i, file_i):
+    return [(file_i[:-4] + "_Hor.jpg", Horizontal(img_i)),
+            (file_i[:-4] + "_Ver.jpg", Vertical(img_i))]
 
-            img_Ver = Vertical(img_i)
-            cv2.imwrite(os.path.join(save_path, file_i[:-4] + "_Ver.jpg"), img_Ver)
+def Horizontal_Vertical(rootpath,savepath,workers=1):
+    run_ops(rootpath, savepath, ['flip'], workers=workers)
 
 ####################翻转###########################################
 ####################翻转###########################################
@@ -70,54 +61,63 @@ def Rotate(image, angle, scale):
     image = cv2.warpAffine(image,M,(w,h),borderValue=(255,0,0))
     return image
 
-def Rotate_45(rootpath,savepath):
-    save_loc = savepath
-    for a,b,c in os.walk(rootpath):
-        for file_i in c:
-            file_i_path = os.path.join(a,file_i)
-            print(file_i_path)
-            split = os.path.split(file_i_path)
-            dir_loc = os.path.split(split[0])[1]
-            save_path = os.path.join(save_loc,dir_loc)
-
-            if not os.path.exists(save_path):  # 先检查是否存在
-                os.makedirs(save_path)  # 创建多级目录
-                print(f"目录 {save_path} 创建成功！")
-            # else:
-            #     print(f"目录 {save_path} 已存在，无需创建。")
+def _op_rotate_45(img_i, file_i, angle=45, scale=0.6):
+    return [(file_i[:-4] + "_x.jpg", Rotate(img_i, angle, scale))]
 
-            img_i = cv2.imread(file_i_path)
-            
-            img_rotate = Rotate(img_i, 45,0.6)
-            cv2.imwrite(os.path.join(save_path, file_i[:-4] + "_x.jpg"), img_rotate)
+def Rotate_45(rootpath,savepath,workers=1):
+    run_ops(rootpath, savepath, ['rotate_45'], workers=workers)
 
 
-def Rotate_90_180_270(rootpath,savepath):
-    save_loc = savepath
-    for a,b,c in os.walk(rootpath):
-        for file_i in c:
-            file_i_path = os.path.join(a,file_i)
-            print(file_i_path)
-            split = os.path.split(file_i_path)
-            dir_loc = os.path.split(split[0])[1]
-            save_path = os.path.join(save_loc,dir_loc)
-            
-            if not os.path.exists(save_path):  # 先检查是否存在
-                os.makedirs(save_path)  # 创建多级目录
-                print(f"目录 {save_path} 创建成功！")
-            # else:
-            #     print(f"目录 {save_path} 已存在，无需创建。")
-
-            img_i = cv2.imread(file_i_path)
-            
-            img_rotate = Rotate(img_i, 90,1)
-            cv2.imwrite(os.path.join(save_path, file_i[:-4] + "_90.jpg"), img_rotate)
-            
-            img_rotate = Rotate(img_i, 180,1)
-            cv2.imwrite(os.path.join(save_path, file_i[:-4] + "_180.jpg"), img_rotate)
-
-            img_rotate = Rotate(img_i, 270,1)
-            cv2.imwrite(os.path.join(save_path, file_i[:-4] + "_270.jpg"), img_rotate)
+# 直角旋转角度（逆时针，与 Rotate 方向一致）-> cv2.rotate 标志
+_RIGHT_ANGLE_CODES = {
+    90: cv2.ROTATE_90_COUNTERCLOCKWISE,
+    180: cv2.ROTATE_180,
+    270: cv2.ROTATE_90_CLOCKWISE,
+}
+
+def Rotate_right_angle(image, angle):
+    """
+    直角旋转：只做转置/翻转的内存重排，没有插值模糊，也不会裁剪或填充边角，
+    非正方形图像的宽高会随角度正确交换
+    :param image: 输入图像
+    :param angle: 逆时针旋转角度，必须是 90 的整数倍
+    :return: 旋转后的图像
+    """
+    angle = angle % 360
+    if angle == 0:
+        return image.copy()
+    if angle not in _RIGHT_ANGLE_CODES:
+        raise ValueError(f"直角旋转只支持 90 的整数倍，收到: {angle}")
+    return cv2.rotate(image, _RIGHT_ANGLE_CODES[angle])
+
+def Dihedral(image):
+    """
+    生成二面体群的全部 8 种变体（是否水平翻转 × 0/90/180/270 旋转）
+    :param image: 输入图像
+    :return: [(文件名后缀, 图像), ...]，后缀形如 _D0、_D90、_Hor_D180；
+             带 D 前缀，与 Rotate_90_180_270 的 _90/_180/_270 不重名，两个操作可以在同一次 run_ops 中使用
+    """
+    variants = []
+    for flip_suffix, flipped in (("", image), ("_Hor", Horizontal(image))):
+        for angle in (0, 90, 180, 270):
+            variants.append((f"{flip_suffix}_D{angle}", Rotate_right_angle(flipped, angle)))
+    return variants
+
+def _op_rotate_90_180_270(img_i, file_i, exact=True):
+    # exact=False 时沿用旧的 warpAffine 实现（保持原画布尺寸，边角填充蓝色）
+    rotate = Rotate_right_angle if exact else (lambda image, angle: Rotate(image, angle, 1))
+    return [(file_i[:-4] + "_" + str(angle) + ".jpg", rotate(img_i, angle))
+            for angle in (90, 180, 270)]
+
+def Rotate_90_180_270(rootpath,savepath,workers=1,exact=True):
+    run_ops(rootpath, savepath, [('rotate_90_180_270', {'exact': exact})], workers=workers)
+
+
+def _op_dihedral(img_i, file_i):
+    return [(file_i[:-4] + suffix + ".jpg", img_out) for suffix, img_out in Dihedral(img_i)]
+
+def Dihedral_image(rootpath,savepath,workers=1):
+    run_ops(rootpath, savepath, ['dihedral'], workers=workers)
 ####################旋转###########################################
 ####################旋转###########################################
 ####################旋转###########################################
@@ -136,81 +136,133 @@ def Move(img,x,y):
     dst=cv2.warpAffine(img,mat_translation,(width,height))  #变换函数
     return dst
 
-def move_img(rootpath,savepath):
-    save_loc = savepath
-    for a,b,c in os.walk(rootpath):
-        for file_i in c:
-            file_i_path = os.path.join(a,file_i)
-            print(file_i_path)
-            split = os.path.split(file_i_path)
-            dir_loc = os.path.split(split[0])[1]
-            save_path = os.path.join(save_loc,dir_loc)   
-
-            if not os.path.exists(save_path):  # 先检查是否存在
-                os.makedirs(save_path)  # 创建多级目录
-                print(f"目录 {save_path} 创建成功！")
-            # else:
-            #     print(f"目录 {save_path} 已存在，无需创建。")
+def _op_move(img_i, file_i, x=20, y=20):
+    return [(file_i[:-4] + "_move.jpg", Move(img_i, x, y))]
 
-            img_i = cv2.imread(file_i_path)
-            
-            img_rotate = Move(img_i, 20,20)
-            cv2.imwrite(os.path.join(save_path, file_i[:-4] + "_move.jpg"), img_rotate)   
+def move_img(rootpath,savepath,workers=1):
+    run_ops(rootpath, savepath, ['move'], workers=workers)
 ####################平移###########################################
 ####################平移###########################################
 ####################平移###########################################
 
+####################几何变换组合###########################################
+####################几何变换组合###########################################
+####################几何变换组合###########################################
+class GeoTransform:
+    """
+    几何变换组合器：把 Scale / Rotate / Move 等操作累积成 3x3 矩阵并相乘，
+    最后只做一次 warpAffine（含透视时为 warpPerspective），避免多次重采样带来的耗时和模糊
+
+    用法:
+        GeoTransform(img.shape).scale(0.5).rotate(45).move(20, 20).apply(img)
+    """
+    def __init__(self, shape):
+        """
+        :param shape: 输入图像的 shape（至少包含 高, 宽）
+        """
+        self.height, self.width = shape[:2]  # 当前输出画布尺寸
+        self.matrix = np.eye(3)
+
+    def _push(self, M):
+        self.matrix = M @ self.matrix
+        return self
+
+    def scale(self, scale):
+        """
+        放大缩小，与 Scale(image, scale) 一致：画布尺寸随之缩放
+        （cv2.resize 的边缘按复制处理，单独放大时用 border_mode=cv2.BORDER_REPLICATE 可得到相同的边缘）
+        """
+        # cv2.resize 以像素中心对齐：x' = (x + 0.5) * scale - 0.5
+        offset = 0.5 * scale - 0.5
+        self.width, self.height = round(self.width * scale), round(self.height * scale)
+        return self._push(np.array([[scale, 0, offset], [0, scale, offset], [0, 0, 1]]))
+
+    def rotate(self, angle, scale=1.0):
+        """绕当前画布中心旋转（逆时针角度），与 Rotate(image, angle, scale) 一致：画布尺寸不变"""
+        M = cv2.getRotationMatrix2D((self.width/2, self.height/2), angle, scale)
+        return self._push(np.vstack([M, [0, 0, 1]]))
+
+    def move(self, x, y):
+        """平移，与 Move(img, x, y) 一致：画布尺寸不变"""
+        return self._push(np.array([[1, 0, x], [0, 1, y], [0, 0, 1]], dtype=np.float64))
+
+    def perspective(self, src_points, dst_points):
+        """透视变换：把 4 个源点映射到 4 个目标点，画布尺寸不变"""
+        M = cv2.getPerspectiveTransform(np.float32(src_points), np.float32(dst_points))
+        return self._push(M)
+
+    def apply(self, image, interpolation=cv2.INTER_LINEAR, border_mode=cv2.BORDER_CONSTANT, border_value=0):
+        """
+        对图像执行一次组合后的变换
+        :param interpolation: 插值方式，如 cv2.INTER_LINEAR / cv2.INTER_CUBIC
+        :param border_mode: 边界模式，如 cv2.BORDER_CONSTANT / cv2.BORDER_REFLECT_101
+        :param border_value: BORDER_CONSTANT 时的填充颜色，如 Rotate 使用的 (255,0,0)
+        """
+        dsize = (self.width, self.height)
+        if np.allclose(self.matrix[2], [0, 0, 1]):
+            return cv2.warpAffine(image, self.matrix[:2], dsize, flags=interpolation,
+                                  borderMode=border_mode, borderValue=border_value)
+        return cv2.warpPerspective(image, self.matrix, dsize, flags=interpolation,
+                                   borderMode=border_mode, borderValue=border_value)
+####################几何变换组合###########################################
+####################几何变换组合###########################################
+####################几何变换组合###########################################
+
 ####################椒盐、高斯噪声###########################################
 ####################椒盐、高斯噪声###########################################
 ####################椒盐、高斯噪声###########################################
-def SaltAndPepper(src,percetage=0.01):
-    SP_NoiseImg=src.copy()
-    SP_NoiseNum=int(percetage*src.shape[0]*src.shape[1])
-    for i in range(SP_NoiseNum):
-        randR=np.random.randint(0,src.shape[0]-1)
-        randG=np.random.randint(0,src.shape[1]-1)
-        randB=np.random.randint(0,3)
-        if np.random.randint(0,1)==0:
-            SP_NoiseImg[randR,randG,randB]=0
-        else:
-            SP_NoiseImg[randR,randG,randB]=255
+def _noise_index(shape, percetage, rng):
+    """
+    为 (H,W,C) 单张图或 (N,H,W,C) 图像堆随机选取噪声位置（可重复），每张图 int(percetage*H*W) 个
+    :return: 可直接用于花式索引的下标元组
+    """
+    h, w, c = shape[-3:]
+    num = int(percetage*h*w)
+    batch_shape = shape[:-3]
+    size = batch_shape + (num,)
+    index = tuple(np.indices(batch_shape + (1,))[:-1].reshape(len(batch_shape), *batch_shape, 1))
+    return index + (rng.integers(0, h, size), rng.integers(0, w, size), rng.integers(0, c, size))
+
+def SaltAndPepper(src,percetage=0.01,seed=None):
+    """
+    椒盐噪声：随机选取 percetage*H*W 个通道值，各以 50% 概率置 0（椒）或 255（盐）
+    :param src: (H,W,C) 单张图，或 (N,H,W,C) 图像堆（每张图独立取位置）
+    :param seed: 随机种子，整数或 np.random.Generator；None 时每次结果不同
+    """
+    rng = np.random.default_rng(seed)
+    SP_NoiseImg = src.copy()
+    index = _noise_index(src.shape, percetage, rng)
+    SP_NoiseImg[index] = rng.integers(0, 2, index[-1].shape, dtype=np.uint8) * np.uint8(255)
     return SP_NoiseImg
 
 # 高斯噪声
-def GaussianNoise(image,percetage=0.01):
+def GaussianNoise(image,percetage=0.01,sigma=25,seed=None):
+    """
+    加性高斯噪声：在随机选取的 percetage*H*W 个通道值上叠加 N(0, sigma²)，按 uint8 饱和截断
+    :param image: (H,W,C) 单张图，或 (N,H,W,C) 图像堆（每张图独立取位置）
+    :param percetage: 加噪比例，>=1 时对全部像素加噪
+    :param sigma: 噪声标准差（像素值单位）
+    :param seed: 随机种子，整数或 np.random.Generator；None 时每次结果不同
+    """
+    rng = np.random.default_rng(seed)
+    if percetage >= 1:
+        noise = rng.standard_normal(image.shape, dtype=np.float32) * np.float32(sigma)
+        return np.clip(np.rint(image + noise), 0, 255).astype(np.uint8)
+
     G_Noiseimg = image.copy()
-    w = image.shape[1]
-    h = image.shape[0]
-    G_NoiseNum=int(percetage*image.shape[0]*image.shape[1])
-    for i in range(G_NoiseNum):
-        temp_x = np.random.randint(0,h)
-        temp_y = np.random.randint(0,w)
-        G_Noiseimg[temp_x][temp_y][np.random.randint(3)] = np.random.randn(1)[0]
+    index = _noise_index(image.shape, percetage, rng)
+    noise = rng.standard_normal(index[-1].shape, dtype=np.float32) * np.float32(sigma)
+    G_Noiseimg[index] = np.clip(np.rint(image[index] + noise), 0, 255).astype(np.uint8)
     return G_Noiseimg
 
-def G_and_S(rootpath,savepath):
-    save_loc = savepath
-    for a,b,c in os.walk(rootpath):
-        for file_i in c:
-            file_i_path = os.path.join(a,file_i)
-            print(file_i_path)
-            split = os.path.split(file_i_path)
-            dir_loc = os.path.split(split[0])[1]
-            save_path = os.path.join(save_loc,dir_loc)
-
-            if not os.path.exists(save_path):  # 先检查是否存在
-                os.makedirs(save_path)  # 创建多级目录
-                print(f"目录 {save_path} 创建成功！")
-            # else:
-            #     print(f"目录 {save_path} 已存在，无需创建。")
-
-            img_i = cv2.imread(file_i_path)
-
-            img_Gauss = GaussianNoise(img_i,0.01)
-            cv2.imwrite(os.path.join(save_path, file_i[:-4] + "_Gauss.jpg"),img_Gauss)
+def _op_noise(img_i, file_i, percetage=0.01, seed=None):
+    # 给定种子时按 (种子, 文件名) 派生每张图的随机流，结果与进程数、处理顺序无关
+    rng = np.random.default_rng(None if seed is None else [seed, zlib.crc32(file_i.encode())])
+    return [(file_i[:-4] + "_Gauss.jpg", GaussianNoise(img_i, percetage, seed=rng)),
+            (file_i[:-4] + "_Salt.jpg", SaltAndPepper(img_i, percetage, seed=rng))]
 
-            img_Salt = SaltAndPepper(img_i,0.01)
-            cv2.imwrite(os.path.join(save_path, file_i[:-4] + "_Salt.jpg"),img_Salt)
+def G_and_S(rootpath,savepath,workers=1,seed=None):
+    run_ops(rootpath, savepath, [('noise', {'seed': seed})], workers=workers)
 
 ####################椒盐、高斯噪声###########################################
 ####################椒盐、高斯噪声###########################################
@@ -241,55 +293,72 @@ def compress_img_CV(img, target_width=800, target_height=600):
     img_resize = cv2.resize(img, (target_width, target_height), interpolation=cv2.INTER_AREA)
     return img_resize
 
+# JPEG 可在 DCT 阶段直接按 1/2、1/4、1/8 解码
+_REDUCED_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+_JPEG_EXT = ('.jpg', '.jpeg', '.jpe', '.jfif')
+
+def plan_reduced_decode(file_path, target_width, target_height):
+    """
+    根据已知的目标尺寸选择 JPEG 缩小解码倍数：在解码结果仍不小于目标尺寸的前提下取最大倍数
+    只读取文件头（PIL 延迟解码），会考虑 EXIF 方向导致的宽高交换
+    :return: 缩小倍数 1/2/4/8，非 JPEG 或无法读取文件头时为 1
+    """
+    if not file_path.lower().endswith(_JPEG_EXT):
+        return 1
+    try:
+        with Image.open(file_path) as img:
+            width, height = img.size
+            orientation = img.getexif().get(0x0112, 1)
+    except Exception:
+        return 1
+    if orientation in (5, 6, 7, 8):  # 旋转 90°/270° 的方向，cv2.imread 会自动转正
+        width, height = height, width
+    for factor in (8, 4, 2):
+        if width // factor >= target_width and height // factor >= target_height:
+            return factor
+    return 1
+
+def imread_for_size(file_path, target_width, target_height):
+    """
+    为缩放到 target_width x target_height 读取图像：大 JPEG 先按 plan_reduced_decode 缩小解码，
+    省去解码后又被丢弃的像素；返回的图像不小于目标尺寸，之后再用 compress_img_CV 精确缩放
+    """
+    factor = plan_reduced_decode(file_path, target_width, target_height)
+    if factor == 1:
+        return cv2.imread(file_path)
+    return cv2.imread(file_path, _REDUCED_FLAGS[factor])
+
 import datetime
 
 
-def YASUO(rootpath, savepath, target_width=800, target_height=600):
+def _op_resize(img_i, file_i, target_width=800, target_height=600, date=None):
+    # 保存缩放后的图像（格式：原文件名_宽度x高度_日期.jpg）
+    base_name = os.path.splitext(file_i)[0]  # 获取文件名（不含扩展名）
+    save_file_name = f"{base_name}_{target_width}x{target_height}_{date}.jpg"
+    return [(save_file_name, compress_img_CV(img_i, target_width=target_width, target_height=target_height))]
+
+def YASUO(rootpath, savepath, target_width=800, target_height=600, workers=1, reduced_decode=True, io_threads=4,
+          resume=False, cache_dir=None):
     """
     遍历指定目录下的所有图片文件，将其缩放到固定大小并保存到目标目录
     :param rootpath: 源图片目录
     :param savepath: 保存目录
     :param target_width: 目标宽度
     :param target_height: 目标高度
+    :param workers: 并行进程数，1 为单进程，None 为 CPU 核数
+    :param reduced_decode: 大 JPEG 按目标尺寸缩小解码后再缩放（见 plan_reduced_decode）
+    :param io_threads: 读取、写入线程数，与缩放计算重叠执行；0 为串行
+    :param resume: 跳过清单中已是最新的图片，只处理新增或修改过的源文件（见 manifest.py）
+    :param cache_dir: 结果缓存目录，多个实验共用同一缩放结果时直接链接（见 aug_cache.py）
     """
-    # 获取当前日期（YYYYMMDD格式）
-    current_date = datetime.datetime.now().strftime("%Y%m%d")
     # target_width2 = int(random.uniform(-15,10))
     # target_width = int(target_width + target_width2)
-    save_loc = savepath
-    for a, b, c in os.walk(rootpath):
-        for file_i in c:
-            file_i_path = os.path.join(a, file_i)
-            print(f"处理文件: {file_i_path}")
-            
-            # 获取文件所在目录名
-            split = os.path.split(file_i_path)
-            dir_loc = os.path.split(split[0])[1]
-            save_path = os.path.join(save_loc, dir_loc)
-
-            # 如果保存路径不存在，则创建
-            if not os.path.exists(save_path):
-                os.makedirs(save_path)
-                print(f"目录 {save_path} 创建成功！")
-
-            # 读取图像
-            img_i = cv2.imread(file_i_path)
-            if img_i is None:
-                print(f"无法读取文件: {file_i_path}")
-                continue
-
-            # 缩放图像
-
-            img_yasuo = compress_img_CV(img_i, target_width=target_width, target_height=target_height)
-
-            # 保存缩放后的图像（格式：原文件名_宽度x高度_日期.jpg）
-            base_name = os.path.splitext(file_i)[0]  # 获取文件名（不含扩展名）
-            # 新命名格式：原文件名 + 尺寸（宽x高） + 日期
-            save_file_name = f"{base_name}_{target_width}x{target_height}_{current_date}.jpg"
-            save_file_path = os.path.join(save_path, save_file_name)
-            cv2.imwrite(save_file_path, img_yasuo)
-            print(f"已保存: {save_file_path}")
-            # print(f"图像已保存到: {save_file_path}")
+    run_ops(rootpath, savepath, [('resize', {'target_width': target_width, 'target_height': target_height})],
+            workers=workers, reduced_decode=reduced_decode, io_threads=io_threads, resume=resume, cache_dir=cache_dir)
 ####################压缩图片###########################################
 ####################压缩图片###########################################
 ####################压缩图片###########################################
@@ -302,30 +371,12 @@ def Darker_Brighter(image,percetage):
     brightened_image = cv2.multiply(image, brightness_factor)
     return brightened_image
 
-def D_dan_B(rootpath,savepath):
-    save_loc = savepath
-    for a,b,c in os.walk(rootpath):
-        for file_i in c:
-            file_i_path = os.path.join(a,file_i)
-            print(file_i_path)
-            split = os.path.split(file_i_path)
-            dir_loc = os.path.split(split[0])[1]
-            save_path = os.path.join(save_loc,dir_loc)
-
-            if not os.path.exists(save_path):  # 先检查是否存在
-                os.makedirs(save_path)  # 创建多级目录
-                print(f"目录 {save_path} 创建成功！")
-            # else:
-            #     print(f"目录 {save_path} 已存在，无需创建。")
+def _op_brightness(img_i, file_i):
+    return [(file_i[:-4] + "_" + str(1.25) + "_bar.jpg", Darker_Brighter(img_i, 1.5)),
+            (file_i[:-4] + "_" + str(0.75) + "_dar.jpg", Darker_Brighter(img_i, 0.75))]
 
-            img_i = cv2.imread(file_i_path)
-
-            img_dar = Darker_Brighter(img_i,1.5)
-            cv2.imwrite(os.path.join(save_path, file_i[:-4] + "_" + str(1.25) + "_bar.jpg"), img_dar)
-
-          
-            img_bar = Darker_Brighter(img_i,0.75)
-            cv2.imwrite(os.path.join(save_path, file_i[:-4] + "_" + str(0.75) + "_dar.jpg"), img_bar)                        
+def D_dan_B(rootpath,savepath,workers=1):
+    run_ops(rootpath, savepath, ['brightness'], workers=workers)
 ####################亮暗###########################################
 ####################亮暗###########################################
 ####################亮暗###########################################
@@ -338,30 +389,12 @@ def Contrast(image,percetage):
     contrasted_image = cv2.convertScaleAbs(image, alpha=contrast_factor, beta=0)
     return contrasted_image
 
-def Contrast_image(rootpath,savepath):
-    save_loc = savepath
-    for a,b,c in os.walk(rootpath):
-        for file_i in c:
-            file_i_path = os.path.join(a,file_i)
-            print(file_i_path)
-            split = os.path.split(file_i_path)
-            dir_loc = os.path.split(split[0])[1]
-            save_path = os.path.join(save_loc,dir_loc)
-
-            if not os.path.exists(save_path):  # 先检查是否存在
-                os.makedirs(save_path)  # 创建多级目录
-                print(f"目录 {save_path} 创建成功！")
-            # else:
-            #     print(f"目录 {save_path} 已存在，无需创建。")
-
-            img_i = cv2.imread(file_i_path)
-            
-            i=0.3
-            img__Contrastd = Contrast(img_i,1-i)
-            cv2.imwrite(os.path.join(save_path, file_i[:-4] + "_" + str(i) + "_Contrastd.jpg"), img__Contrastd)
+def _op_contrast(img_i, file_i, i=0.3):
+    return [(file_i[:-4] + "_" + str(i) + "_Contrastd.jpg", Contrast(img_i, 1-i)),
+            (file_i[:-4] + "_" + str(i) + "_Contrasth.jpg", Contrast(img_i, 1+i))]
 
-            img__Contrasth = Contrast(img_i,1+i)
-            cv2.imwrite(os.path.join(save_path, file_i[:-4] + "_" + str(i) + "_Contrasth.jpg"), img__Contrasth)                        
+def Contrast_image(rootpath,savepath,workers=1):
+    run_ops(rootpath, savepath, ['contrast'], workers=workers)
 ####################对比度###########################################
 ####################对比度###########################################
 ####################对比度###########################################
@@ -376,30 +409,12 @@ def hsv(image,percetage):
     saturated_image = cv2.cvtColor(hsv_image, cv2.COLOR_HSV2BGR)
     return saturated_image
 
-def hsv_image(rootpath,savepath):
-    save_loc = savepath
-    for a,b,c in os.walk(rootpath):
-        for file_i in c:
-            file_i_path = os.path.join(a,file_i)
-            print(file_i_path)
-            split = os.path.split(file_i_path)
-            dir_loc = os.path.split(split[0])[1]
-            save_path = os.path.join(save_loc,dir_loc)
-
-            if not os.path.exists(save_path):  # 先检查是否存在
-                os.makedirs(save_path)  # 创建多级目录
-                print(f"目录 {save_path} 创建成功！")
-            # else:
-            #     print(f"目录 {save_path} 已存在，无需创建。")
-
-            img_i = cv2.imread(file_i_path)
-            
-            i=0.25
-            img_hsvd = hsv(img_i,1-i)
-            cv2.imwrite(os.path.join(save_path, file_i[:-4] + "_" + str(i) + "_hsvd.jpg"), img_hsvd)
+def _op_saturation(img_i, file_i, i=0.25):
+    return [(file_i[:-4] + "_" + str(i) + "_hsvd.jpg", hsv(img_i, 1-i)),
+            (file_i[:-4] + "_" + str(i) + "_hsvh.jpg", hsv(img_i, 1+i))]
 
-            img_hsvh = hsv(img_i,1+i)
-            cv2.imwrite(os.path.join(save_path, file_i[:-4] + "_" + str(i) + "_hsvh.jpg"), img_hsvh)                        
+def hsv_image(rootpath,savepath,workers=1):
+    run_ops(rootpath, savepath, ['saturation'], workers=workers)
 ####################饱和度###########################################
 ####################饱和度###########################################
 ####################饱和度###########################################
@@ -414,31 +429,91 @@ def hue(image,percetage):
     hue_shifted_image = cv2.cvtColor(hue_image, cv2.COLOR_HSV2BGR)
     return hue_shifted_image
 
-def hue_image(rootpath,savepath):
-    save_loc = savepath
-    for a,b,c in os.walk(rootpath):
-        for file_i in c:
-            file_i_path = os.path.join(a,file_i)
-            print(file_i_path)
-            split = os.path.split(file_i_path)
-            dir_loc = os.path.split(split[0])[1]
-            save_path = os.path.join(save_loc,dir_loc)
-
-            if not os.path.exists(save_path):  # 先检查是否存在
-                os.makedirs(save_path)  # 创建多级目录
-                print(f"目录 {save_path} 创建成功！")
-            # else:
-            #     print(f"目录 {save_path} 已存在，无需创建。")
+def _op_hue(img_i, file_i, shift=7):
+    return [(file_i[:-4] + "_" + "_hueh.jpg", hue(img_i, shift))]
 
-            img_i = cv2.imread(file_i_path)
-        
-                # img_hued = Contrast(img_i,0-i)
-                # cv2.imwrite(os.path.join(save_path, file_i[:-4] + "_" + str(i) + "_hued.jpg"), img_hued)
+def hue_image(rootpath,savepath,workers=1):
+    run_ops(rootpath, savepath, ['hue'], workers=workers)
+####################色调扰动###########################################
+####################色调扰动###########################################
+####################色调扰动###########################################
 
-            img_hueh = hue(img_i,7)
-            cv2.imwrite(os.path.join(save_path, file_i[:-4] + "_" + "_hueh.jpg"), img_hueh)                        
+####################光度变换组合###########################################
+####################光度变换组合###########################################
+####################光度变换组合###########################################
+_IDENTITY_LUT = np.arange(256)
 
+class Photometric:
+    """
+    光度变换组合器：把亮度/对比度/饱和度/色调链编译成 256 项查找表，用 cv2.LUT 一次完成；
+    相邻的饱和度、色调操作共用一次 BGR→HSV→BGR 转换。
+    单个操作的结果与 Darker_Brighter / Contrast / hsv / hue 逐位相同；亮度、对比度组成的链也逐位相同。
+    饱和度+色调链省去了中间一次有损的 HSV→BGR→HSV 往返，与逐个调用相比个别像素会相差 1~3 个灰度级
 
+    用法:
+        Photometric().brightness(1.2).contrast(0.9).saturation(1.25).hue(7).apply(img)
+    """
+    def __init__(self):
+        # 阶段列表 [(色彩空间 'bgr'/'hsv', [通道0 LUT, 通道1 LUT, 通道2 LUT])]，同一色彩空间的相邻操作合并为一个阶段
+        self.stages = []
+
+    def _push(self, space, channels, lut):
+        if not self.stages or self.stages[-1][0] != space:
+            self.stages.append((space, [_IDENTITY_LUT] * 3))
+        luts = self.stages[-1][1]
+        for c in channels:
+            luts[c] = lut[luts[c]]  # 复合查找表：先查旧表，再查新表
+        return self
+
+    def brightness(self, percetage):
+        """亮度，等价于 Darker_Brighter(image, percetage)"""
+        lut = np.clip(np.rint(_IDENTITY_LUT * percetage), 0, 255).astype(np.int64)
+        return self._push('bgr', (0, 1, 2), lut)
+
+    def contrast(self, percetage):
+        """对比度，等价于 Contrast(image, percetage)"""
+        # convertScaleAbs 以 float32 计算，按相同精度舍入才能逐位一致
+        lut = np.rint(np.abs(_IDENTITY_LUT.astype(np.float32) * np.float32(percetage)))
+        lut = np.clip(lut, 0, 255).astype(np.int64)
+        return self._push('bgr', (0, 1, 2), lut)
+
+    def saturation(self, percetage):
+        """饱和度，等价于 hsv(image, percetage)"""
+        lut = np.clip(np.rint(_IDENTITY_LUT * percetage), 0, 255).astype(np.int64)
+        return self._push('hsv', (1,), lut)
+
+    def hue(self, percetage):
+        """色调偏移，等价于 hue(image, percetage)"""
+        return self._push('hsv', (0,), (_IDENTITY_LUT + int(percetage)) % 180)
+
+    def apply(self, image):
+        """对 BGR uint8 图像执行整条光度变换链"""
+        if not self.stages:
+            return image.copy()
+        for space, luts in self.stages:
+            lut = np.dstack(luts).astype(np.uint8)  # (1, 256, 3)，每个通道一张表
+            if space == 'hsv':
+                image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+                image = cv2.cvtColor(cv2.LUT(image, lut), cv2.COLOR_HSV2BGR)
+            else:
+                image = cv2.LUT(image, lut)
+        return image
+
+def _op_photometric(img_i, file_i, chains):
+    """
+    :param chains: {文件名后缀: [(操作名, 参数), ...]}，操作名为 Photometric 的方法名，
+                   如 {'_bright_sat': [('brightness', 1.2), ('saturation', 1.25)]}
+    """
+    variants = []
+    for suffix, chain in chains.items():
+        stage = Photometric()
+        for name, value in chain:
+            getattr(stage, name)(value)
+        variants.append((file_i[:-4] + suffix + ".jpg", stage.apply(img_i)))
+    return variants
+####################光度变换组合###########################################
+####################光度变换组合###########################################
+####################光度变换组合###########################################
 
 
 def pixelate(image, pixel_size):
@@ -457,54 +532,47 @@ def pixelate(image, pixel_size):
     new_height = height // pixel_size * pixel_size
     resized_image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_NEAREST)
 
-    # 分块并计算平均颜色
-    pixelated_image = resized_image.copy()
-    for i in range(0, new_width, pixel_size):
-        for j in range(0, new_height, pixel_size):
-            # 获取当前像素块
-            block = resized_image[j:j+pixel_size, i:i+pixel_size]
-            average_color = block.mean(axis=0).mean(axis=0)  # 计算平均颜色
+    # 分块并计算平均颜色：reshape 成 (行块, 块内行, 列块, 块内列, 通道)，
+    # 先对块内行、再对块内列求均值，求和顺序与逐块 block.mean(axis=0).mean(axis=0) 一致，结果逐位相同
+    blocks = resized_image.reshape(new_height // pixel_size, pixel_size, new_width // pixel_size, pixel_size, -1)
+    average_color = blocks.mean(axis=1).mean(axis=2).astype(np.uint8)
 
-            # 填充像素块
-            pixelated_image[j:j+pixel_size, i:i+pixel_size] = average_color
+    # 填充像素块
+    pixelated_image = np.repeat(np.repeat(average_color, pixel_size, axis=0), pixel_size, axis=1)
 
     # 将图像调整回原始尺寸
     pixelated_image = cv2.resize(pixelated_image, (width, height), interpolation=cv2.INTER_NEAREST)
     return pixelated_image
 
-def pixelate_image(rootpath, savepath, pixel_size=10):
+def pixelate_multi(image, pixel_sizes):
     """
-    遍历根目录下的所有图片，进行像素化处理并保存到目标目录。
+    对同一张已解码图像一次生成多种块大小的像素化结果。
 
-    :param rootpath: 要处理的图片根目录
-    :param savepath: 处理后图片的保存目录
-    :param pixel_size: 像素块的大小
+    :param image: 输入的BGR图像 (OpenCV格式)
+    :param pixel_sizes: 像素块大小列表
+    :return: {像素块大小: 像素化后的图像}
     """
-    for root, _, files in os.walk(rootpath):
-        for file in files:
-            file_path = os.path.join(root, file)
-            try:
-                # 读取图像
-                img = cv2.imread(file_path)
-                if img is None:
-                    print(f"无法读取图像: {file_path}")
-                    continue
-
-                # 像素化处理
-                pixelated_img = pixelate(img, pixel_size)
+    return {pixel_size: pixelate(image, pixel_size) for pixel_size in dict.fromkeys(pixel_sizes)}
 
-                # 构造保存路径
-                relative_path = os.path.relpath(root, rootpath)
-                save_dir = os.path.join(savepath, relative_path)
-                os.makedirs(save_dir, exist_ok=True)
+def _op_pixelate(img, file, pixel_size=10):
+    if isinstance(pixel_size, int):
+        return [(f"pixelated_{file}", pixelate(img, pixel_size))]
+    # 多个块大小：同一次解码输出全部变体，文件名带上块大小以免互相覆盖
+    return [(f"pixelated{size}_{file}", img_out) for size, img_out in pixelate_multi(img, pixel_size).items()]
 
-                # 保存图像
-                save_file = os.path.join(save_dir, f"pixelated_{file}")
-                cv2.imwrite(save_file, pixelated_img)
-                print(f"保存图像: {save_file}")
+def pixelate_image(rootpath, savepath, pixel_size=10, workers=1, resume=False, cache_dir=None):
+    """
+    遍历根目录下的所有图片，进行像素化处理并保存到目标目录。
 
-            except Exception as e:
-                print(f"处理图像时出错: {file_path}, 错误信息: {e}") 
+    :param rootpath: 要处理的图片根目录
+    :param savepath: 处理后图片的保存目录
+    :param pixel_size: 像素块的大小，也可以是列表（如 [3, 5, 8]），一次解码输出全部块大小，保存为 pixelated<大小>_<原文件名>
+    :param workers: 并行进程数，1 为单进程，None 为 CPU 核数
+    :param resume: 跳过清单中已是最新的图片，只处理新增或修改过的源文件（见 manifest.py）
+    :param cache_dir: 结果缓存目录，相同源图与参数直接链接已有结果（见 aug_cache.py）
+    """
+    run_ops(rootpath, savepath, [('pixelate', {'pixel_size': pixel_size})], relative=True, workers=workers,
+            resume=resume, cache_dir=cache_dir)
 
 
 ####################正方形转换###########################################
@@ -550,52 +618,318 @@ def make_square(image):
     # 转换回OpenCV格式
     return cv2.cvtColor(np.array(new_image), cv2.COLOR_RGB2BGR)
 
-def Square_image(rootpath, savepath):
+def _op_square(img_i, file_i):
+    base_name = os.path.splitext(file_i)[0]  # 获取文件名（不含扩展名）
+    return [(f"{base_name}_square.jpg", make_square(img_i))]
+
+def Square_image(rootpath, savepath, workers=1, resume=False, cache_dir=None):
     """
     遍历目录并将所有图片转换为正方形
     
     参数:
         rootpath: 源图片目录
         savepath: 保存目录
+        workers: 并行进程数，1 为单进程，None 为 CPU 核数
+        resume: 跳过清单中已是最新的图片，只处理新增或修改过的源文件（见 manifest.py）
+        cache_dir: 结果缓存目录，相同源图直接链接已有结果（见 aug_cache.py）
+    """
+    run_ops(rootpath, savepath, ['square'], workers=workers, resume=resume, cache_dir=cache_dir)
+####################正方形转换###########################################
+####################正方形转换###########################################
+####################正方形转换###########################################
+
+
+####################单次解码多操作引擎###########################################
+####################单次解码多操作引擎###########################################
+####################单次解码多操作引擎###########################################
+# 操作注册表：操作名 -> 变体生成函数
+# 变体生成函数签名为 op(img, file_name, **params)，返回 [(保存文件名, 图像), ...]
+OPS = {
+    'flip': _op_flip,                            # Horizontal_Vertical
+    'rotate_45': _op_rotate_45,                  # Rotate_45
+    'rotate_90_180_270': _op_rotate_90_180_270,  # Rotate_90_180_270
+    'dihedral': _op_dihedral,                    # Dihedral_image
+    'move': _op_move,                            # move_img
+    'noise': _op_noise,                          # G_and_S
+    'resize': _op_resize,                        # YASUO
+    'brightness': _op_brightness,                # D_dan_B
+    'contrast': _op_contrast,                    # Contrast_image
+    'saturation': _op_saturation,                # hsv_image
+    'hue': _op_hue,                              # hue_image
+    'photometric': _op_photometric,              # Photometric 光度变换链
+    'pixelate': _op_pixelate,                    # pixelate_image
+    'square': _op_square,                        # Square_image
+}
+
+# 输出尺寸固定、与原图分辨率无关的操作：操作名 -> 由参数求目标尺寸 (宽, 高)，用于缩小解码
+DECODE_SIZE = {
+    'resize': lambda params: (params.get('target_width', 800), params.get('target_height', 600)),
+}
+
+def _decode_size(ops):
+    """所有操作都声明了目标尺寸时，返回能满足全部操作的最小解码尺寸；否则返回 None（全分辨率解码）"""
+    if not ops or any(name not in DECODE_SIZE for name, _ in ops):
+        return None
+    sizes = [DECODE_SIZE[name](params) for name, params in ops]
+    return max(w for w, _ in sizes), max(h for _, h in sizes)
+
+# 输出只由 源文件内容 + 参数 决定的操作，可以使用结果缓存（见 aug_cache.py）；
+# 噪声只有固定 seed 时才可复现，另行判断
+CACHEABLE_OPS = {'flip', 'rotate_45', 'rotate_90_180_270', 'dihedral', 'move', 'resize', 'brightness',
+                 'contrast', 'saturation', 'hue', 'photometric', 'pixelate', 'square'}
+
+def _normalize_ops(ops):
+    """将 ['flip', ('resize', {...}), ...] 统一为 [(操作名, 参数字典), ...]"""
+    normalized = []
+    for op in ops:
+        name, params = (op, {}) if isinstance(op, str) else (op[0], dict(op[1]))
+        if name not in OPS:
+            raise ValueError(f"未知操作: {name}，可选操作: {', '.join(OPS)}")
+        if name == 'resize':
+            # 日期在整个批次开始时确定一次，保证同一批次的输出命名一致
+            params.setdefault('date', datetime.datetime.now().strftime("%Y%m%d"))
+        normalized.append((name, params))
+    return normalized
+
+def _walk_tasks(rootpath, savepath, relative=False):
+    """
+    遍历一次目录，生成 (源文件路径, 保存目录, 文件名)
+    :param relative: True 时按相对路径重建目录结构，False 时仅保留上一级目录名
     """
-    save_loc = savepath
     for a, b, c in os.walk(rootpath):
         for file_i in c:
             file_i_path = os.path.join(a, file_i)
-            print(f"处理文件: {file_i_path}")
-            
-            # 获取文件所在目录名
-            split = os.path.split(file_i_path)
-            dir_loc = os.path.split(split[0])[1]
-            save_path = os.path.join(save_loc, dir_loc)
-
-            # 如果保存路径不存在，则创建
-            if not os.path.exists(save_path):
-                os.makedirs(save_path)
-                print(f"目录 {save_path} 创建成功！")
-            
+            if relative:
+                save_path = os.path.join(savepath, os.path.relpath(a, rootpath))
+            else:
+                dir_loc = os.path.split(os.path.split(file_i_path)[0])[1]
+                save_path = os.path.join(savepath, dir_loc)
+            yield file_i_path, save_path, file_i
+
+def _read_image(file_i_path, decode_size=None):
+    return imread_for_size(file_i_path, *decode_size) if decode_size else cv2.imread(file_i_path)
+
+def _cache_key(cache, src_hash, file_i, name, params, decode_size=None):
+    """可缓存的操作返回缓存键，否则返回 None；缩小解码会改变像素，解码尺寸也参与键"""
+    if name not in CACHEABLE_OPS and not (name == 'noise' and params.get('seed') is not None):
+        return None
+    try:
+        return cache.key(src_hash, file_i, name, {**params, 'decode_size': decode_size})
+    except TypeError:
+        return None  # 参数无法序列化，不缓存
+
+def _load_task(task, decode_size=None, cache=None, telemetry=None):
+    """
+    读取阶段：有结果缓存时先按源文件内容查缓存，命中的操作直接链接输出，全部命中时不再解码
+    :return: (图像或 None, 由缓存完成的 [(操作名, 参数, [保存路径, ...])], 需要计算的 [(操作名, 参数, 缓存键)])
+    """
+    tm = telemetry or NULL_TELEMETRY
+    file_i_path, save_path, file_i, task_ops = task
+    served, missed = [], []
+    if cache is None:
+        missed = [(name, params, None) for name, params in task_ops]
+    else:
+        with tm.stage('cache_lookup'):
             try:
-                # 读取图像
-                img_i = cv2.imread(file_i_path)
+                src_hash = cache.hash_file(file_i_path)
+            except OSError:
+                src_hash = None  # 读不到的文件交给下面的解码报错
+            for name, params in task_ops:
+                key = _cache_key(cache, src_hash, file_i, name, params, decode_size) if src_hash else None
+                outputs = cache.get(key, save_path) if key else None
+                if outputs is None:
+                    missed.append((name, params, key))
+                else:
+                    served.append((name, params, outputs))
+        tm.count('cache_hits', len(served))
+    img_i = None
+    if missed:
+        with tm.stage('decode'):
+            img_i = _read_image(file_i_path, decode_size)
+    return img_i, served, missed
+
+def _apply_ops(img_i, file_i_path, save_path, file_i, ops, telemetry=None):
+    """
+    对已解码的图片依次执行所有操作，逐个生成 (操作名, 参数, 缓存键, [(保存路径, 图像), ...])
+    :param ops: [(操作名, 参数, 缓存键或 None), ...]
+    :param telemetry: Telemetry 实例，每个操作记为 op.<操作名> 阶段
+    """
+    tm = telemetry or NULL_TELEMETRY
+    for name, params, key in ops:
+        try:
+            with tm.stage(f"op.{name}"):
+                variants = OPS[name](img_i, file_i, **params)
+        except Exception as e:
+            print(f"处理图片时出错: {file_i_path}, 操作: {name}, 错误信息: {str(e)}")
+            continue
+        yield name, params, key, [(os.path.join(save_path, save_file_name), img_out) for save_file_name, img_out in variants]
+
+def _write_jobs(jobs, key, pending=None):
+    """
+    生成写任务 (该组的 [(保存路径, 图像)], 缓存键, PendingRecord 或 None)。要缓存的操作整组写完才能入库，
+    作为一个写任务；不缓存的按单张图片拆开，写线程可以并行编码。
+    有 pending 时每个写任务提交前先登记，写成功后由写线程回报，整组写完才记入清单
+    """
+    groups = [(jobs, key)] if key is not None else [([job], None) for job in jobs]
+    for group, group_key in groups:
+        if pending is not None:
+            pending.add(*[save_file_path for save_file_path, _ in group])
+        yield group, group_key, pending
+
+def _write_outputs(job, cache=None, telemetry=None):
+    outputs, key, pending = job
+    for save_file_path, img_out in outputs:
+        imwrite_or_raise(save_file_path, img_out, telemetry=telemetry)
+    if cache is not None and key is not None:
+        with (telemetry or NULL_TELEMETRY).stage('cache_store'):
+            cache.put(key, [save_file_path for save_file_path, _ in outputs])
+    if pending is not None:
+        pending.done()
+
+def _process_file(file_i_path, save_path, file_i, ops, decode_size=None, cache=None):
+    """
+    读取一张图片，依次执行所有操作并保存全部变体
+    :return: 完成的 [(操作名, 参数, [保存路径, ...]), ...]，读取失败时为 None；写入失败的操作不计入
+    """
+    img_i, done, missed = _load_task((file_i_path, save_path, file_i, ops), decode_size, cache)
+    if missed and img_i is None:
+        print(f"无法读取文件: {file_i_path}")
+        return done or None
+
+    for name, params, key, jobs in _apply_ops(img_i, file_i_path, save_path, file_i, missed):
+        try:
+            for job in _write_jobs(jobs, key):
+                _write_outputs(job, cache)
+        except Exception as e:
+            print(f"写入失败: {file_i_path}, 操作: {name}, 错误信息: {str(e)}")
+            continue
+        done.append((name, params, [save_file_path for save_file_path, _ in jobs]))
+    return done
+
+def _process_task(task, decode_size=None, cache=None):
+    return task[0], _process_file(*task, decode_size, cache)
+
+def _init_worker():
+    # 每个进程只保留一个 OpenCV 线程，避免 进程数 × OpenCV线程数 的过度订阅
+    cv2.setNumThreads(1)
+
+def _file_size(task):
+    try:
+        return os.path.getsize(task[0])
+    except OSError:
+        return 0
+
+# 不参与清单比对的参数：如 YASUO 文件名中的日期，换一天重跑不应视为参数变化
+_VOLATILE_PARAMS = ('date',)
+
+def _manifest_params(name, params):
+    return {'op': name, **{k: v for k, v in params.items() if k not in _VOLATILE_PARAMS}}
+
+def _pending_tasks(rootpath, savepath, ops, relative, manifest):
+    """生成 (源文件路径, 保存目录, 文件名, 待执行操作)，有清单时跳过已是最新的操作，全部最新的文件不再读取"""
+    for file_i_path, save_path, file_i in _walk_tasks(rootpath, savepath, relative):
+        if manifest is None:
+            yield file_i_path, save_path, file_i, ops
+            continue
+        task_ops = [(name, params) for name, params in ops
+                    if not manifest.is_done([file_i_path], _manifest_params(name, params))]
+        if task_ops:
+            yield file_i_path, save_path, file_i, task_ops
+
+def _record_done(manifest, file_i_path, done):
+    if manifest is None or not done:
+        return
+    for name, params, outputs in done:
+        manifest.record([file_i_path], _manifest_params(name, params), outputs)
+
+def run_ops(rootpath, savepath, ops, relative=False, workers=1, reduced_decode=True, io_threads=4, resume=False,
+            cache_dir=None, cache_max_gb=20, telemetry=None):
+    """
+    单次遍历、单次解码的多操作引擎：每张图片只读取一次，
+    解码后的数组依次交给所有选中的操作，再统一编码保存
+    :param rootpath: 源图片目录
+    :param savepath: 保存目录
+    :param ops: 操作列表，元素为操作名或 (操作名, 参数字典)，操作名见 OPS
+    :param relative: True 时按相对路径重建目录结构，False 时仅保留上一级目录名
+    :param workers: 并行进程数，1 为单进程逐个处理，None 为 CPU 核数
+    :param reduced_decode: 所有操作的输出尺寸都已知时（见 DECODE_SIZE），大 JPEG 按该尺寸缩小解码
+    :param io_threads: 单进程模式下读取、写入线程池各自的线程数，读写与计算重叠执行（见 pipeline.py）；
+                       0 为完全串行
+    :param resume: True 时在 savepath 下维护输出清单（见 manifest.py），跳过源文件未变且输出仍在的 (图片, 操作)，
+                   中断后重跑可从断点继续
+    :param cache_dir: 结果缓存目录（见 aug_cache.py），可被多个实验共用；CACHEABLE_OPS 中的操作命中时
+                      直接链接缓存文件，不解码也不编码。None 为不使用缓存。
+                      resize 的输出名带日期，日期也参与缓存键，需要跨天命中时可显式传入固定的 date
+    :param cache_max_gb: 结果缓存的大小上限 (GB)，批次结束后按 LRU 淘汰
+    :param telemetry: 分阶段耗时遥测（见 telemetry.py）：JSON Lines 路径、True（只打印汇总）或 Telemetry 实例。
+                      单进程模式记录 解码/各操作/编码/写盘 等阶段；多进程模式只记录整体吞吐与主进程内存
+    """
+    ops = _normalize_ops(ops)
+    decode_size = _decode_size(ops) if reduced_decode else None
+    if workers is None:
+        workers = os.cpu_count() or 1
+    manifest = Manifest(savepath) if resume else None
+    cache = AugCache(cache_dir, int(cache_max_gb * 1024 ** 3)) if cache_dir else None
+    tm, own_telemetry = open_telemetry(telemetry)
+
+    try:
+        if workers <= 1:
+            def compute(task, loaded):
+                file_i_path, save_path, file_i, task_ops = task
+                img_i, served, missed = loaded
+                print(f"处理文件: {file_i_path}")
+
+                with tm.stage('mkdir'):
+                    if not os.path.exists(save_path):  # 先检查是否存在
+                        os.makedirs(save_path)  # 创建多级目录
+                        print(f"目录 {save_path} 创建成功！")
+
+                _record_done(manifest, file_i_path, served)
+                if not missed:
+                    return
                 if img_i is None:
                     print(f"无法读取文件: {file_i_path}")
-                    continue
-                
-                # 转换为正方形
-                img_square = make_square(img_i)
-                
-                # 保存图像
-                base_name = os.path.splitext(file_i)[0]  # 获取文件名（不含扩展名）
-                save_file_name = f"{base_name}_square.jpg"
-                save_file_path = os.path.join(save_path, save_file_name)
-                cv2.imwrite(save_file_path, img_square)
-                print(f"正方形图片已保存至: {save_file_path}")
-                
-            except Exception as e:
-                print(f"处理图片时出错: {file_i_path}, 错误信息: {str(e)}")
-####################正方形转换###########################################
-####################正方形转换###########################################
-####################正方形转换###########################################
+                    return
+                for name, params, key, jobs in _apply_ops(img_i, file_i_path, save_path, file_i, missed, tm):
+                    # 该操作的全部输出由写线程写成功后才记入清单
+                    pending = PendingRecord(manifest, [file_i_path], _manifest_params(name, params))
+                    yield from _write_jobs(jobs, key, pending)
+                    pending.seal()
+
+            run_pipeline(_pending_tasks(rootpath, savepath, ops, relative, manifest),
+                         read=partial(_load_task, decode_size=decode_size, cache=cache, telemetry=tm),
+                         compute=compute, write=partial(_write_outputs, cache=cache, telemetry=tm),
+                         readers=io_threads, writers=io_threads, telemetry=tm)
+            return
+
+        # 并行模式：先收集文件列表并在主进程中创建全部目录，避免子进程竞争
+        tasks = list(_pending_tasks(rootpath, savepath, ops, relative, manifest))
+        for save_path in sorted({task[1] for task in tasks}):
+            if not os.path.exists(save_path):
+                os.makedirs(save_path, exist_ok=True)
+                print(f"目录 {save_path} 创建成功！")
+
+        # 大图优先分发，缩短最后几个大文件造成的尾部等待；输出文件名只由输入决定，与调度顺序无关
+        tasks.sort(key=_file_size, reverse=True)
+        chunksize = max(1, min(64, len(tasks) // (workers * 8)))
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            results = executor.map(partial(_process_task, decode_size=decode_size, cache=cache), tasks,
+                                   chunksize=chunksize)
+            for file_i_path, done in tqdm(results, total=len(tasks), desc=f"并行处理 ({workers} 进程)", unit="img"):
+                _record_done(manifest, file_i_path, done)
+                tm.count('items')
+                tm.count('outputs', sum(len(outputs) for _, _, outputs in done or []))
+    finally:
+        if manifest is not None:
+            manifest.close()
+        if cache is not None:
+            cache.prune()
+        if own_telemetry:
+            tm.close('run_ops')
+####################单次解码多操作引擎###########################################
+####################单次解码多操作引擎###########################################
+####################单次解码多操作引擎###########################################
 
 
 # def TestOnePic():
@@ -617,7 +951,16 @@ def runs():
     
     save_path = '../Datasets/smartcar26_160'
 
-    YASUO(root_path,save_path,target_width=160, target_height=160)
+    YASUO(root_path,save_path,target_width=160, target_height=160, resume=True)    # workers=None 可用全部 CPU 核并行
+
+    # 缩放 -> 像素化 -> 合成 -> 全局增强 在内存中串联（见 chain.py），每张源图只解码一次，
+    # 中间结果不再经过 JPEG 编码/解码；像素化结果作为检查点另存一份，供其他脚本使用（合成阶段需要 albumentations）：
+    # from chain import Chain
+    # from image_mask_AL import global_aug_pipeline
+    # Chain().resize(160, 160).pixelate(3).checkpoint('../Datasets/smartcar26_160_pixelated') \
+    #     .composite('../Datasets/background', min_scale=0.6, max_scale=1.1, min_visible=0.9, num_augments=10) \
+    #     .albumentations(global_aug_pipeline) \
+    #     .run(root_path, '../Datasets/smartcar26_160_pixelated_masked_AL', resume=True)
 
     # Rotate_90_180_270(root_path,save_path)
 
@@ -635,9 +978,12 @@ def runs():
 
     # Square_image(root_path,save_path)     
 
+    # 多个操作可合并为一次遍历，每张图片只解码一次
+    # run_ops(root_path, save_path, ['rotate_90_180_270', 'hue', 'brightness', 'contrast', 'saturation'])
+
     root_path = '../Datasets/smartcar26_160'
     save_path = '../Datasets/smartcar26_160_pixelated'
-    pixelate_image(root_path,save_path,pixel_size=3)      #图像像素化---可任意参数
+    pixelate_image(root_path,save_path,pixel_size=3, resume=True)      #图像像素化---可任意参数
     
 if __name__ == "__main__":
     runs()
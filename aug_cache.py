@@ -0,0 +1,199 @@
+'''
+    内容寻址的增强结果缓存
+    键 = SHA256(源文件内容哈希, 文件名, 操作名, 操作参数, 缓存/库版本)，值 = 该操作输出的已编码文件
+    命中时把缓存文件硬链接（跨磁盘时复制）到输出目录，不解码、不计算、也不重新编码；
+    多个实验共用同一段预处理（如 缩放到 160 -> 像素化 -> 正方形）时，只有第一次真正计算
+    缓存总大小有上限，按最近使用时间淘汰（LRU）
+
+    命令行:
+        python aug_cache.py inspect <缓存目录>
+        python aug_cache.py prune <缓存目录> --max-gb 20
+'''
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+import cv2
+import numpy as np
+
+# 编码参数、输出命名或算法变化时递增，使旧缓存全部失效
+CACHE_VERSION = 1
+LIBRARY_VERSION = f"cache{CACHE_VERSION}-cv{cv2.__version__}-np{np.__version__}"
+
+
+def _link_or_copy(src, dst):
+    """硬链接 src 到 dst，跨文件系统或不支持硬链接时退回复制"""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class AugCache:
+    """
+    缓存目录结构: <cache_dir>/<键前两位>/<键>/<输出文件名>...
+    每个条目是一个目录，保存一次操作的全部输出；条目目录的修改时间即最近使用时间
+
+    用法:
+        cache = AugCache(cache_dir)
+        src_hash = cache.hash_file(src_path)
+        key = cache.key(src_hash, file_name, 'flip', {})
+        outputs = cache.get(key, save_dir)  # 命中返回输出路径列表，未命中返回 None
+        if outputs is None:
+            ...  # 计算并写出 out_paths
+            cache.put(key, out_paths)
+        cache.prune()
+    """
+
+    def __init__(self, cache_dir, max_bytes=20 * 1024 ** 3):
+        """
+        :param cache_dir: 缓存目录，可被多个输出目录、多个进程共用
+        :param max_bytes: 缓存总大小上限（字节），prune() 时按 LRU 淘汰到该大小以下
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def hash_file(path, chunk_size=1 << 20):
+        """源文件内容的 SHA256"""
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    @staticmethod
+    def key(src_hash, file_name, op, params):
+        """
+        缓存键。输出文件名由源文件名派生，因此文件名也参与键；
+        params 必须可 JSON 序列化，否则抛出 TypeError
+        """
+        payload = json.dumps([src_hash, file_name, op, params, LIBRARY_VERSION], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, key, save_dir):
+        """命中时把条目中的全部输出链接到 save_dir 并刷新使用时间，返回输出路径列表；未命中返回 None"""
+        entry = self._entry(key)
+        try:
+            names = sorted(os.listdir(entry))
+        except OSError:
+            return None
+        os.makedirs(save_dir, exist_ok=True)
+        outputs = []
+        try:
+            for name in names:
+                out_path = os.path.join(save_dir, name)
+                _link_or_copy(os.path.join(entry, name), out_path)
+                outputs.append(out_path)
+            os.utime(entry)
+        except OSError:
+            return None  # 条目正被并发的 prune 删除，按未命中处理，重新计算会覆盖已链接的部分
+        return outputs
+
+    def put(self, key, paths):
+        """
+        把一次操作已写好的输出文件存入缓存。先在临时目录中准备好再整体改名，
+        其他进程只会看到完整的条目；同一个键已存在时直接返回
+        """
+        entry = self._entry(key)
+        if os.path.isdir(entry):
+            return
+        tmp = f"{entry}.tmp-{uuid.uuid4().hex}"
+        os.makedirs(tmp)
+        try:
+            for path in paths:
+                _link_or_copy(path, os.path.join(tmp, os.path.basename(path)))
+            os.rename(tmp, entry)
+        except OSError:
+            pass  # 其他进程已抢先写入同一条目
+        finally:
+            if os.path.isdir(tmp):
+                shutil.rmtree(tmp, ignore_errors=True)
+
+    def entries(self):
+        """返回全部条目 [(键, 大小, 最近使用时间, 文件数), ...]，跳过未完成的临时目录"""
+        result = []
+        for prefix in os.listdir(self.cache_dir):
+            prefix_dir = os.path.join(self.cache_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                entry = os.path.join(prefix_dir, key)
+                if '.tmp-' in key or not os.path.isdir(entry):
+                    continue
+                try:
+                    files = os.listdir(entry)
+                    size = sum(os.path.getsize(os.path.join(entry, name)) for name in files)
+                    result.append((key, size, os.path.getmtime(entry), len(files)))
+                except OSError:
+                    continue  # 并发淘汰
+        return result
+
+    def prune(self, max_bytes=None):
+        """
+        按最近使用时间从旧到新删除条目，直到总大小不超过 max_bytes
+        :return: (删除的条目数, 释放的字节数)
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _, _ in entries)
+        removed, freed = 0, 0
+        for key, size, _, _ in entries:
+            if total <= max_bytes:
+                break
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+            total -= size
+            removed += 1
+            freed += size
+        return removed, freed
+
+
+def _format_bytes(n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1024:
+            return f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="增强结果缓存的查看与清理",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    sub = parser.add_subparsers(dest='command', required=True)
+    inspect_parser = sub.add_parser('inspect', help="查看缓存条目数、总大小和最近使用时间")
+    inspect_parser.add_argument("cache_dir", help="缓存目录")
+    prune_parser = sub.add_parser('prune', help="按 LRU 淘汰到指定大小以下")
+    prune_parser.add_argument("cache_dir", help="缓存目录")
+    prune_parser.add_argument("--max-gb", type=float, default=20.0, help="缓存大小上限 (GB)")
+    args = parser.parse_args()
+
+    cache = AugCache(args.cache_dir)
+    if args.command == 'inspect':
+        entries = cache.entries()
+        total = sum(size for _, size, _, _ in entries)
+        print(f"缓存目录: {os.path.abspath(args.cache_dir)}")
+        print(f"版本: {LIBRARY_VERSION}")
+        print(f"条目数: {len(entries)}，文件数: {sum(n for _, _, _, n in entries)}，总大小: {_format_bytes(total)}")
+        if entries:
+            fmt = "%Y-%m-%d %H:%M:%S"
+            print(f"最早使用: {time.strftime(fmt, time.localtime(min(e[2] for e in entries)))}")
+            print(f"最近使用: {time.strftime(fmt, time.localtime(max(e[2] for e in entries)))}")
+    else:
+        removed, freed = cache.prune(int(args.max_gb * 1024 ** 3))
+        print(f"已删除 {removed} 个条目，释放 {_format_bytes(freed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+'''
+    跨进程共享的背景图存储
+    多进程合成时，每个子进程各自解码、各自持有一份背景图，1080p~4K 的背景每张就有 6~24 MB，
+    进程数一多就是数 GB 的重复内存。SharedBackgroundStore 在主进程中把每张背景只解码一次，
+    以 BGR uint8 放进 multiprocessing.shared_memory；子进程按句柄零拷贝附加为只读 NumPy 视图。
+    背景按引用计数管理：最后一个使用它的任务完成后立即释放，批次结束时 close() 释放剩余的全部背景
+
+    用法（主进程）:
+        with SharedBackgroundStore() as store:
+            handle = store.acquire(bg_path, count=len(tasks))   # 首次使用时解码，句柄可以 pickle 传给子进程
+            ...                                                 # 每个任务完成后
+            store.release(bg_path)
+
+    用法（子进程）:
+        background = attach_background(handle)                  # 只读视图，不复制
+'''
+import threading
+from collections import OrderedDict
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from compositing import load_background
+from telemetry import NULL_TELEMETRY
+
+
+class SharedBackgroundStore:
+    """主进程中的共享背景存储：路径 -> 共享内存段，引用计数归零时关闭并删除"""
+
+    def __init__(self, telemetry=None, loader=None):
+        """
+        :param telemetry: Telemetry 实例，记录 decode 阶段耗时与 shared_backgrounds / shared_background_mb 两个指标
+        :param loader: 解码函数 路径 -> 数组，失败时抛出异常；默认 compositing.load_background（BGR uint8）
+        """
+        self.telemetry = telemetry or NULL_TELEMETRY
+        self.loader = loader or load_background
+        self.nbytes = 0
+        self._items = {}  # 路径 -> [共享内存段, 句柄, 引用数]
+        self._lock = threading.Lock()
+
+    def acquire(self, path, count=1):
+        """
+        增加 count 个引用，首次使用时解码并复制到共享内存
+        :return: 句柄 (共享内存名, 形状, dtype)，交给子进程的 attach_background
+        """
+        with self._lock:
+            item = self._items.get(path)
+            if item is None:
+                with self.telemetry.stage('decode'):
+                    img = self.loader(path)
+                shm = shared_memory.SharedMemory(create=True, size=img.nbytes)
+                np.ndarray(img.shape, img.dtype, buffer=shm.buf)[...] = img
+                item = self._items[path] = [shm, (shm.name, img.shape, img.dtype.str), 0]
+                self.nbytes += img.nbytes
+                self._gauge()
+            item[2] += count
+            return item[1]
+
+    def release(self, path, count=1):
+        """减少 count 个引用，归零时释放共享内存（已附加的子进程在关闭视图前仍可正常读取）"""
+        with self._lock:
+            item = self._items.get(path)
+            if item is None:
+                return
+            item[2] -= count
+            if item[2] <= 0:
+                self._free(path)
+                self._gauge()
+
+    def _free(self, path):
+        shm = self._items.pop(path)[0]
+        self.nbytes -= shm.size
+        shm.close()
+        shm.unlink()
+
+    def _gauge(self):
+        self.telemetry.gauge('shared_backgrounds', len(self._items))
+        self.telemetry.gauge('shared_background_mb', round(self.nbytes / 2 ** 20, 1))
+
+    def close(self):
+        """释放全部背景，批次结束（包括异常退出）时调用"""
+        with self._lock:
+            for path in list(self._items):
+                self._free(path)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+# 子进程中已附加的共享内存段：共享内存名 -> (共享内存段, 视图)，只保留最近使用的几张
+_attached = OrderedDict()
+_MAX_ATTACHED = 2
+
+
+def attach_background(handle):
+    """
+    子进程中按句柄附加背景图，返回只读的 BGR uint8 视图（零拷贝）。
+    任务按背景分组分发，每个进程只需保留最近的几张；更早的附加会被关闭，释放映射
+    """
+    name, shape, dtype = handle
+    entry = _attached.get(name)
+    if entry is not None:
+        _attached.move_to_end(name)
+        return entry[1]
+    shm = shared_memory.SharedMemory(name=name)
+    view = np.ndarray(shape, np.dtype(dtype), buffer=shm.buf)
+    view.flags.writeable = False
+    _attached[name] = (shm, view)
+    while len(_attached) > _MAX_ATTACHED:
+        _, (old_shm, old_view) = _attached.popitem(last=False)
+        del old_view
+        try:
+            old_shm.close()
+        except BufferError:
+            # 还有视图在使用（调用方仍持有引用），交给进程退出时释放
+            pass
+    return view
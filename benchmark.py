@@ -0,0 +1,501 @@
+'''
+    性能基准测试
+    1. 在本地按固定随机种子生成合成数据集（160x160 小图、640x640 检测帧、4000x3000 照片、背景、YOLO 标签），
+       每次运行的输入完全相同
+    2. 逐个计时 Augmentation_CV 的各个基础操作、各脚本中的 albumentations 管道，以及端到端的批处理函数
+    3. 输出每秒处理图片数、单张延迟分位数（p50/p90/p99）和峰值内存（RSS），保存为 JSON
+    4. compare 模式与保存的基线对比，吞吐下降或延迟上升超过阈值的用例标记为回退，并以非 0 退出码结束
+
+    命令行:
+        python benchmark.py run --out bench.json              # 完整测试
+        python benchmark.py run --quick --filter pixelate     # 快速模式，只跑名称匹配的用例
+        python benchmark.py compare bench_base.json bench.json --threshold 0.1
+        python benchmark.py run --out bench.json --baseline bench_base.json   # 跑完直接对比
+'''
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import Augmentation_CV as CV
+import image_mask
+from photometric_batch import sprite_color_pipeline
+from telemetry import current_rss
+
+# 各尺寸档位 (宽, 高)
+SIZES = {
+    'sprite': (160, 160),    # 分类/合成用小图
+    'frame': (640, 640),     # 检测帧
+    'photo': (4000, 3000),   # 相机原图
+}
+# 合成数据集中每个档位的图片数：(完整模式, 快速模式)
+DATASET_COUNTS = {'sprite': (64, 16), 'frame': (32, 8), 'photo': (6, 2), 'background': (4, 2), 'yolo': (16, 4)}
+NUM_CLASSES = 2
+AUGMENT_COPIES = 10  # 批量增强用例中每张输入生成的份数
+DATASET_VERSION = 1  # 合成数据的生成方式变化时递增，旧数据自动重新生成
+
+
+####################合成数据###########################################
+def synth_image(width, height, rng):
+    """纹理接近真实照片的 BGR 图像：低频色块 + 渐变 + 若干几何形状 + 传感器噪声，JPEG 压缩率与实拍图相近"""
+    low = rng.integers(0, 256, (max(2, height // 64), max(2, width // 64), 3), dtype=np.uint8)
+    img = cv2.resize(low, (width, height), interpolation=cv2.INTER_CUBIC).astype(np.int16)
+    img += np.linspace(-30, 30, width, dtype=np.int16)[None, :, None]
+    img = np.clip(img, 0, 255).astype(np.uint8)
+    for _ in range(8):
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        r = int(rng.integers(min(width, height) // 20 + 1, min(width, height) // 4 + 2))
+        if rng.random() < 0.5:
+            cv2.circle(img, (x, y), r, color, -1)
+        else:
+            cv2.rectangle(img, (x - r, y - r), (x + r, y + r), color, -1)
+    noise = rng.normal(0, 6, img.shape)
+    return np.clip(img + noise, 0, 255).astype(np.uint8)
+
+def synth_sprite(width, height, rng):
+    """带透明通道的 BGRA 小图：椭圆形主体，外部全透明"""
+    bgr = synth_image(width, height, rng)
+    alpha = np.zeros((height, width), np.uint8)
+    axes = (int(width * rng.uniform(0.3, 0.45)), int(height * rng.uniform(0.3, 0.45)))
+    cv2.ellipse(alpha, (width // 2, height // 2), axes, float(rng.uniform(0, 180)), 0, 360, 255, -1)
+    return np.dstack([bgr, alpha])
+
+def make_dataset(root, quick=False, seed=0):
+    """
+    生成合成数据集，已存在且规格相同则直接复用
+    目录结构:
+        sprites/cls<k>/*.png      BGRA 小图
+        frames/cls<k>/*.jpg       检测帧
+        photos/cls<k>/*.jpg       大图
+        backgrounds/*.jpg         合成背景
+        yolo/images/train/*.jpg, yolo/labels/train/*.txt
+    """
+    spec = {'version': DATASET_VERSION, 'quick': quick, 'seed': seed}
+    spec_path = os.path.join(root, 'dataset.json')
+    if os.path.exists(spec_path):
+        with open(spec_path, 'r', encoding='utf-8') as f:
+            if json.load(f) == spec:
+                return root
+    shutil.rmtree(root, ignore_errors=True)
+    rng = np.random.default_rng(seed)
+    count = {kind: counts[1 if quick else 0] for kind, counts in DATASET_COUNTS.items()}
+
+    for kind, folder in (('sprite', 'sprites'), ('frame', 'frames'), ('photo', 'photos')):
+        w, h = SIZES[kind]
+        for i in range(count[kind]):
+            class_dir = os.path.join(root, folder, f"cls{i % NUM_CLASSES}")
+            os.makedirs(class_dir, exist_ok=True)
+            if kind == 'sprite':
+                cv2.imwrite(os.path.join(class_dir, f"{kind}{i:04d}.png"), synth_sprite(w, h, rng))
+            else:
+                cv2.imwrite(os.path.join(class_dir, f"{kind}{i:04d}.jpg"), synth_image(w, h, rng))
+
+    os.makedirs(os.path.join(root, 'backgrounds'), exist_ok=True)
+    for i in range(count['background']):
+        cv2.imwrite(os.path.join(root, 'backgrounds', f"bg{i:02d}.jpg"), synth_image(640, 480, rng))
+
+    for sub in ('images', 'labels'):
+        os.makedirs(os.path.join(root, 'yolo', sub, 'train'), exist_ok=True)
+    w, h = SIZES['frame']
+    for i in range(count['yolo']):
+        cv2.imwrite(os.path.join(root, 'yolo', 'images', 'train', f"frame{i:04d}.jpg"), synth_image(w, h, rng))
+        with open(os.path.join(root, 'yolo', 'labels', 'train', f"frame{i:04d}.txt"), 'w') as f:
+            for _ in range(int(rng.integers(1, 6))):
+                bw, bh = rng.uniform(0.05, 0.3, 2)
+                xc, yc = rng.uniform(bw / 2, 1 - bw / 2), rng.uniform(bh / 2, 1 - bh / 2)
+                f.write(f"{int(rng.integers(0, NUM_CLASSES))} {xc:.6f} {yc:.6f} {bw:.6f} {bh:.6f}\n")
+
+    with open(spec_path, 'w', encoding='utf-8') as f:
+        json.dump(spec, f)
+    return root
+
+
+def make_roi_masks(backgrounds_dir, out_dir):
+    """为每张背景生成同名的 ROI 掩码（下方 60%、左右各留 10% 的矩形，类似路面区域），返回掩码目录"""
+    os.makedirs(out_dir, exist_ok=True)
+    for name in sorted(os.listdir(backgrounds_dir)):
+        bg = cv2.imread(os.path.join(backgrounds_dir, name), cv2.IMREAD_GRAYSCALE)
+        h, w = bg.shape
+        mask = np.zeros((h, w), np.uint8)
+        mask[int(h * 0.4):, int(w * 0.1):int(w * 0.9)] = 255
+        cv2.imwrite(os.path.join(out_dir, os.path.splitext(name)[0] + '.png'), mask)
+    return out_dir
+
+def load_images(folder, flags=cv2.IMREAD_COLOR):
+    paths = sorted(os.path.join(a, f) for a, _, c in os.walk(folder) for f in c)
+    return [cv2.imread(p, flags) for p in paths]
+
+
+####################计时与内存###########################################
+class PeakRss:
+    """后台线程定期采样 RSS，记录 with 块内的峰值（字节）"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+
+    def _sample(self):
+        rss = current_rss()
+        if rss is not None:
+            self.peak = rss if self.peak is None else max(self.peak, rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+def summarize(latencies, images, wall, peak_rss):
+    """
+    latencies: 每次调用的耗时（秒），端到端用例为 None
+    images: 处理的图片数
+    wall: 总耗时（秒）
+    """
+    result = {
+        'images': images,
+        'seconds': round(wall, 6),
+        'images_per_sec': round(images / wall, 3) if wall > 0 else None,
+        'peak_rss_mb': round(peak_rss / 2 ** 20, 1) if peak_rss else None,
+    }
+    if latencies:
+        ms = np.asarray(latencies) * 1000
+        result.update({
+            'mean_ms': round(float(ms.mean()), 4),
+            'p50_ms': round(float(np.percentile(ms, 50)), 4),
+            'p90_ms': round(float(np.percentile(ms, 90)), 4),
+            'p99_ms': round(float(np.percentile(ms, 99)), 4),
+        })
+    return result
+
+def time_calls(fn, inputs, repeat=1, warmup=1):
+    """对 inputs 中每个输入调用 fn，重复 repeat 轮，返回 (单次耗时列表, 总耗时, 峰值 RSS)"""
+    for x in inputs[:warmup]:
+        fn(x)
+    latencies = []
+    with PeakRss() as rss:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for x in inputs:
+                t = time.perf_counter()
+                fn(x)
+                latencies.append(time.perf_counter() - t)
+        wall = time.perf_counter() - start
+    return latencies, wall, rss.peak
+
+def time_batch(fn):
+    """端到端批处理：整体计时一次，屏蔽逐文件打印与进度条"""
+    with PeakRss() as rss, contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        start = time.perf_counter()
+        fn()
+        wall = time.perf_counter() - start
+    return None, wall, rss.peak
+
+
+####################基础操作###########################################
+# 名称 -> 作用于单张 BGR 图像的函数
+PRIMITIVES = {
+    'Horizontal': CV.Horizontal,
+    'Vertical': CV.Vertical,
+    'Scale': lambda img: CV.Scale(img, 0.5),
+    'Rotate_45': lambda img: CV.Rotate(img, 45, 0.6),
+    'Rotate_right_angle_90': lambda img: CV.Rotate_right_angle(img, 90),
+    'Dihedral': CV.Dihedral,
+    'Move': lambda img: CV.Move(img, 20, 20),
+    'GeoTransform': lambda img: CV.GeoTransform(img.shape).scale(0.9).rotate(15).move(10, 5).apply(img),
+    'SaltAndPepper': lambda img: CV.SaltAndPepper(img, 0.01, seed=0),
+    'GaussianNoise': lambda img: CV.GaussianNoise(img, 0.01, seed=0),
+    'Blur': CV.Blur,
+    'compress_img_CV': lambda img: CV.compress_img_CV(img, 160, 160),
+    'Darker_Brighter': lambda img: CV.Darker_Brighter(img, 1.2),
+    'Contrast': lambda img: CV.Contrast(img, 0.7),
+    'hsv': lambda img: CV.hsv(img, 1.25),
+    'hue': lambda img: CV.hue(img, 7),
+    'Photometric': lambda img: CV.Photometric().brightness(1.2).contrast(0.9).saturation(1.25).hue(7).apply(img),
+    'pixelate': lambda img: CV.pixelate(img, 3),
+    'make_square': CV.make_square,
+    'imencode_jpg': lambda img: cv2.imencode('.jpg', img),
+}
+# 大图上每轮的输入数上限，避免单个用例耗时过长
+PHOTO_INPUTS = (4, 1)
+
+def primitive_cases(data_root, quick):
+    images = {
+        'sprite': load_images(os.path.join(data_root, 'sprites')),
+        'frame': load_images(os.path.join(data_root, 'frames')),
+        'photo': load_images(os.path.join(data_root, 'photos'))[:PHOTO_INPUTS[1 if quick else 0]],
+    }
+    repeat = {'sprite': 1 if quick else 3, 'frame': 1 if quick else 2, 'photo': 1}
+    for name, fn in PRIMITIVES.items():
+        for size, inputs in images.items():
+            yield f"cv/{name}/{size}", (lambda fn=fn, inputs=inputs, r=repeat[size]:
+                                        time_calls(fn, inputs, r)), len(inputs) * repeat[size]
+
+    # 批量颜色增强：与 image_mask_AL.small_aug_pipeline 相同的参数（SPRITE_COLOR_STAGES），一次处理 AUGMENT_COPIES 张小图
+    color = sprite_color_pipeline(seed=0)
+    stacks = [np.stack([cv2.cvtColor(img, cv2.COLOR_BGR2RGB)] * AUGMENT_COPIES) for img in images['sprite']]
+    yield "np/photometric_batch/sprite", (lambda: time_calls(lambda st: color(images=st), stacks, repeat['sprite'])), \
+        len(stacks) * repeat['sprite'] * AUGMENT_COPIES
+
+    # 解码：全分辨率与按目标尺寸缩小解码
+    photo_paths = sorted(os.path.join(a, f) for a, _, c in os.walk(os.path.join(data_root, 'photos')) for f in c)
+    yield "cv/imread/photo", (lambda: time_calls(cv2.imread, photo_paths)), len(photo_paths)
+    yield "cv/imread_for_size_160/photo", (lambda: time_calls(lambda p: CV.imread_for_size(p, 160, 160),
+                                                               photo_paths)), len(photo_paths)
+
+
+####################albumentations 管道###########################################
+def albumentations_cases(data_root, quick):
+    """导入失败（未安装 albumentations 或其依赖）时只给出跳过原因"""
+    try:
+        import Augmentation_AL
+        import image_mask_AL
+        import yolo_Au
+        from sprites import SpritePyramid
+        from compositing import load_background
+    except Exception as e:
+        yield "al/*", e, 0
+        return
+
+    frames = load_images(os.path.join(data_root, 'frames'))
+    sprites = load_images(os.path.join(data_root, 'sprites'), cv2.IMREAD_UNCHANGED)
+    pyramids = [SpritePyramid(s, trim=True) for s in sprites]
+    rgb_frames = [cv2.cvtColor(f, cv2.COLOR_BGR2RGB) for f in frames]
+    labels = []
+    for i in range(len(rgb_frames)):
+        labels.append([[0.5, 0.5, 0.2, 0.3, i % NUM_CLASSES], [0.3, 0.6, 0.1, 0.1, 0]])
+    background = load_background(sorted(os.path.join(data_root, 'backgrounds', f)
+                                        for f in os.listdir(os.path.join(data_root, 'backgrounds')))[0])
+    repeat = 1 if quick else 3
+
+    # 每张帧生成 AUGMENT_COPIES 份：弹性变换逐张执行，颜色增强整批执行；吞吐按输出张数计
+    yield "al/Augmentation_AL.augment_copies/frame", (
+        lambda: time_calls(lambda img: Augmentation_AL.augment_copies(img, AUGMENT_COPIES), frames, repeat)), \
+        len(frames) * repeat * AUGMENT_COPIES
+    yield "al/yolo_Au.train_transform/frame", (
+        lambda: time_calls(lambda i: yolo_Au.train_transform(image=rgb_frames[i], bboxes=labels[i]),
+                           list(range(len(rgb_frames))), repeat)), len(rgb_frames) * repeat
+    yield "al/image_mask_AL.global_aug_pipeline/frame", (
+        lambda: time_calls(lambda img: image_mask_AL.global_aug_pipeline(image=img), frames, repeat)), \
+        len(frames) * repeat
+    yield "al/image_mask_AL.apply_small_aug/sprite", (
+        lambda: time_calls(image_mask_AL.apply_small_aug, sprites, repeat)), len(sprites) * repeat
+    yield "al/image_mask_AL.overlay_once/sprite", (
+        lambda: time_calls(lambda s: image_mask_AL.overlay_once(background, s, 0.6, 1.1, 0.9), pyramids, repeat)), \
+        len(sprites) * repeat
+
+
+####################端到端批处理###########################################
+def batch_cases(data_root, out_root, quick):
+    sprites = os.path.join(data_root, 'sprites')
+    frames = os.path.join(data_root, 'frames')
+    photos = os.path.join(data_root, 'photos')
+    count = {kind: counts[1 if quick else 0] for kind, counts in DATASET_COUNTS.items()}
+
+    def fresh(name):
+        path = os.path.join(out_root, name)
+        shutil.rmtree(path, ignore_errors=True)
+        return path
+
+    yield "batch/YASUO_160/photo", (lambda: time_batch(lambda: CV.YASUO(photos, fresh('yasuo'), 160, 160))), \
+        count['photo']
+    yield "batch/pixelate_image/sprite", (
+        lambda: time_batch(lambda: CV.pixelate_image(sprites, fresh('pixelate'), pixel_size=3))), count['sprite']
+    yield "batch/Square_image/frame", (lambda: time_batch(lambda: CV.Square_image(frames, fresh('square')))), \
+        count['frame']
+    yield "batch/run_ops_5ops/frame", (
+        lambda: time_batch(lambda: CV.run_ops(frames, fresh('run_ops'),
+                                              ['rotate_90_180_270', 'hue', 'brightness', 'contrast', 'saturation']))), \
+        count['frame']
+
+    # image_mask.batch_overlay 的随机模式（解析放置，见 placement.py）；ROI 版本另用一组固定的掩码
+    backgrounds = os.path.join(data_root, 'backgrounds')
+    yield "batch/image_mask.batch_overlay/sprite", (
+        lambda: time_batch(lambda: image_mask.batch_overlay(backgrounds, sprites, fresh('image_mask'),
+                                                            min_scale=0.6, max_scale=1.1, min_visible=0.9))), \
+        count['sprite']
+    roi_dir = make_roi_masks(backgrounds, fresh('roi_masks'))
+    yield "batch/image_mask.batch_overlay_roi/sprite", (
+        lambda: time_batch(lambda: image_mask.batch_overlay(backgrounds, sprites, fresh('image_mask_roi'),
+                                                            min_scale=0.6, max_scale=1.1, min_visible=0.9,
+                                                            roi_dir=roi_dir))), count['sprite']
+
+    try:
+        import Augmentation_AL
+        import image_mask_AL
+        import yolo_Au
+        from chain import Chain
+    except Exception as e:
+        yield "batch/al/*", e, 0
+        return
+
+    num_augments = 2
+    yield "batch/augment_dir/frame", (
+        lambda: time_batch(lambda: Augmentation_AL.augment_dir(frames, fresh('augment_dir'), num_augments))), \
+        count['frame']
+
+    def process_split():
+        # process_split 从模块级路径配置读取输入输出目录，测试期间临时替换
+        saved = json.loads(json.dumps([yolo_Au.base_dir, yolo_Au.output_dir]))
+        out = fresh('yolo')
+        yolo_Au.base_dir['images']['train'] = os.path.join(data_root, 'yolo', 'images', 'train')
+        yolo_Au.base_dir['labels']['train'] = os.path.join(data_root, 'yolo', 'labels', 'train')
+        yolo_Au.output_dir['images']['train'] = os.path.join(out, 'images')
+        yolo_Au.output_dir['labels']['train'] = os.path.join(out, 'labels')
+        try:
+            yolo_Au.process_split('train', augment=True, Au_num=num_augments)
+        finally:
+            for current, original in zip([yolo_Au.base_dir, yolo_Au.output_dir], saved):
+                current.update(original)
+    yield "batch/process_split/frame", (lambda: time_batch(process_split)), count['yolo']
+
+    yield "batch/batch_overlay/sprite", (
+        lambda: time_batch(lambda: image_mask_AL.batch_overlay(backgrounds, sprites, fresh('overlay'),
+                                                               min_scale=0.6, max_scale=1.1, min_visible=0.9,
+                                                               num_augments=num_augments))), count['sprite']
+    yield "batch/chain_resize_pixelate_composite/photo", (
+        lambda: time_batch(lambda: Chain().resize(160, 160).pixelate(3)
+                           .composite(backgrounds, 0.6, 1.1, 0.9, num_augments)
+                           .albumentations(image_mask_AL.global_aug_pipeline)
+                           .run(photos, fresh('chain')))), count['photo']
+
+
+####################运行与对比###########################################
+def run(out_path, data_dir=None, quick=False, pattern=None, seed=0):
+    data_root = make_dataset(data_dir or os.path.join(tempfile.gettempdir(), 'augmentation_bench_data'), quick, seed)
+    out_root = tempfile.mkdtemp(prefix='augmentation_bench_out_')
+    results, skipped = {}, {}
+    try:
+        for cases in (primitive_cases(data_root, quick), albumentations_cases(data_root, quick),
+                      batch_cases(data_root, out_root, quick)):
+            for name, case, images in cases:
+                if pattern and not re.search(pattern, name):
+                    continue
+                if isinstance(case, Exception):
+                    skipped[name] = f"{type(case).__name__}: {case}"
+                    print(f"跳过 {name}: {skipped[name]}")
+                    continue
+                # 每个用例前重置随机状态，随机增强的执行路径可复现
+                random.seed(seed)
+                np.random.seed(seed)
+                latencies, wall, peak_rss = case()
+                results[name] = summarize(latencies, images, wall, peak_rss)
+                r = results[name]
+                p50 = f"{r['p50_ms']:.3f} ms" if 'p50_ms' in r else '-'
+                print(f"{name:55s} {r['images_per_sec']:>10.1f} img/s   p50 {p50:>12s}   RSS {r['peak_rss_mb']} MB")
+    finally:
+        shutil.rmtree(out_root, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'opencv': cv2.__version__,
+            'opencv_threads': cv2.getNumThreads(),
+            'numpy': np.__version__,
+            'quick': quick,
+            'filter': pattern,
+            'seed': seed,
+        },
+        'results': results,
+        'skipped': skipped,
+    }
+    with open(out_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存到 {out_path}")
+    return report
+
+def compare(baseline, current, threshold=0.1):
+    """
+    逐个用例对比吞吐和 p50 延迟，变差超过 threshold（比例）的用例视为回退
+    :return: 回退的用例名列表
+    """
+    regressions = []
+    base_results, cur_results = baseline['results'], current['results']
+    print(f"{'用例':55s} {'基线 img/s':>12s} {'当前 img/s':>12s} {'变化':>8s}")
+    for name in sorted(set(base_results) & set(cur_results)):
+        base, cur = base_results[name], cur_results[name]
+        if not base.get('images_per_sec') or not cur.get('images_per_sec'):
+            continue
+        ratio = cur['images_per_sec'] / base['images_per_sec']
+        slower = ratio < 1 - threshold
+        if base.get('p50_ms') and cur.get('p50_ms'):
+            slower = slower or cur['p50_ms'] > base['p50_ms'] * (1 + threshold)
+        flag = '  <-- 回退' if slower else ''
+        print(f"{name:55s} {base['images_per_sec']:>12.1f} {cur['images_per_sec']:>12.1f} {ratio - 1:>+8.1%}{flag}")
+        if slower:
+            regressions.append(name)
+    missing = sorted(set(base_results) - set(cur_results))
+    if current.get('meta', {}).get('filter'):
+        print(f"当前结果使用了 --filter，{len(missing)} 个基线用例未运行")
+    else:
+        for name in missing:
+            print(f"{name:55s} 当前结果中缺失")
+    for name in sorted(set(cur_results) - set(base_results)):
+        print(f"{name:55s} 新增用例，无基线")
+    if baseline.get('meta', {}).get('quick') != current.get('meta', {}).get('quick'):
+        print("注意: 基线与当前结果的 quick 模式不同，数据规模不一致")
+    print(f"共 {len(regressions)} 个用例回退（阈值 {threshold:.0%}）")
+    return regressions
+
+def _load(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="数据增强性能基准测试",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    sub = parser.add_subparsers(dest='command', required=True)
+    run_parser = sub.add_parser('run', help="运行基准测试并保存 JSON")
+    run_parser.add_argument("--out", default="bench.json", help="结果 JSON 路径")
+    run_parser.add_argument("--data-dir", default=None, help="合成数据集目录，默认放在系统临时目录，可重复使用")
+    run_parser.add_argument("--quick", action="store_true", help="快速模式：更少的图片和重复次数")
+    run_parser.add_argument("--filter", default=None, help="只运行名称匹配该正则的用例")
+    run_parser.add_argument("--seed", type=int, default=0, help="合成数据与随机增强的种子")
+    run_parser.add_argument("--baseline", default=None, help="运行后与该基线 JSON 对比")
+    run_parser.add_argument("--threshold", type=float, default=0.1, help="回退阈值（比例）")
+    compare_parser = sub.add_parser('compare', help="对比两份结果，标记回退")
+    compare_parser.add_argument("baseline", help="基线 JSON")
+    compare_parser.add_argument("current", help="当前 JSON")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="回退阈值（比例）")
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        report = run(args.out, args.data_dir, args.quick, args.filter, args.seed)
+        if args.baseline is None:
+            return
+        regressions = compare(_load(args.baseline), report, args.threshold)
+    else:
+        regressions = compare(_load(args.baseline), _load(args.current), args.threshold)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+'''
+    预处理阶段的内存串联
+    原流程每个阶段都把结果写成 JPEG、下一阶段再读回来：
+        YASUO -> smartcar26_160 -> pixelate_image -> smartcar26_160_pixelated -> batch_overlay -> ...
+    每多一个阶段就多一次有损编码和一次解码，JPEG 损失逐级叠加。
+    Chain 把 缩放、像素化、正方形、合成、albumentations 增强 等阶段在内存中串起来，
+    每张源图只解码一次，只有最终结果和显式指定的检查点（checkpoint）写盘
+
+    用法:
+        Chain().resize(160, 160).pixelate(3).checkpoint('../Datasets/smartcar26_160_pixelated') \
+               .composite('../Datasets/background', num_augments=10) \
+               .albumentations(global_aug_pipeline) \
+               .run('../smartcar26', '../Datasets/smartcar26_160_pixelated_masked_AL')
+'''
+import os
+from functools import partial
+
+import cv2
+
+from Augmentation_CV import OPS, _decode_size, _normalize_ops, _read_image
+from compositing import load_background
+from manifest import Manifest, PendingRecord, imwrite_or_raise
+from pipeline import run_pipeline
+from sprites import SpritePyramid
+
+
+class _Composite:
+    """合成阶段：把当前图片作为小图，贴到每张背景上各生成 num_augments 张（见 image_mask_AL.overlay_once）"""
+
+    def __init__(self, backgrounds_dir, min_scale, max_scale, min_visible, num_augments):
+        from image_mask_AL import check_background_names, find_images  # 用到合成阶段时才导入 albumentations
+        self.bg_paths = sorted(find_images(backgrounds_dir))
+        check_background_names(self.bg_paths, backgrounds_dir)
+        self.backgrounds_dir = backgrounds_dir
+        self.params = {'min_scale': min_scale, 'max_scale': max_scale, 'min_visible': min_visible}
+        self.num_augments = num_augments
+        self._backgrounds = None
+
+    def __call__(self, img, name):
+        from image_mask_AL import background_name, overlay_once
+        if self._backgrounds is None:
+            # 背景只解码一次，所有小图共用
+            self._backgrounds = [(background_name(bg_path, self.backgrounds_dir), load_background(bg_path))
+                                 for bg_path in self.bg_paths]
+        # 金字塔在所有背景、所有增强序号之间共用
+        sprite = SpritePyramid(cv2.cvtColor(img, cv2.COLOR_BGR2BGRA))
+        pic_name = os.path.splitext(name)[0]
+        for bg_name, background in self._backgrounds:
+            for aug_idx in range(self.num_augments):
+                cv_image = overlay_once(background, sprite, **self.params)
+                if cv_image is None:
+                    print(f"无法为 {name} 找到满足 min_visible={self.params['min_visible']} 的位置")
+                    continue
+                # 与 batch_overlay 的命名相同
+                yield f"{bg_name}_{pic_name}_aug{aug_idx}.jpg", cv_image
+
+
+def _albumentations(pipeline, img, name):
+    # 与 batch_overlay 一致，按 BGR 数组传给增强管道，文件名不变
+    return [(name, pipeline(image=img)['image'])]
+
+
+class Chain:
+    """
+    阶段链。每个阶段的签名与 Augmentation_CV.OPS 相同：stage(图像, 文件名) -> [(新文件名, 新图像), ...]，
+    一个阶段可以产生多个变体（如合成阶段每张背景、每个增强序号各一张），后续阶段对每个变体继续执行。
+    图像在阶段之间以 BGR uint8 数组传递，输出文件名与逐阶段写盘时相同
+    """
+
+    def __init__(self):
+        # [(阶段函数或 None, 描述)]，阶段函数为 None 表示检查点，描述用于输出清单
+        self.stages = []
+
+    def op(self, name, **params):
+        """追加 Augmentation_CV.OPS 中的任意操作，如 op('flip')、op('photometric', chains={...})"""
+        (name, params), = _normalize_ops([(name, params)])
+        self.stages.append((partial(OPS[name], **params), {'op': name, **params}))
+        return self
+
+    def resize(self, target_width=800, target_height=600):
+        """缩放，等价于 YASUO"""
+        return self.op('resize', target_width=target_width, target_height=target_height)
+
+    def pixelate(self, pixel_size=10):
+        """像素化，等价于 pixelate_image"""
+        return self.op('pixelate', pixel_size=pixel_size)
+
+    def square(self):
+        """白边补成正方形，等价于 Square_image"""
+        return self.op('square')
+
+    def composite(self, backgrounds_dir, min_scale=0.3, max_scale=1.7, min_visible=0.75, num_augments=3):
+        """合成到背景上（不含全局增强），参数同 image_mask_AL.batch_overlay"""
+        stage = _Composite(backgrounds_dir, min_scale, max_scale, min_visible, num_augments)
+        self.stages.append((stage, {'op': 'composite', 'backgrounds': stage.bg_paths, **stage.params,
+                                    'num_augments': num_augments}))
+        return self
+
+    def albumentations(self, pipeline):
+        """对每个变体执行一次 albumentations 增强管道，如 image_mask_AL.global_aug_pipeline"""
+        self.stages.append((partial(_albumentations, pipeline), {'op': 'albumentations', 'pipeline': repr(pipeline)}))
+        return self
+
+    def checkpoint(self, savepath):
+        """把当前阶段的结果另存到 savepath（目录结构与源目录相同），链继续在内存中执行"""
+        self.stages.append((None, {'checkpoint': os.path.abspath(savepath)}))
+        return self
+
+    def _outputs(self, img, name, rel_dir, savepath, i=0):
+        """深度优先执行第 i 个及之后的阶段，逐个生成写任务 (保存路径, 图像)，扇出的变体不会同时驻留内存"""
+        if i == len(self.stages):
+            yield os.path.join(savepath, rel_dir, name), img
+            return
+        stage, desc = self.stages[i]
+        if stage is None:
+            yield os.path.join(desc['checkpoint'], rel_dir, name), img
+            yield from self._outputs(img, name, rel_dir, savepath, i + 1)
+            return
+        for new_name, img_out in stage(img, name):
+            yield from self._outputs(img_out, new_name, rel_dir, savepath, i + 1)
+
+    def _params(self):
+        # 清单参数：缩放文件名中的日期不参与比对，与 run_ops 一致
+        return {'chain': [{k: v for k, v in desc.items() if k != 'date'} for _, desc in self.stages]}
+
+    def run(self, rootpath, savepath, reduced_decode=True, io_threads=4, resume=False):
+        """
+        对 rootpath 下的每张图片执行整条链，最终结果按相对路径保存到 savepath
+
+        参数:
+            rootpath: 源图片目录
+            savepath: 最终结果的保存目录
+            reduced_decode: 第一个阶段是缩放时，大 JPEG 按目标尺寸缩小解码（见 Augmentation_CV.plan_reduced_decode）
+            io_threads: 读取、写入线程数，与计算重叠执行（见 pipeline.py）；0 为串行
+            resume: 在 savepath 下维护输出清单（见 manifest.py），跳过源文件未变、链未改且输出仍在的图片
+        """
+        first = [(desc['op'], desc) for _, desc in self.stages[:1] if 'op' in desc]
+        decode_size = _decode_size(first) if reduced_decode else None
+        manifest = Manifest(savepath) if resume else None
+        params = self._params()
+
+        tasks = []
+        for a, _, c in os.walk(rootpath):
+            for file_i in sorted(c):
+                file_i_path = os.path.join(a, file_i)
+                if manifest is None or not manifest.is_done([file_i_path], params):
+                    tasks.append((file_i_path, os.path.relpath(a, rootpath), file_i))
+        print(f"待处理图片: {len(tasks)} 张，阶段数: {len(self.stages)}")
+
+        def compute(task, img_i):
+            file_i_path, rel_dir, file_i = task
+            print(f"处理文件: {file_i_path}")
+            if img_i is None:
+                print(f"无法读取文件: {file_i_path}")
+                return
+            # 全部输出由写线程写成功后才记入清单
+            pending = PendingRecord(manifest, [file_i_path], params)
+            for save_file_path, img_out in self._outputs(img_i, file_i, rel_dir, savepath):
+                pending.add(save_file_path)
+                yield save_file_path, img_out, pending
+            pending.seal()
+
+        def write(job):
+            save_file_path, img_out, pending = job
+            os.makedirs(os.path.dirname(save_file_path), exist_ok=True)
+            imwrite_or_raise(save_file_path, img_out)
+            pending.done()
+
+        def on_error(task, e):
+            print(f"处理失败：{task[0]} | 错误：{str(e)}")
+
+        try:
+            run_pipeline(tasks, read=lambda task: _read_image(task[0], decode_size), compute=compute, write=write,
+                         readers=io_threads, writers=io_threads, on_error=on_error)
+        finally:
+            if manifest is not None:
+                manifest.close()
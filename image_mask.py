@@ -1,7 +1,15 @@
 import os
 import random
+import cv2
+import numpy as np
 from PIL import Image
 from datetime import datetime
+from compositing import composite, load_background, pil_to_bgra
+from manifest import imwrite_atomic
+from placement import Placement, rotated_size
+
+# 与 PIL Image.save 的 JPEG 默认质量一致
+JPEG_QUALITY = 75
 
 def find_images(root_dir):
     """递归查找所有子目录中的图片文件"""
@@ -11,31 +19,48 @@ def find_images(root_dir):
             if f.lower().endswith(img_ext):
                 yield os.path.join(dirpath, f)
 
+def load_roi_mask(path):
+    """读取 ROI 掩码（单通道，非 0 为可放置区域），路径中含中文时也能打开"""
+    mask = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if mask is None:
+        raise ValueError(f"无法读取 ROI 掩码: {path}")
+    return mask
+
 def batch_overlay(backgrounds_dir=r'dataset\background', 
                  pics_root=r'dataset\stage2',
                  output_root=r'dataset\stage3',
                  min_scale=0.3,
                  max_scale=1.7,
                  min_visible=0.75,
-                 center_mode=False):
+                 center_mode=False,
+                 roi_dir=None):
     """
     支持缩放、旋转和位置调整的批量处理
     
     参数:
-    min_visible - 可见区域最小比例 (0.0~1.0)
+    min_visible - 可见区域最小比例 (0.0~1.0)，按旋转后的外接框计算
     center_mode - True: 小图居中无旋转变换; False: 随机变换模式
+    roi_dir - 可选的 ROI 掩码目录，掩码与背景同名（扩展名任意），非 0 为可放置区域，
+              随机模式下可见面积只计算落在掩码内的部分；没有对应掩码的背景使用整张图
+    随机模式直接求出满足 min_visible 的全部位置并均匀抽取（见 placement.py），没有可行位置时跳过该组合
     """
     
     # 获取所有背景和小图路径
     bg_paths = list(find_images(backgrounds_dir))
     pic_paths = list(find_images(pics_root))
+    roi_paths = {}
+    if roi_dir is not None:
+        roi_paths = {os.path.splitext(os.path.basename(p))[0]: p for p in find_images(roi_dir)}
     
     # 处理每个组合
     for bg_path in bg_paths:
         try:
-            base_img = Image.open(bg_path).convert('RGBA')
-            bg_w, bg_h = base_img.size
+            background = load_background(bg_path)  # BGR 数组，所有小图共用
+            bg_h, bg_w = background.shape[:2]
             bg_name = os.path.splitext(os.path.basename(bg_path))[0]
+            # 放置求解器：ROI 掩码的积分图每张背景只算一次
+            roi_path = roi_paths.get(bg_name)
+            placer = Placement(bg_w, bg_h, load_roi_mask(roi_path) if roi_path else None)
             
             for pic_path in pic_paths:
                 # 计算输出路径
@@ -74,51 +99,42 @@ def batch_overlay(backgrounds_dir=r'dataset\background',
                             max(1, int(small_img.width * scale)),
                             max(1, int(small_img.height * scale))
                         )
-                        scaled_img = small_img.resize(new_size, Image.LANCZOS)
                         
-                        # 随机旋转
+                        # 随机旋转：先只计算旋转后的外接框尺寸，找到位置后再做缩放和旋转
                         angle = random.uniform(0, 360)
+                        rw, rh = rotated_size(*new_size, angle)
+                        
+                        # 位置范围
+                        x_min = max(-int(rw * 0.3), -rw + int(bg_w * 0.25))
+                        x_max = min(bg_w - int(rw * 0.7), bg_w - int(rw * 0.25))
+                        y_min = max(-int(rh * 0.3), -rh + int(bg_h * 0.25))
+                        y_max = min(bg_h - int(rh * 0.7), bg_h - int(rh * 0.25))
+                        
+                        # 确保位置范围有效
+                        if x_min > x_max:
+                            x_min, x_max = -rw, bg_w
+                        if y_min > y_max:
+                            y_min, y_max = -rh, bg_h
+                        
+                        # 智能定位：在范围内满足 min_visible 的全部位置中均匀抽取，与逐个重抽的分布相同
+                        pos = placer.sample(rw, rh, min_visible, x_range=(x_min, x_max), y_range=(y_min, y_max))
+                        if pos is None:
+                            print(f"无法为 {pic_path} 找到满足 min_visible={min_visible} 的位置，跳过")
+                            continue
+                        x, y = pos
+                        
+                        scaled_img = small_img.resize(new_size, Image.LANCZOS)
                         rotated_img = scaled_img.rotate(
                             angle,
                             expand=True,
                             resample=Image.BICUBIC,
                             fillcolor=(0, 0, 0, 0)
                         )
-                        rw, rh = rotated_img.size
-                        
-                        # 智能定位（根据min_visible参数控制可见比例）
-                        valid_pos = False
-                        for _ in range(100):
-                            # 动态计算位置范围
-                            x_min = max(-int(rw * 0.3), -rw + int(bg_w * 0.25))
-                            x_max = min(bg_w - int(rw * 0.7), bg_w - int(rw * 0.25))
-                            y_min = max(-int(rh * 0.3), -rh + int(bg_h * 0.25))
-                            y_max = min(bg_h - int(rh * 0.7), bg_h - int(rh * 0.25))
-                            
-                            # 确保位置范围有效
-                            if x_min > x_max:
-                                x_min, x_max = -rw, bg_w
-                            if y_min > y_max:
-                                y_min, y_max = -rh, bg_h
-                            
-                            x = random.randint(x_min, x_max)
-                            y = random.randint(y_min, y_max)
-                            
-                            # 计算可见区域
-                            visible_w = min(x+rw, bg_w) - max(x, 0)
-                            visible_h = min(y+rh, bg_h) - max(y, 0)
-                            if visible_w > 0 and visible_h > 0:
-                                visible_area = visible_w * visible_h
-                                # 使用参数控制可见比例
-                                if visible_area >= min_visible * rw * rh:
-                                    valid_pos = True
-                                    break
                     
-                    # 合成图像
-                    composite = Image.new('RGBA', (bg_w, bg_h))
-                    composite.paste(base_img, (0,0))
-                    composite.alpha_composite(rotated_img, (x, y))
-                    composite.convert('RGB').save(output_path)
+                    # 合成图像：复制一次背景，只混合小图覆盖的区域（见 compositing.py）
+                    canvas = composite(background, pil_to_bgra(rotated_img), x, y)
+                    if not imwrite_atomic(output_path, canvas, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]):
+                        raise ValueError("图片编码失败")
                     
                     print(f"生成成功：{output_path}")
                     
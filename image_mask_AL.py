@@ -1,11 +1,21 @@
 import os
+import math
 import random
 import cv2
 import numpy as np
 from PIL import Image
-from datetime import datetime
 import albumentations as A
 from tqdm import tqdm
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from functools import partial
+from pipeline import run_pipeline
+from seeding import task_seed
+from manifest import Manifest, imwrite_atomic, imwrite_or_raise, write_atomic
+from telemetry import NULL_TELEMETRY, open_telemetry
+from sprites import SpriteCache, SpritePyramid, resize_from_level, rotate_sprite
+from background_store import SharedBackgroundStore, attach_background
+from photometric_batch import sprite_color_pipeline
+from compositing import alpha_blend_roi, clip_roi, composite, load_background, pil_to_bgra
 
 def find_images(root_dir):
     """递归查找所有子目录中的图片文件"""
@@ -15,15 +25,11 @@ def find_images(root_dir):
             if f.lower().endswith(img_ext):
                 yield os.path.join(dirpath, f)
 
-# 定义小图增强管道（仅颜色变换，针对 RGB）
-small_aug_pipeline = A.Compose([
-    A.RGBShift(r_shift_limit=(-10, 10), g_shift_limit=(-10, 10), b_shift_limit=(-10, 10), p=0.5),
-    A.RandomBrightnessContrast(p=0.8, brightness_limit=(-0.10, 0.10), contrast_limit=(-0.1, 0.1)),
-    A.HueSaturationValue(hue_shift_limit=(-10, 10), 
-                         sat_shift_limit=(-15, 15), 
-                         val_shift_limit=(-10, 10), 
-                         p=0.7)
-])
+# 定义小图增强管道（仅颜色变换）
+# 用批量颜色增强引擎代替 albumentations，参数与原 RGBShift / RandomBrightnessContrast / HueSaturationValue 相同，
+# 省去每次调用的 Compose 开销；参数见 photometric_batch.SPRITE_COLOR_STAGES（benchmark 共用）。
+# 按 channels='BGR' 直接处理 BGRA 小图，alpha 不参与
+small_aug_pipeline = sprite_color_pipeline()
 
 # 定义专门处理带 Alpha 通道的几何变换管道
 small_geom_pipeline = A.Compose([
@@ -60,28 +66,367 @@ global_aug_pipeline = A.Compose([
     # )
 ])
 
-def apply_small_aug(img_pil_rgba):
-    """对小图应用增强（分层处理颜色与几何变换）"""
-    # 1. 颜色增强阶段：仅对 RGB 部分操作
-    img_cv_rgba = np.array(img_pil_rgba)
-    img_cv_rgb = cv2.cvtColor(img_cv_rgba, cv2.COLOR_RGBA2RGB)
+# 多目标合成（带检测框）使用的全局增强：只含不移动像素的光度变换，标注框保持准确
+detection_aug_pipeline = A.Compose([
+    A.RGBShift(r_shift_limit=(-10, 10), g_shift_limit=(-10, 10), b_shift_limit=(-10, 10), p=0.5),
+    A.HueSaturationValue(hue_shift_limit=(-10, 10), 
+                         sat_shift_limit=(-15, 15), 
+                         val_shift_limit=(-10, 10), 
+                         p=0.7),
+    A.RandomBrightnessContrast(p=0.8, brightness_limit=(-0.10, 0.10), contrast_limit=(-0.1, 0.1)),
+    A.MotionBlur(p=0.1, blur_limit=(3)),
+    A.ISONoise(p=0.2),
+])
+
+def apply_small_aug(img_bgra):
+    """
+    对 BGRA 小图应用增强（分层处理颜色与几何变换），返回新的 BGRA 数组，输入不会被修改
+    小图始终保持 BGRA 布局，不做 RGBA/BGRA 转换，也不经过 PIL
+    """
+    # 1. 颜色增强阶段：只作用于 BGR 三个通道，alpha 原样保留
+    img_bgra = small_aug_pipeline(image=img_bgra, channels='BGR')['image']
+
+    # 2. 几何增强阶段：四个通道一起变换（支持透视后的透明填充）
+    return small_geom_pipeline(image=img_bgra)['image']
+
+def seeded_rng(seed):
+    """用任务种子重置三个 albumentations 管道的随机状态，返回给缩放、旋转、定位使用的 random.Random"""
+    rng = random.Random(seed)
+    for pipeline in (small_aug_pipeline, small_geom_pipeline, global_aug_pipeline):
+        pipeline.set_random_seed(rng.getrandbits(32))
+    return rng
+
+def _image_id(path, root):
+    return os.path.relpath(path, root).replace(os.sep, '/')
+
+def transform_sprite(sprite, min_scale, max_scale, telemetry=None, rng=None):
+    """
+    小图增强、随机缩放、随机旋转
+
+    返回:
+        (变换后的 BGRA 小图, 缩放后的透明边宽度 (左, 上, 右, 下))。
+        小图加载时裁掉了透明边（见 SpritePyramid 的 trim），按原始尺寸定位时需要把这部分加回去
+
+    参数:
+        sprite: 小图的 SpritePyramid（见 sprites.py），也可以直接传 BGRA 数组或 PIL RGBA 图像（不使用金字塔）
+        min_scale, max_scale: 随机缩放倍数范围
+        telemetry: Telemetry 实例，记录 sprite_aug、resize_rotate 两个阶段的耗时
+        rng: 随机数来源（random.Random），None 为全局 random
+    """
+    tm = telemetry or NULL_TELEMETRY
+    rng = rng or random
+
+    if isinstance(sprite, Image.Image):
+        sprite = pil_to_bgra(sprite)
+    if not isinstance(sprite, SpritePyramid):
+        sprite = SpritePyramid(sprite, max_levels=1, trim=True)
+
+    # 随机缩放：先确定缩放倍数，取金字塔中分辨率不低于目标的最小一层，
+    # 在该层上做小图增强，最后只需一次不超过 2 倍的廉价缩放
+    scale = rng.uniform(min_scale, max_scale)
+    level, level_img = sprite.level_for(scale)
+
+    # 应用小图增强（包含颜色和透视变换）
+    # 每次循环重新应用以保证随机性。这里有意逐张调用，不把同一小图的多个增强序号堆成一批：
+    # 各序号的缩放倍数不同，取到的金字塔层尺寸不同，无法堆叠；并且每个样本的随机状态只由自己的任务种子决定
+    # （见 seeded_rng），续跑只补缺失的序号、regenerate_sample 单独重算时结果才与整批生成时相同
+    with tm.stage('sprite_aug'):
+        current_small_img = apply_small_aug(level_img)
+
+    margins = tuple(int(round(m * scale)) for m in sprite.margins)
+    level_scale = scale * (1 << level)
+    h, w = current_small_img.shape[:2]
+    new_size = (int(w * level_scale), int(h * level_scale))
+    with tm.stage('resize_rotate'):
+        scaled_img = resize_from_level(current_small_img, new_size)
+
+    # 随机旋转
+    angle = rng.choice([0, 90, 180, 270])
+    angle1 = rng.uniform(-10, 10)
+    angle = 0
+    angle1 = 0
+    angle = angle + angle1
+    with tm.stage('resize_rotate'):
+        rotated_img = rotate_sprite(scaled_img, angle)
+    # 透明边按未旋转处理（当前角度固定为 0）
+    return rotated_img, margins
+
+def random_position(rw, rh, bg_w, bg_h, min_visible, rng=None):
+    """
+    在背景内随机选取 rw × rh 小图的左上角，宽和高方向上都至少有 min_visible 的长度落在背景内
+    :return: (x, y)
+    """
+    rng = rng or random
+
+    # 使用整个背景作为放置区域
+    roi_x, roi_y, roi_w, roi_h = (0, 0, bg_w, bg_h)
+
+    # 重构可见度逻辑：
+    # min_visible 控制图片在 ROI (当前为全图) 内的最小边长比例
+    # 例如 0.9 表示图片在宽和高方向上至少有 90% 的长度落在背景内
     
-    # 应用颜色增强
-    augmented_color = small_aug_pipeline(image=img_cv_rgb)
-    img_cv_rgb_aug = augmented_color['image']
+    # 计算图片在左/上侧允许超出的最大长度
+    max_offset_x = rw * (1 - min_visible)
+    max_offset_y = rh * (1 - min_visible)
     
-    # 合并回 RGBA
-    aug_rgba_data = cv2.cvtColor(img_cv_rgb_aug, cv2.COLOR_RGB2RGBA)
-    aug_rgba_data[:, :, 3] = img_cv_rgba[:, :, 3]  # 保留原始 Alpha
+    # 计算左上角坐标 x, y 的允许范围：
+    # 最小值：图片左边缘在背景左边缘左侧 max_offset_x 处
+    # 最大值：图片右边缘在背景右边缘右侧 max_offset_x 处 (即 x = bg_w - rw + max_offset_x)
+    x_min = roi_x - max_offset_x
+    x_max = roi_x + roi_w - rw + max_offset_x
     
-    # 2. 几何增强阶段：对 BGRA 操作（支持透视后的透明填充）
-    img_cv_bgra = cv2.cvtColor(aug_rgba_data, cv2.COLOR_RGBA2BGRA)
-    augmented_geom = small_geom_pipeline(image=img_cv_bgra)
-    img_cv_bgra_aug = augmented_geom['image']
+    y_min = roi_y - max_offset_y
+    y_max = roi_y + roi_h - rh + max_offset_y
     
-    # 转换回 PIL RGBA
-    img_cv_rgba_final = cv2.cvtColor(img_cv_bgra_aug, cv2.COLOR_BGRA2RGBA)
-    return Image.fromarray(img_cv_rgba_final)
+    # 如果图片太大且 min_visible 要求很高导致逻辑冲突，则居中处理
+    if x_min > x_max:
+        x_min = x_max = roi_x + (roi_w - rw) / 2
+    if y_min > y_max:
+        y_min = y_max = roi_y + (roi_h - rh) / 2
+
+    # 随机选择左上角起始位置
+    return int(rng.uniform(x_min, x_max)), int(rng.uniform(y_min, y_max))
+
+def overlay_once(background, sprite, min_scale, max_scale, min_visible, telemetry=None, rng=None):
+    """
+    把小图增强、随机缩放后贴到背景上，生成一张合成图（不含全局增强）
+
+    参数:
+        background: 背景图（BGR uint8 数组，见 compositing.load_background），不会被修改
+        sprite: 小图的 SpritePyramid（见 sprites.py），也可以直接传 BGRA 数组或 PIL RGBA 图像（不使用金字塔）
+        min_scale, max_scale, min_visible: 同 batch_overlay
+        telemetry: Telemetry 实例，记录 sprite_aug、resize_rotate、composite 三个阶段的耗时
+        rng: 缩放、旋转、定位使用的 random.Random（见 seeded_rng），None 为全局 random
+
+    返回:
+        合成图（OpenCV BGR 数组），找不到满足 min_visible 的位置时为 None
+    """
+    tm = telemetry or NULL_TELEMETRY
+    bg_h, bg_w = background.shape[:2]
+
+    rotated_img, (left, top, right, bottom) = transform_sprite(sprite, min_scale, max_scale, tm, rng)
+    rh, rw = rotated_img.shape[:2]
+    
+    # 智能定位 - 专门在ROI区域内放置小图
+    # 按含透明边的原始尺寸定位，再贴上裁剪后的小图，放置位置与不裁剪时相同
+    x, y = random_position(rw + left + right, rh + top + bottom, bg_w, bg_h, min_visible, rng)
+
+    with tm.stage('composite'):
+        # 复制一次背景，只在小图覆盖的区域内做 alpha 混合（见 compositing.py）
+        return composite(background, rotated_img, x + left, y + top)
+
+def _trim_alpha(sprite_bgra):
+    """裁掉四周全透明的行列，全透明时返回 None"""
+    x, y, w, h = cv2.boundingRect(sprite_bgra[..., 3])
+    if w == 0 or h == 0:
+        return None
+    return sprite_bgra[y:y + h, x:x + w]
+
+def pack_once(background, sprites, min_scale, max_scale, min_visible, max_overlap=0.2, max_tries=20,
+              telemetry=None, rng=None):
+    """
+    在一张背景上放置多张小图（不含全局增强），用占用图限制目标之间的遮挡
+
+    参数:
+        background: 背景图（BGR uint8 数组），不会被修改
+        sprites: 小图列表（SpritePyramid、BGRA 数组或 PIL RGBA 图像）
+        min_scale, max_scale, min_visible: 同 batch_overlay
+        max_overlap: 两个目标的重叠像素数不超过其中任一目标可见像素数的该比例（按 alpha 逐像素计算）
+        max_tries: 每张小图随机定位的最多尝试次数，都不满足时跳过该小图
+        telemetry: Telemetry 实例
+        rng: 随机数来源（random.Random），None 为全局 random
+
+    返回:
+        (合成图, [(小图序号, x0, y0, x1, y1), ...])，框为画布内 alpha 非零像素的紧致外接框（像素坐标，右下不含）
+    """
+    tm = telemetry or NULL_TELEMETRY
+    canvas = background.copy()
+    bg_h, bg_w = canvas.shape[:2]
+    occupancy = np.zeros((bg_h, bg_w), np.uint16)  # 0 为空，k 为第 k 个已放置的目标
+    areas = []  # 已放置目标的可见像素数
+    boxes = []
+
+    for idx, sprite in enumerate(sprites):
+        # 仿射、旋转可能重新引入透明边，贴图前再裁一次
+        sprite_bgra = _trim_alpha(transform_sprite(sprite, min_scale, max_scale, tm, rng)[0])
+        if sprite_bgra is None:
+            continue
+        h, w = sprite_bgra.shape[:2]
+        opaque = sprite_bgra[..., 3] > 0
+
+        for _ in range(max_tries):
+            x, y = random_position(w, h, bg_w, bg_h, min_visible, rng)
+            roi = clip_roi(canvas.shape, sprite_bgra.shape, x, y)
+            if roi is None:
+                continue
+            dst, src = roi
+            mask = opaque[src]
+            area = int(np.count_nonzero(mask))
+            if area == 0:
+                continue
+            # 与每个已放置目标重叠的像素数（下标 0 为空白）
+            hits = np.bincount(occupancy[dst][mask], minlength=len(areas) + 1)[1:]
+            if (hits > max_overlap * np.minimum(area, areas)).any():
+                continue
+            break
+        else:
+            continue
+
+        with tm.stage('composite'):
+            alpha_blend_roi(canvas, sprite_bgra, x, y)
+        occupancy[dst][mask] = len(areas) + 1
+        areas.append(area)
+        bx, by, bw, bh = cv2.boundingRect(mask.astype(np.uint8))
+        x0, y0 = dst[1].start + bx, dst[0].start + by
+        boxes.append((idx, x0, y0, x0 + bw, y0 + bh))
+    return canvas, boxes
+
+def yolo_label_text(boxes, class_ids, img_w, img_h):
+    """像素框 [(类别下标, x0, y0, x1, y1)] -> YOLO 标签文本（类别 中心x 中心y 宽 高，均已归一化）"""
+    lines = []
+    for (idx, x0, y0, x1, y1) in boxes:
+        coords = [(x0 + x1) / 2 / img_w, (y0 + y1) / 2 / img_h, (x1 - x0) / img_w, (y1 - y0) / img_h]
+        lines.append(f"{class_ids[idx]} {' '.join(f'{v:.6f}' for v in coords)}\n")
+    return ''.join(lines)
+
+def render_sample(background, sprite, min_scale, max_scale, min_visible, seed=None, telemetry=None):
+    """
+    生成一张最终样本：合成（overlay_once）+ 全局增强
+
+    参数:
+        seed: 任务种子（见 seeding.task_seed），同一种子总是得到逐位相同的结果；None 为使用全局随机状态
+        其余参数同 overlay_once
+
+    返回:
+        增强后的 BGR 数组，找不到满足 min_visible 的位置时为 None
+    """
+    tm = telemetry or NULL_TELEMETRY
+    rng = seeded_rng(seed) if seed is not None else None
+    # 合成（小图增强、随机缩放与定位）
+    cv_image = overlay_once(background, sprite, min_scale, max_scale, min_visible, tm, rng)
+    if cv_image is None:
+        return None
+    # 应用全局数据增强
+    with tm.stage('global_aug'):
+        return global_aug_pipeline(image=cv_image)['image']
+
+def regenerate_sample(bg_path, pic_path, aug_idx, seed, backgrounds_dir, pics_root,
+                      min_scale=0.3, max_scale=1.7, min_visible=0.75):
+    """
+    单独重新生成 batch_overlay(seed=seed) 输出中的某一张，用于排查有问题的样本；
+    参数须与生成时一致，结果与批量生成时逐位相同
+    """
+    seed = task_seed(seed, _image_id(bg_path, backgrounds_dir), _image_id(pic_path, pics_root), aug_idx)
+    return render_sample(load_background(bg_path), SpriteCache().load(pic_path),
+                         min_scale, max_scale, min_visible, seed=seed)
+
+def background_name(bg_path, backgrounds_dir):
+    """输出文件名中的背景名：背景相对 backgrounds_dir 的路径去掉扩展名，目录分隔符换成 '_'（子目录中的同名背景不会重名）"""
+    return os.path.splitext(_image_id(bg_path, backgrounds_dir))[0].replace('/', '_')
+
+def check_background_names(bg_paths, backgrounds_dir):
+    """两张背景的输出名相同（如 a/1.jpg 与 a/1.png）时抛出 ValueError，否则输出会互相覆盖、清单却都记为完成"""
+    seen = {}
+    for bg_path in bg_paths:
+        bg_name = background_name(bg_path, backgrounds_dir)
+        if bg_name in seen:
+            raise ValueError(f"背景 {seen[bg_name]} 与 {bg_path} 的输出名都是 {bg_name}，请重命名其中一张")
+        seen[bg_name] = bg_path
+
+def _output_path(output_root, backgrounds_dir, pics_root, bg_path, pic_path, aug_idx):
+    # 文件名由背景、小图和增强序号唯一确定，重跑时覆盖而不是产生重复
+    rel_path = os.path.relpath(pic_path, pics_root)
+    bg_name = background_name(bg_path, backgrounds_dir)
+    pic_name = os.path.splitext(os.path.basename(pic_path))[0]
+    return os.path.join(output_root, os.path.dirname(rel_path), f"{bg_name}_{pic_name}_aug{aug_idx}.jpg")
+
+# 子进程内的小图缓存，由 _init_overlay_worker 在进程启动时创建；背景通过共享内存附加（见 background_store.py）
+_worker_sprites = None
+
+def _init_overlay_worker(sprite_cache_mb):
+    global _worker_sprites
+    # 每个进程只保留一个 OpenCV 线程，避免 进程数 × OpenCV线程数 的过度订阅
+    cv2.setNumThreads(1)
+    _worker_sprites = SpriteCache(sprite_cache_mb * 2 ** 20)
+
+def _overlay_task(task, backgrounds_dir, pics_root, output_root, params, seed):
+    """子进程中执行一个 (背景, 小图) 组合的若干增强序号，直接写盘，只把输出路径传回主进程"""
+    handle, bg_path, pic_path, aug_ids = task
+    done = []
+    try:
+        background = attach_background(handle)
+        sprite = _worker_sprites.get(pic_path)
+        bg_id, pic_id = _image_id(bg_path, backgrounds_dir), _image_id(pic_path, pics_root)
+        for aug_idx in aug_ids:
+            img = render_sample(background, sprite, **params, seed=task_seed(seed, bg_id, pic_id, aug_idx))
+            if img is None:
+                print(f"无法为 {pic_path} 找到满足 min_visible={params['min_visible']} 的位置")
+                continue
+            output_path = _output_path(output_root, backgrounds_dir, pics_root, bg_path, pic_path, aug_idx)
+            if imwrite_atomic(output_path, img):
+                done.append((aug_idx, output_path))
+            else:
+                print(f"图片编码失败: {output_path}")
+    except Exception as e:
+        return task, done, str(e)
+    return task, done, None
+
+def _class_of(pic_path, pics_root):
+    # 类别为 pics_root 下的第一级目录名，直接放在 pics_root 下的小图类别为 ''
+    parts = _image_id(pic_path, pics_root).split('/')
+    return parts[0] if len(parts) > 1 else ''
+
+def plan_samples(bg_paths, pic_paths, pics_root, num_augments, target_count=None, per_class=None, seed=None):
+    """
+    按预算采样 (背景, 小图, 增强序号)，替代 背景 × 小图 × num_augments 的全组合
+
+    参数:
+        target_count: 总样本数，平均分到各类别（小图的第一级目录）
+        per_class: 每个类别的样本数，与 target_count 二选一
+        seed: 采样种子，同样的输入和种子总是选出同样的组合（断点续跑依赖这一点）
+
+    返回:
+        {背景路径: {小图路径: [增强序号, ...]}}，按背景分组，每张背景只在处理自己的那组时解码
+
+    每个类别内先用完所有 (背景, 小图) 组合，再用下一个增强序号，不会重复；
+    第 k 个样本取 小图[k % P]、背景[(起点 + k + k // L) % B]（L 为 P、B 的最小公倍数，每 L 个样本背景多错开一位，
+    前 P*B 个样本恰好覆盖全部组合）。小图与背景都轮流使用，选中次数基本均衡；起点随已分配的样本数后移，
+    背景在类别之间也保持均衡
+    """
+    rng = random.Random(0 if seed is None else seed)
+    bgs = sorted(bg_paths)
+    rng.shuffle(bgs)
+    classes = {}
+    for pic_path in sorted(pic_paths):
+        classes.setdefault(_class_of(pic_path, pics_root), []).append(pic_path)
+
+    names = sorted(classes)
+    if per_class is not None:
+        quotas = {name: per_class for name in names}
+    else:
+        # 余数随机分给部分类别
+        base, extra = divmod(target_count, len(names)) if names else (0, 0)
+        lucky = set(rng.sample(names, extra))
+        quotas = {name: base + (name in lucky) for name in names}
+
+    plan = {}
+    start = 0
+    for name in names:
+        pics = classes[name][:]
+        rng.shuffle(pics)
+        P, B = len(pics), len(bgs)
+        capacity = P * B * num_augments
+        quota = quotas[name]
+        if quota > capacity:
+            print(f"类别 {name or '(根目录)'} 最多只有 {capacity} 个不重复组合，少于配额 {quota}")
+            quota = capacity
+        L = math.lcm(P, B)
+        for k in range(quota):
+            bg_path = bgs[(start + k + k // L) % B]
+            aug_idx = k // (P * B)
+            plan.setdefault(bg_path, {}).setdefault(pics[k % P], []).append(aug_idx)
+        start += quota
+    return plan
 
 def batch_overlay(
     backgrounds_dir=r'dataset\background',
@@ -90,7 +435,18 @@ def batch_overlay(
     min_scale=0.3,
     max_scale=1.7,
     min_visible=0.75,  # 控制小图在ROI内的可见面积比例
-    num_augments=3
+    num_augments=3,
+    io_threads=4,  # 读取、写入线程数，读写与合成计算重叠执行（见 pipeline.py）；0 为串行
+    resume=False,  # 维护输出清单（见 manifest.py），只生成新增/修改过的 (背景, 小图, 增强序号) 组合
+    telemetry=None,  # 分阶段耗时遥测（见 telemetry.py）：JSON Lines 路径、True（只打印汇总）或 Telemetry 实例
+    sprite_cache_mb=512,  # 小图缓存预算（MB）：小图只解码一次并预生成金字塔，所有背景共用（见 sprites.py）
+    workers=1,  # 并行进程数，1 为单进程，None 为 CPU 核数；多进程时遥测只记录整体吞吐；多目标模式只支持单进程
+    seed=None,  # 全局随机种子：每个 (背景, 小图, 增强序号) 的结果由它唯一确定，与进程数无关（见 seeding.task_seed）；
+                # None 时单进程沿用全局随机状态，多进程随机选取一个并打印出来
+    target_count=None,  # 按预算采样的总样本数（见 plan_samples），None 为生成全部组合
+    per_class=None,  # 按预算采样时每个类别（小图的第一级目录）的样本数，与 target_count 二选一
+    objects_per_canvas=1,  # 大于 1 时每张画布放置多张小图并输出 YOLO 标签（见 pack_once）；预算按目标数计算
+    max_overlap=0.2  # 多目标模式下两个目标之间允许的最大重叠比例
 ):
     # 获取所有背景和小图路径
     bg_paths = list(find_images(backgrounds_dir))
@@ -98,126 +454,262 @@ def batch_overlay(
     
     print(f"找到 {len(bg_paths)} 张背景图片")
     print(f"找到 {len(pic_paths)} 张小图")
-    total_tasks = len(bg_paths) * len(pic_paths) * num_augments
+    if target_count is not None and per_class is not None:
+        raise ValueError("target_count 与 per_class 只能指定一个")
+    check_background_names(bg_paths, backgrounds_dir)
+    # 按预算采样时只生成计划中的组合，否则为 背景 × 小图 × 增强序号 的全组合
+    plan = None
+    if target_count is not None or per_class is not None:
+        plan = plan_samples(bg_paths, pic_paths, pics_root, num_augments, target_count, per_class, seed)
+        bg_paths = [bg_path for bg_path in bg_paths if bg_path in plan]
+        total_tasks = sum(len(aug_ids) for wanted in plan.values() for aug_ids in wanted.values())
+        print(f"按预算采样，使用 {len(bg_paths)} 张背景")
+    else:
+        total_tasks = len(bg_paths) * len(pic_paths) * num_augments
     print(f"总任务量: {total_tasks} 张合成图")
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if objects_per_canvas > 1 and workers > 1:
+        raise ValueError(f"多目标模式（objects_per_canvas={objects_per_canvas}）暂不支持多进程，请使用 workers=1")
+    # 清单参数：增强序号以外影响输出的配置；显式指定的种子也参与比对，换种子后重新生成
+    params = {'min_scale': min_scale, 'max_scale': max_scale, 'min_visible': min_visible}
+    manifest_params = params if seed is None else {**params, 'seed': seed}
+    if seed is None and workers > 1:
+        seed = random.SystemRandom().randrange(2 ** 32)
+        print(f"随机种子: {seed}（传入 seed={seed} 可复现本次结果）")
     
     # 初始化进度条
     pbar = tqdm(total=total_tasks, desc="合成进度", unit="image", dynamic_ncols=True)
 
-    # 处理每个组合
-    for bg_path in bg_paths:
-        try:
-            base_img = Image.open(bg_path).convert('RGBA')
-            bg_w, bg_h = base_img.size
-            bg_name = os.path.splitext(os.path.basename(bg_path))[0]
-            
-            # 使用整个背景作为放置区域
-            roi_x, roi_y, roi_w, roi_h = (0, 0, bg_w, bg_h)
-            
-            for pic_path in pic_paths:
+    manifest = Manifest(output_root) if resume else None
+    tm, own_telemetry = open_telemetry(telemetry)
+    sprite_cache = SpriteCache(sprite_cache_mb * 2 ** 20, telemetry=tm)
+
+    def wanted_for(bg_path):
+        # 该背景要生成的 {小图: 增强序号}
+        return plan[bg_path] if plan is not None else dict.fromkeys(pic_paths, range(num_augments))
+
+    def pending_for(bg_path):
+        # 每张小图待生成的增强序号；已是最新的组合直接计入进度，背景/小图都不再解码
+        pending = {}
+        for pic_path, all_ids in wanted_for(bg_path).items():
+            aug_ids = [aug_idx for aug_idx in all_ids
+                       if manifest is None or
+                       not manifest.is_done([bg_path, pic_path], {**manifest_params, 'aug_idx': aug_idx})]
+            pbar.update(len(all_ids) - len(aug_ids))
+            if aug_ids:
+                pending[pic_path] = aug_ids
+        return pending
+
+    def record(bg_path, pic_path, aug_idx, output_path):
+        if manifest is not None:
+            manifest.record([bg_path, pic_path], {**manifest_params, 'aug_idx': aug_idx}, [output_path])
+
+    try:
+        if objects_per_canvas > 1:
+            _overlay_packed(bg_paths, pic_paths, wanted_for, backgrounds_dir, pics_root, output_root, params,
+                            manifest_params, seed, objects_per_canvas, max_overlap, sprite_cache, manifest,
+                            io_threads, pbar, tm)
+        elif workers > 1:
+            _overlay_parallel(bg_paths, pending_for, record, backgrounds_dir, pics_root, output_root, params,
+                              seed, workers, sprite_cache_mb, pbar, tm)
+        else:
+            # 处理每个组合
+            for bg_path in bg_paths:
+                pending = pending_for(bg_path)
+                if not pending:
+                    continue
+
                 try:
-                    # 加载小图
-                    small_img_pil = Image.open(pic_path).convert('RGBA')
-                    
-                    for aug_idx in range(num_augments):
-                        # 应用小图增强（包含颜色和透视变换）
-                        # 每次循环重新应用以保证随机性
-                        current_small_img = apply_small_aug(small_img_pil)
-                        
-                        # 随机缩放
-                        scale = random.uniform(min_scale, max_scale)
-                        new_size = (int(current_small_img.width * scale), int(current_small_img.height * scale))
-                        scaled_img = current_small_img.resize(new_size, Image.LANCZOS)
-
-                        # 随机旋转
-                        angle = random.choice([0, 90, 180, 270])
-                        angle1 = random.uniform(-10, 10)
-                        angle = 0
-                        angle1 = 0
-                        angle = angle + angle1
-                        rotated_img = scaled_img.rotate(
-                            angle,
-                            expand=True,
-                            resample=Image.BICUBIC,
-                            fillcolor=(0, 0, 0, 0)
-                        )
-                        rw, rh = rotated_img.size
-                        
-                        # 智能定位 - 专门在ROI区域内放置小图
-                        valid_pos = False
-                        
-                        # 重构可见度逻辑：
-                        # min_visible 控制图片在 ROI (当前为全图) 内的最小边长比例
-                        # 例如 0.9 表示图片在宽和高方向上至少有 90% 的长度落在背景内
-                        
-                        # 计算图片在左/上侧允许超出的最大长度
-                        max_offset_x = rw * (1 - min_visible)
-                        max_offset_y = rh * (1 - min_visible)
-                        
-                        # 计算左上角坐标 x, y 的允许范围：
-                        # 最小值：图片左边缘在背景左边缘左侧 max_offset_x 处
-                        # 最大值：图片右边缘在背景右边缘右侧 max_offset_x 处 (即 x = bg_w - rw + max_offset_x)
-                        x_min = roi_x - max_offset_x
-                        x_max = roi_x + roi_w - rw + max_offset_x
-                        
-                        y_min = roi_y - max_offset_y
-                        y_max = roi_y + roi_h - rh + max_offset_y
-                        
-                        # 如果图片太大且 min_visible 要求很高导致逻辑冲突，则居中处理
-                        if x_min > x_max:
-                            x_min = x_max = roi_x + (roi_w - rw) / 2
-                        if y_min > y_max:
-                            y_min = y_max = roi_y + (roi_h - rh) / 2
-
-                        # 随机选择左上角起始位置
-                        x = int(random.uniform(x_min, x_max))
-                        y = int(random.uniform(y_min, y_max))
-                        valid_pos = True
-
-                        if not valid_pos:
-                            # 如果找不到有效位置，跳过当前增强
-                            print(f"无法为 {pic_path} 找到满足 min_visible={min_visible} 的位置")
-                            continue
-
-                        # 计算输出路径
-                        rel_path = os.path.relpath(pic_path, pics_root)
-                        output_dir = os.path.join(output_root, os.path.dirname(rel_path))
-                        os.makedirs(output_dir, exist_ok=True)
-                        
-                        # 合成基础图像
-                        composite = Image.new('RGBA', (bg_w, bg_h))
-                        composite.paste(base_img, (0,0))
-                        composite.alpha_composite(rotated_img, (x, y))
-                        rgb_composite = composite.convert('RGB')
-                        
-                        # 转换为OpenCV格式
-                        cv_image = cv2.cvtColor(np.array(rgb_composite), cv2.COLOR_RGB2BGR)
-                        
-                        # 应用全局数据增强
-                        augmented = global_aug_pipeline(image=cv_image)
-                        augmented_img = augmented['image']
-                        
-                        # 生成唯一文件名
-                        timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
-                        pic_name = os.path.splitext(os.path.basename(pic_path))[0]
-                        output_name = f"{bg_name}_{pic_name}_{timestamp}_aug{aug_idx}.jpg"
-                        output_path = os.path.join(output_dir, output_name)
-                        
-                        # 保存增强后的图像
-                        cv2.imwrite(output_path, augmented_img)
-                        
-                        # 更新进度条
-                        pbar.set_postfix_str(f"处理: {os.path.basename(output_path)}")
-                        pbar.update(1)
-                        
+                    with tm.stage('decode'):
+                        background = load_background(bg_path)
+                    bg_id = _image_id(bg_path, backgrounds_dir)
+
+                    def compute(pic_path, sprite):
+                        pic_id = _image_id(pic_path, pics_root)
+                        for aug_idx in pending[pic_path]:
+                            # 合成与全局增强
+                            sample_seed = None if seed is None else task_seed(seed, bg_id, pic_id, aug_idx)
+                            augmented_img = render_sample(background, sprite, min_scale, max_scale, min_visible,
+                                                          sample_seed, tm)
+                            if augmented_img is None:
+                                print(f"无法为 {pic_path} 找到满足 min_visible={min_visible} 的位置")
+                                continue
+
+                            # 计算输出路径
+                            output_path = _output_path(output_root, backgrounds_dir, pics_root, bg_path, pic_path,
+                                                       aug_idx)
+                            with tm.stage('mkdir'):
+                                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+                            # 保存增强后的图像（交给写线程，写成功后才记入清单）
+                            yield output_path, augmented_img, pic_path, aug_idx
+
+                            # 更新进度条
+                            pbar.set_postfix_str(f"处理: {os.path.basename(output_path)}")
+                            pbar.update(1)
+
+                    def write(job):
+                        output_path, augmented_img, pic_path, aug_idx = job
+                        imwrite_or_raise(output_path, augmented_img, telemetry=tm)
+                        record(bg_path, pic_path, aug_idx, output_path)
+
+                    def on_error(pic_path, e):
+                        print(f"处理失败：{pic_path} | 错误：{str(e)}")
+
+                    # 小图读取解码、合成增强、编码保存三段流水线
+                    run_pipeline(list(pending),
+                                 read=sprite_cache.get,
+                                 compute=compute,
+                                 write=write,
+                                 readers=io_threads, writers=io_threads, on_error=on_error, telemetry=tm)
+
                 except Exception as e:
-                    print(f"处理失败：{pic_path} | 错误：{str(e)}")
-                
+                    print(f"背景图处理失败：{bg_path} | 错误：{str(e)}")
+            print(f"小图缓存: 命中 {sprite_cache.hits} 次，解码 {sprite_cache.misses} 次")
+    finally:
+        pbar.close()
+        if manifest is not None:
+            manifest.close()
+        if own_telemetry:
+            tm.close('batch_overlay')
+    print("所有图像合成完成！")
+
+def _overlay_parallel(bg_paths, pending_for, record, backgrounds_dir, pics_root, output_root, params,
+                      seed, workers, sprite_cache_mb, pbar, tm):
+    """
+    batch_overlay 的多进程模式：任务为 (背景, 小图, 待生成的增强序号)，子进程合成并直接写盘。
+    背景在主进程中只解码一次，放进共享内存（见 background_store.py），子进程零拷贝附加；
+    任务按背景分组、限量提交，一张背景的任务全部完成后立即释放，同时驻留的背景数有界
+    """
+    groups = [(bg_path, pending) for bg_path, pending in ((bg_path, pending_for(bg_path)) for bg_path in bg_paths)
+              if pending]
+    if not groups:
+        return
+
+    # 先在主进程中创建全部目录，避免子进程竞争
+    for output_dir in sorted({os.path.dirname(_output_path(output_root, backgrounds_dir, pics_root, bg_path,
+                                                           pic_path, 0))
+                              for bg_path, pending in groups for pic_path in pending}):
+        os.makedirs(output_dir, exist_ok=True)
+
+    run_task = partial(_overlay_task, backgrounds_dir=backgrounds_dir, pics_root=pics_root,
+                       output_root=output_root, params=params, seed=seed)
+    max_in_flight = workers * 4
+    in_flight = set()
+
+    def collect(futures):
+        for future in futures:
+            (_, bg_path, pic_path, aug_ids), done, error = future.result()
+            store.release(bg_path)
+            if error is not None:
+                print(f"处理失败：{pic_path} | 背景：{bg_path} | 错误：{error}")
+            for aug_idx, output_path in done:
+                record(bg_path, pic_path, aug_idx, output_path)
+            pbar.update(len(aug_ids))
+            tm.count('items')
+            tm.count('outputs', len(done))
+
+    with SharedBackgroundStore(telemetry=tm) as store, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_overlay_worker,
+                                initargs=(sprite_cache_mb,)) as executor:
+        pbar.set_description(f"合成进度 ({workers} 进程)")
+        for bg_path, pending in groups:
+            try:
+                # 一次占上该背景全部任务的引用，最后一个任务完成时释放
+                handle = store.acquire(bg_path, count=len(pending))
+            except Exception as e:
+                print(f"背景图处理失败：{bg_path} | 错误：{str(e)}")
+                pbar.update(sum(len(aug_ids) for aug_ids in pending.values()))
+                continue
+            for pic_path, aug_ids in pending.items():
+                if len(in_flight) >= max_in_flight:
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(finished)
+                in_flight.add(executor.submit(run_task, (handle, bg_path, pic_path, aug_ids)))
+        collect(as_completed(in_flight))
+
+def _overlay_packed(bg_paths, pic_paths, wanted_for, backgrounds_dir, pics_root, output_root, params,
+                    manifest_params, seed, objects_per_canvas, max_overlap, sprite_cache, manifest, io_threads,
+                    pbar, tm):
+    """
+    batch_overlay 的多目标模式：每张背景待生成的 (小图, 增强序号) 实例随机分组，每组 objects_per_canvas 个
+    贴到同一张画布上（见 pack_once），输出 背景名_pack画布序号.jpg 与同名 YOLO 标签 .txt；
+    类别为小图的第一级目录，类别表写入 output_root/classes.txt
+    """
+    names = sorted({_class_of(pic_path, pics_root) for pic_path in pic_paths})
+    class_index = {name: i for i, name in enumerate(names)}
+    os.makedirs(output_root, exist_ok=True)
+    root_name = os.path.basename(os.path.normpath(pics_root))
+    write_atomic(os.path.join(output_root, 'classes.txt'),
+                 ''.join(f"{name or root_name}\n" for name in names).encode('utf-8'))
+    pack_params = {**manifest_params, 'objects_per_canvas': objects_per_canvas, 'max_overlap': max_overlap}
+
+    for bg_path in bg_paths:
+        bg_id = _image_id(bg_path, backgrounds_dir)
+        bg_name = background_name(bg_path, backgrounds_dir)
+        # 分组只由种子和背景决定，续跑时每张画布的小图不变
+        instances = sorted((pic_path, aug_idx) for pic_path, aug_ids in wanted_for(bg_path).items()
+                           for aug_idx in aug_ids)
+        random.Random(task_seed(0 if seed is None else seed, bg_id, None, -1)).shuffle(instances)
+        groups = []
+        for canvas_idx, start in enumerate(range(0, len(instances), objects_per_canvas)):
+            group = instances[start:start + objects_per_canvas]
+            if manifest is not None and manifest.is_done([bg_path] + [pic_path for pic_path, _ in group],
+                                                         {**pack_params, 'canvas': canvas_idx}):
+                pbar.update(len(group))
+                continue
+            groups.append((canvas_idx, group))
+        if not groups:
+            continue
+
+        try:
+            with tm.stage('decode'):
+                background = load_background(bg_path)
+            bg_h, bg_w = background.shape[:2]
+
+            def read(item):
+                return [sprite_cache.get(pic_path) for pic_path, _ in item[1]]
+
+            def compute(item, sprites):
+                canvas_idx, group = item
+                rng = None
+                if seed is not None:
+                    rng = seeded_rng(task_seed(seed, bg_id, None, canvas_idx))
+                    detection_aug_pipeline.set_random_seed(rng.getrandbits(32))
+                canvas, boxes = pack_once(background, sprites, **params, max_overlap=max_overlap,
+                                          telemetry=tm, rng=rng)
+                if len(boxes) < len(group):
+                    print(f"画布 {bg_name}_pack{canvas_idx} 只放下 {len(boxes)}/{len(group)} 个目标")
+                with tm.stage('global_aug'):
+                    canvas = detection_aug_pipeline(image=canvas)['image']
+
+                class_ids = [class_index[_class_of(pic_path, pics_root)] for pic_path, _ in group]
+                output_path = os.path.join(output_root, f"{bg_name}_pack{canvas_idx}.jpg")
+                label_path = os.path.splitext(output_path)[0] + '.txt'
+                yield output_path, canvas, label_path, yolo_label_text(boxes, class_ids, bg_w, bg_h), item
+                pbar.set_postfix_str(f"处理: {os.path.basename(output_path)}")
+                pbar.update(len(group))
+
+            def write(job):
+                # 图片和标签都先写临时文件再改名，两者都写成功后才记入清单
+                output_path, canvas, label_path, label, (canvas_idx, group) = job
+                imwrite_or_raise(output_path, canvas, telemetry=tm)
+                with tm.stage('write'):
+                    write_atomic(label_path, label.encode('utf-8'))
+                if manifest is not None:
+                    manifest.record([bg_path] + [pic_path for pic_path, _ in group],
+                                    {**pack_params, 'canvas': canvas_idx}, [output_path, label_path])
+
+            def on_error(item, e):
+                print(f"处理失败：{bg_name}_pack{item[0]} | 错误：{str(e)}")
+
+            run_pipeline(groups, read=read, compute=compute, write=write,
+                         readers=io_threads, writers=io_threads, on_error=on_error, telemetry=tm)
+
         except Exception as e:
             print(f"背景图处理失败：{bg_path} | 错误：{str(e)}")
-    
-    pbar.close()
-    print("所有图像合成完成！")
 
 if __name__ == '__main__':
     # 示例用法1：没有指定ROI，默认使用整个背景
@@ -244,4 +736,5 @@ if __name__ == '__main__':
         max_scale=1.1,
         min_visible=0.9,  # 100%的小图必须位于指定ROI区域内
         num_augments=10,
+        resume=True,
     )
\ No newline at end of file
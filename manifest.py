@@ -0,0 +1,188 @@
+'''
+    输出清单（manifest）：支持增量、可断点续跑的批处理
+    每完成一个任务，就在输出目录下的 .manifest.jsonl 追加一行：
+        源文件（路径、大小、修改时间，可选内容哈希）、操作参数、输出文件列表
+    再次运行时，源文件未变、参数相同且输出文件都还在的任务直接跳过；
+    新增的源文件/背景/类别只生成新的组合，中途被杀掉的任务从断点继续
+'''
+import hashlib
+import json
+import os
+import threading
+
+import cv2
+
+from telemetry import NULL_TELEMETRY
+
+
+def encode_image(path, img, params=None):
+    """按 path 的扩展名编码图片，返回字节；与 cv2.imwrite 写出的文件内容相同，编码失败返回 None"""
+    ok, buf = cv2.imencode(os.path.splitext(path)[1], img, params or [])
+    return buf.tobytes() if ok else None
+
+
+def write_atomic(path, data):
+    """
+    先写到同目录下的临时文件再改名。临时文件名为 原文件名 + '.part'，扩展名不再是图片格式，
+    进程被杀时留下的半个文件不会被 find_images、os.walk 遍历或训练脚本当成图片读取
+    """
+    tmp_path = path + '.part'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def imwrite_atomic(path, img, params=None, telemetry=None):
+    """
+    先写到同目录下的临时文件再改名，输出文件要么完整存在、要么不存在，
+    进程被杀时不会留下写了一半却被清单当成已完成的图片
+    :param telemetry: Telemetry 实例（见 telemetry.py），分别记录 encode、write 两个阶段的耗时
+    """
+    tm = telemetry or NULL_TELEMETRY
+    with tm.stage('encode'):
+        data = encode_image(path, img, params)
+    if data is None:
+        return False
+    with tm.stage('write'):
+        write_atomic(path, data)
+    return True
+
+
+def imwrite_or_raise(path, img, params=None, telemetry=None):
+    """写任务用的 imwrite_atomic：编码失败时抛出 IOError，由流水线的写线程报告，对应任务也不会记入清单"""
+    if not imwrite_atomic(path, img, params, telemetry):
+        raise IOError(f"图片编码失败: {path}")
+
+
+class PendingRecord:
+    """
+    一个任务的输出拆成多个写任务交给写线程时，全部写成功后才记入清单；
+    任何一个写任务失败（没有调用 done）时整个任务都不记录，下次运行会重新生成
+
+    用法:
+        pending = PendingRecord(manifest, [src_path], params)   # manifest 为 None 时不记录
+        for out_path, img in outputs:
+            pending.add(out_path)                # 计算侧：提交写任务前登记该写任务的输出
+            yield out_path, img, pending         # 写侧：写成功后调用 pending.done()
+        pending.seal()                           # 计算侧：该任务不再有新的写任务
+    """
+
+    def __init__(self, manifest, sources, params):
+        self.manifest = manifest
+        self.sources = sources
+        self.params = params
+        self.outputs = []
+        self._remaining = 1  # seal 之前多占一个计数，输出登记完之前不会提前记录
+        self._lock = threading.Lock()
+
+    def add(self, *paths):
+        """登记一个写任务及其输出路径"""
+        with self._lock:
+            self.outputs.extend(paths)
+            self._remaining += 1
+
+    def done(self):
+        """一个写任务已成功写完"""
+        self._release()
+
+    def seal(self):
+        """全部写任务都已登记"""
+        self._release()
+
+    def _release(self):
+        with self._lock:
+            self._remaining -= 1
+            finished = self._remaining == 0
+        if finished and self.manifest is not None:
+            self.manifest.record(self.sources, self.params, self.outputs)
+
+
+class Manifest:
+    """
+    输出清单，保存为 <output_root>/.manifest.jsonl
+
+    用法:
+        manifest = Manifest(output_root)
+        if not manifest.is_done([src_path], params):
+            ...  # 生成输出
+            manifest.record([src_path], params, [out_path, ...])
+        manifest.close()
+    """
+    FILE_NAME = '.manifest.jsonl'
+
+    def __init__(self, output_root, hash_sources=False):
+        """
+        :param output_root: 输出根目录，清单文件写在该目录下
+        :param hash_sources: True 时用源文件内容的 SHA1 判断是否变化（更可靠但需要读全文件），
+                             False 时用 文件大小 + 修改时间
+        """
+        os.makedirs(output_root, exist_ok=True)
+        self.output_root = output_root
+        self.path = os.path.join(output_root, self.FILE_NAME)
+        self.hash_sources = hash_sources
+        self.records = {}
+        self._fingerprints = {}
+        self._lock = threading.Lock()
+        self._file = None
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # 进程被杀时最后一行可能只写了一半
+                self.records[record['key']] = record
+
+    @staticmethod
+    def _key(sources, params):
+        return json.dumps([[os.path.abspath(src) for src in sources], params], sort_keys=True, ensure_ascii=False)
+
+    def fingerprint(self, src_path):
+        """源文件指纹：大小 + 修改时间，或内容 SHA1；同一次运行内按路径缓存"""
+        if src_path not in self._fingerprints:
+            stat = os.stat(src_path)
+            fp = {'size': stat.st_size}
+            if self.hash_sources:
+                with open(src_path, 'rb') as f:
+                    fp['sha1'] = hashlib.sha1(f.read()).hexdigest()
+            else:
+                fp['mtime_ns'] = stat.st_mtime_ns
+            self._fingerprints[src_path] = fp
+        return self._fingerprints[src_path]
+
+    def is_done(self, sources, params):
+        """源文件未变、参数相同、且记录的输出文件都存在时返回 True"""
+        record = self.records.get(self._key(sources, params))
+        if record is None:
+            return False
+        try:
+            fingerprints = [self.fingerprint(src) for src in sources]
+        except OSError:
+            return False
+        return record['sources'] == fingerprints and all(
+            os.path.exists(os.path.join(self.output_root, out)) for out in record['outputs'])
+
+    def record(self, sources, params, outputs):
+        """记录一个已完成的任务，立即追加写入清单文件"""
+        key = self._key(sources, params)
+        record = {
+            'key': key,
+            'sources': [self.fingerprint(src) for src in sources],
+            'outputs': [os.path.relpath(out, self.output_root) for out in outputs],  # 相对输出根目录保存
+        }
+        with self._lock:
+            self.records[key] = record
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
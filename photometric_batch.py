@@ -0,0 +1,191 @@
+'''
+    图像堆的批量颜色增强
+    albumentations 每调用一次都要走一遍 Compose 的参数采样、校验和调度，160px 的小图上这部分开销比像素计算还大。
+    BatchPhotometric 一次处理 N×H×W×3 的 uint8 图像堆：为每个样本、每个通道采样参数并生成 256 项查找表，
+    相邻的逐像素变换（RGBShift、RandomBrightnessContrast）合成一张表，用 cv2.LUT 一次完成；
+    HueSaturationValue 对整个图像堆只做一次 RGB→HSV→RGB 转换
+
+    公式与 albumentations（r_shift_limit / brightness_limit 等参数名对应的版本）相同，统计上等价：
+        RGBShift:                 out = clip(x + trunc(shift_c))，shift_c ~ U(limit_c)
+        RandomBrightnessContrast: out = trunc(clip(x * (1 + contrast) + brightness * 255))
+        HueSaturationValue:       H = (H + hue) mod 180，S = clip(S + trunc(sat))（S 为 0 的灰色像素保持为 0），
+                                  V = clip(V + trunc(val))
+    默认与 albumentations 一样按 RGB 解释通道顺序，channels='BGR' 时直接处理 OpenCV 的 BGR/BGRA 数组，不必先转换；
+    第 4 个通道视为 alpha，原样保留。每个变换按概率 p 对每个样本独立决定是否执行
+
+    用法:
+        color = BatchPhotometric().rgb_shift(10, 10, 10, p=0.5).brightness_contrast(0.1, 0.1, p=0.8)
+        stack = color(images=stack)['images']          # N×H×W×3
+        img = color(image=img)['image']                # 单张，与 albumentations 的调用方式相同
+        sprite = color(image=sprite_bgra, channels='BGR')['image']   # BGRA 小图，alpha 不变
+'''
+import cv2
+import numpy as np
+
+_ARANGE = np.arange(256, dtype=np.float32)
+_IDENTITY = np.arange(256, dtype=np.uint8)
+# 通道顺序 -> (查找表中 R、G、B 三张表的排列, 转 HSV 的 cvtColor 代码, 转回的代码)
+_CHANNELS = {
+    'RGB': ([0, 1, 2], cv2.COLOR_RGB2HSV, cv2.COLOR_HSV2RGB),
+    'BGR': ([2, 1, 0], cv2.COLOR_BGR2HSV, cv2.COLOR_HSV2BGR),
+}
+
+
+def _limits(limit):
+    """与 albumentations 相同：单个数 x 表示 (-x, x)"""
+    if np.isscalar(limit):
+        return (-abs(limit), abs(limit))
+    return tuple(limit)
+
+
+def _to_uint8(lut):
+    return np.clip(lut, 0, 255).astype(np.uint8)
+
+
+def _apply_luts(images, luts):
+    """images: N×H×W×C，luts: N×3×256，每个样本用自己的一组表；C 为 4 时第 4 个通道（alpha）不变"""
+    if images.shape[-1] > 3:
+        alpha = np.broadcast_to(_IDENTITY, (len(luts), images.shape[-1] - 3, 256))
+        luts = np.concatenate([luts, alpha], axis=1)
+    out = np.empty_like(images)
+    for n in range(len(images)):
+        cv2.LUT(images[n], np.ascontiguousarray(luts[n].T)[None], dst=out[n])
+    return out
+
+
+class BatchPhotometric:
+    """
+    批量颜色增强管道，变换按添加顺序执行
+    """
+
+    def __init__(self, seed=None):
+        """
+        :param seed: 随机种子，整数或 np.random.Generator；None 时每次结果不同
+        """
+        # [(变换名, 参数字典)]
+        self.stages = []
+        self.set_random_seed(seed)
+
+    def set_random_seed(self, seed):
+        """与 albumentations.Compose.set_random_seed 相同的接口"""
+        self.rng = np.random.default_rng(seed)
+
+    def rgb_shift(self, r_shift_limit=20, g_shift_limit=20, b_shift_limit=20, p=0.5):
+        self.stages.append(('rgb_shift', {'limits': [_limits(r_shift_limit), _limits(g_shift_limit),
+                                                     _limits(b_shift_limit)], 'p': p}))
+        return self
+
+    def brightness_contrast(self, brightness_limit=0.2, contrast_limit=0.2, p=0.5):
+        self.stages.append(('brightness_contrast', {'limits': [_limits(brightness_limit), _limits(contrast_limit)],
+                                                    'p': p}))
+        return self
+
+    def hue_saturation_value(self, hue_shift_limit=20, sat_shift_limit=30, val_shift_limit=20, p=0.5):
+        self.stages.append(('hsv', {'limits': [_limits(hue_shift_limit), _limits(sat_shift_limit),
+                                               _limits(val_shift_limit)], 'p': p}))
+        return self
+
+    def sample(self, n, rng=None):
+        """
+        为 n 个样本采样参数
+        :return: [(变换名, 是否执行 (n,), 参数 (n, k))]，k 为该变换的参数个数
+        """
+        rng = self.rng if rng is None else np.random.default_rng(rng)
+        params = []
+        for name, stage in self.stages:
+            mask = rng.random(n) < stage['p']
+            low, high = np.array(stage['limits'], dtype=np.float64).T
+            params.append((name, mask, rng.uniform(low, high, size=(n, len(low)))))
+        return params
+
+    @staticmethod
+    def _pointwise_luts(name, mask, values):
+        """逐像素变换的查找表 (n, 3, 256)，不执行的样本为恒等表"""
+        if name == 'rgb_shift':
+            luts = _to_uint8(_ARANGE + np.trunc(values)[:, :, None])
+        else:
+            brightness, contrast = values[:, 0], values[:, 1]
+            lut = _to_uint8(_ARANGE * (1 + contrast)[:, None] + (brightness * 255)[:, None])
+            luts = np.repeat(lut[:, None, :], 3, axis=1)
+        luts[~mask] = _ARANGE.astype(np.uint8)
+        return luts
+
+    @staticmethod
+    def _hsv_luts(values):
+        """HSV 三个通道的查找表 (n, 3, 256)"""
+        hue, sat, val = values[:, 0:1], np.trunc(values[:, 1:2]), np.trunc(values[:, 2:3])
+        hue_lut = np.mod(_ARANGE + hue, 180).astype(np.uint8)
+        sat_lut = _to_uint8(_ARANGE + sat)
+        sat_lut[:, 0] = 0  # 灰色像素保持不饱和
+        return np.stack([hue_lut, sat_lut, _to_uint8(_ARANGE + val)], axis=1)
+
+    def apply(self, images, params, channels='RGB'):
+        """
+        按 sample() 的参数处理图像堆，返回新的图像堆
+        :param images: N×H×W×3 uint8，或 N×H×W×4（第 4 个通道为 alpha，原样保留）
+        :param channels: 颜色通道顺序，'RGB' 或 'BGR'
+        """
+        images = np.ascontiguousarray(images)
+        order, to_hsv, from_hsv = _CHANNELS[channels]
+        out = images
+        pending = None  # 尚未执行的逐像素查找表，相邻的逐像素变换先合成为一张表
+        for name, mask, values in params:
+            if name != 'hsv':
+                luts = self._pointwise_luts(name, mask, values)
+                # 先查旧表再查新表：new[n, c, old[n, c, x]]
+                pending = luts if pending is None else np.take_along_axis(luts, pending.astype(np.intp), axis=2)
+                continue
+            if pending is not None:
+                out = _apply_luts(out, pending[:, order])
+                pending = None
+            if not mask.any():
+                continue
+            if out is images:
+                out = images.copy()
+            # 只转换执行该变换的样本，其余样本不做有损的 HSV 往返
+            sub = out if mask.all() else out[mask]
+            n, h, w, c = sub.shape
+            flat = sub.reshape(n * h, w, c)
+            color = cv2.cvtColor(flat, cv2.COLOR_BGRA2BGR) if c == 4 else flat  # 去掉 alpha，与通道顺序无关
+            hsv = cv2.cvtColor(color, to_hsv).reshape(n, h, w, 3)
+            hsv = _apply_luts(hsv, self._hsv_luts(values[mask]))
+            color = cv2.cvtColor(hsv.reshape(n * h, w, 3), from_hsv)
+            if c == 4:
+                cv2.mixChannels([color], [flat], [0, 0, 1, 1, 2, 2])  # 颜色写回前三个通道，alpha 不变
+            else:
+                flat[...] = color
+            if sub is not out:
+                out[mask] = sub
+        if pending is not None:
+            out = _apply_luts(out, pending[:, order])
+        return out.copy() if out is images else out
+
+    def __call__(self, image=None, images=None, channels='RGB'):
+        """
+        与 albumentations 相同的调用方式：image=单张 或 images=图像堆，返回 {'image'/'images': 结果}
+        channels 同 apply
+        """
+        if images is not None:
+            return {'images': self.apply(images, self.sample(len(images)), channels)}
+        return {'image': self.apply(image[None], self.sample(1), channels)[0]}
+
+    def __repr__(self):
+        return f"BatchPhotometric({self.stages!r})"
+
+
+# 合成用小图的颜色增强参数：image_mask_AL.small_aug_pipeline 与 benchmark 都由它构建，
+# 放在这里是为了不依赖 albumentations；改参数只改这一处
+SPRITE_COLOR_STAGES = (
+    ('rgb_shift', {'r_shift_limit': (-10, 10), 'g_shift_limit': (-10, 10), 'b_shift_limit': (-10, 10), 'p': 0.5}),
+    ('brightness_contrast', {'brightness_limit': (-0.10, 0.10), 'contrast_limit': (-0.1, 0.1), 'p': 0.8}),
+    ('hue_saturation_value', {'hue_shift_limit': (-10, 10), 'sat_shift_limit': (-15, 15), 'val_shift_limit': (-10, 10),
+                              'p': 0.7}),
+)
+
+
+def sprite_color_pipeline(seed=None):
+    """按 SPRITE_COLOR_STAGES 构建合成用小图的颜色增强管道"""
+    color = BatchPhotometric(seed)
+    for name, params in SPRITE_COLOR_STAGES:
+        getattr(color, name)(**params)
+    return color
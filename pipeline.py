@@ -0,0 +1,115 @@
+'''
+    图片批处理流水线：读取/解码、计算、编码/写盘 三段重叠执行
+    1. 读取线程池按顺序预取并解码后续图片（cv2.imread / PIL 解码时会释放 GIL）
+    2. 计算阶段在调用线程中按输入顺序执行，随机增强的调用顺序与串行处理相同
+    3. 编码/写盘线程池负责 cv2.imwrite 等耗时 I/O
+    两侧都有数量上限：读取最多预取 max_pending 个，写入最多排队 max_pending 个，
+    计算跟不上时读取自动暂停，磁盘跟不上时计算自动等待，峰值内存有界
+'''
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from telemetry import NULL_TELEMETRY
+
+
+_DONE = object()
+
+
+def _submit(pool, fn, arg):
+    """有线程池时提交到线程池；线程数为 0 时在当前线程直接执行，返回已完成的 Future"""
+    if pool is not None:
+        return pool.submit(fn, arg)
+    future = Future()
+    try:
+        future.set_result(fn(arg))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def run_pipeline(items, read, compute, write, readers=4, writers=4, max_pending=16, on_error=None, telemetry=None):
+    """
+    按 读取 -> 计算 -> 写入 三段流水线处理 items
+
+    参数:
+        items: 任务列表或任意可迭代对象（如图片路径）
+        read: read(item) -> 数据，在读取线程中执行（如解码图片）
+        compute: compute(item, 数据) -> 可迭代的写任务，在调用线程中按输入顺序执行
+        write: write(写任务) -> None，在写线程中执行（如编码并保存图片）
+        readers: 读取线程数，0 表示在调用线程中读取
+        writers: 写入线程数，0 表示在调用线程中写入
+        max_pending: 预取和待写入各自的数量上限（背压）
+        on_error: on_error(item, 异常)，读取或计算失败时调用；为 None 时异常直接抛出。
+                  写入失败只打印错误，不中断流水线
+        telemetry: Telemetry 实例（见 telemetry.py），记录各段耗时、等待时间与排队深度；None 为不记录
+
+    返回:
+        处理的任务数
+    """
+    items = iter(items)
+    pending = deque()
+    write_slots = threading.Semaphore(max_pending)
+    count = 0
+    tm = telemetry or NULL_TELEMETRY
+    writes_in_flight = [0]
+    in_flight_lock = threading.Lock()
+
+    def _read(item):
+        with tm.stage('pipeline.read'):
+            return read(item)
+
+    def _write(job):
+        try:
+            with tm.stage('pipeline.write'):
+                write(job)
+            tm.count('outputs')
+        except Exception as e:
+            print(f"写入失败: {str(e)}")
+        finally:
+            with in_flight_lock:
+                writes_in_flight[0] -= 1
+            write_slots.release()
+
+    read_pool = ThreadPoolExecutor(readers, thread_name_prefix='reader') if readers > 0 else None
+    write_pool = ThreadPoolExecutor(writers, thread_name_prefix='writer') if writers > 0 else None
+
+    def _prefetch():
+        for item in items:
+            pending.append((item, _submit(read_pool, _read, item)))
+            return
+
+    try:
+        for _ in range(max(1, max_pending)):
+            _prefetch()
+        while pending:
+            item, future = pending.popleft()
+            _prefetch()
+            tm.gauge('read_queue', len(pending))
+            try:
+                # 等待读取的时间长说明读盘/解码是瓶颈，等待写入槽位的时间长说明编码/写盘是瓶颈
+                with tm.stage('pipeline.wait_read'):
+                    data = future.result()
+                jobs = iter(compute(item, data))
+                while True:
+                    with tm.stage('pipeline.compute'):
+                        job = next(jobs, _DONE)
+                    if job is _DONE:
+                        break
+                    with tm.stage('pipeline.wait_write'):
+                        write_slots.acquire()
+                    with in_flight_lock:
+                        writes_in_flight[0] += 1
+                        tm.gauge('write_queue', writes_in_flight[0])
+                    _submit(write_pool, _write, job)
+            except Exception as e:
+                if on_error is None:
+                    raise
+                on_error(item, e)
+            count += 1
+            tm.count('items')
+    finally:
+        for pool in (read_pool, write_pool):
+            if pool is not None:
+                pool.shutdown(wait=True)
+    return count
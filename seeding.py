@@ -0,0 +1,20 @@
+'''
+    任务级随机种子：由全局种子和任务标识派生每个任务自己的种子，
+    结果只由 (种子, 任务标识) 决定，与进程数、调度顺序、续跑时跳过了哪些任务都无关。
+    image_mask_AL.batch_overlay 与 yolo_Au.process_split 共用
+
+    用法:
+        from seeding import task_seed
+        sample_seed = task_seed(seed, bg_id, pic_id, aug_idx)     # 任务标识可以是任意个 JSON 可序列化的值
+'''
+import hashlib
+import json
+
+
+def task_seed(seed, *keys):
+    """
+    由 (全局种子, 任务标识...) 派生单个任务的 64 位种子。
+    标识应取相对路径（'/' 分隔）等稳定的值，增删其他图片不会改变已有任务的结果
+    """
+    data = json.dumps([seed, *keys]).encode('utf-8')
+    return int.from_bytes(hashlib.sha256(data).digest()[:8], 'little')
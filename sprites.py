@@ -0,0 +1,187 @@
+'''
+    合成用小图（sprite）的内存缓存
+    1. SpritePyramid: 小图解码后预先生成 mip 金字塔（每层长宽减半），随机缩放时从最接近且不小于目标尺寸的层出发，
+       只需再做一次小幅度的廉价缩放，不必每次都从原图做 LANCZOS
+    2. SpriteCache: 按字节预算做 LRU 的小图缓存，每张小图只解码一次，在所有背景之间共用
+    3. 透明边裁剪：加载时按 alpha 非零区域的外接框裁掉四周的全透明边，记录偏移，
+       后续的颜色增强、仿射、缩放与合成都只处理裁剪后的像素；合成时按原始尺寸（含透明边）定位，放置位置不变
+    4. 小图从解码到合成始终是 BGRA uint8 数组（与 compositing.alpha_blend_roi 的输入相同），不经过 PIL，
+       也没有 RGBA/BGRA 之间的来回转换；缩放、旋转按预乘 alpha 计算，透明边缘不会发黑
+
+    用法:
+        cache = SpriteCache(max_bytes=512 * 2 ** 20)
+        pyramid = cache.get(pic_path)
+        level, img = pyramid.level_for(0.4)   # 第 1 层（原图的 1/2），再缩小 0.8 倍即可
+'''
+import math
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from placement import rotated_size
+from telemetry import NULL_TELEMETRY
+
+
+def read_sprite(path):
+    """
+    读取小图为 BGRA uint8 数组。灰度、无 alpha 的图片补成不透明，16 位图片取高 8 位；
+    用 imdecode 读取，路径中含中文时也能打开
+    """
+    img = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise ValueError(f"无法读取小图: {path}")
+    if img.dtype == np.uint16:
+        img = (img >> 8).astype(np.uint8)
+    if img.ndim == 2:
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2BGRA)
+    if img.shape[2] == 3:
+        return cv2.cvtColor(img, cv2.COLOR_BGR2BGRA)
+    return img
+
+
+def _premultiplied(fn, img):
+    """在预乘 alpha 的空间里执行 fn（缩放、旋转等插值操作），结果转回直通 alpha"""
+    # mRGBA 转换只认 alpha 在第 4 通道，对 BGRA 同样适用
+    return cv2.cvtColor(fn(cv2.cvtColor(img, cv2.COLOR_RGBA2mRGBA)), cv2.COLOR_mRGBA2RGBA)
+
+
+def _reduce2(img):
+    """长宽减半的 2x2 面积平均；奇数边的最后一行/列只对实际存在的像素取平均（复制边缘后效果相同），与 PIL reduce(2) 一致"""
+    h, w = img.shape[:2]
+    if h % 2 or w % 2:
+        img = cv2.copyMakeBorder(img, 0, h % 2, 0, w % 2, cv2.BORDER_REPLICATE)
+    return cv2.resize(img, ((w + 1) // 2, (h + 1) // 2), interpolation=cv2.INTER_AREA)
+
+
+class SpritePyramid:
+    """
+    小图的 mip 金字塔：levels[k] 为原图长宽缩小 2^k 倍的 BGRA 数组。
+    逐层按预乘 alpha 做 2x2 面积平均（与 PIL 对 RGBA 的 reduce(2) 相同），透明边缘不会发黑
+    """
+
+    def __init__(self, img_bgra, min_size=16, max_levels=None, trim=False):
+        """
+        :param img_bgra: 原始小图（BGRA uint8 数组，见 read_sprite）
+        :param min_size: 最小一层的短边不小于该值
+        :param max_levels: 最多层数（含原图），1 表示不建金字塔
+        :param trim: 先裁掉四周 alpha 为 0 的透明边，金字塔只保存裁剪后的部分
+        """
+        self.full_size = (img_bgra.shape[1], img_bgra.shape[0])
+        self.offset = (0, 0)  # 裁剪后左上角在原图中的位置
+        if trim:
+            x, y, w, h = cv2.boundingRect(img_bgra[..., 3])
+            if w > 0 and h > 0 and (w, h) != self.full_size:
+                img_bgra = img_bgra[y:y + h, x:x + w].copy()
+                self.offset = (x, y)
+        self.levels = [img_bgra]
+        while min(self.size_of(-1)) >= 2 * min_size and (max_levels is None or len(self.levels) < max_levels):
+            self.levels.append(_premultiplied(_reduce2, self.levels[-1]))
+
+    def size_of(self, k):
+        """第 k 层的 (宽, 高)"""
+        return self.levels[k].shape[1], self.levels[k].shape[0]
+
+    @property
+    def size(self):
+        return self.size_of(0)
+
+    @property
+    def margins(self):
+        """裁掉的透明边宽度 (左, 上, 右, 下)，原图像素"""
+        (x0, y0), (w, h) = self.offset, self.size
+        return x0, y0, self.full_size[0] - x0 - w, self.full_size[1] - y0 - h
+
+    @property
+    def nbytes(self):
+        return sum(img.nbytes for img in self.levels)
+
+    def level_for(self, scale):
+        """
+        缩放倍数 scale（相对原图）对应的层：分辨率不低于目标的最小一层
+        :return: (层号 k, 该层图像)，该层到目标还需缩放 scale * 2^k 倍（在 (0.5, 1] 内，或 scale > 1 时放大）
+        """
+        k = 0 if scale >= 1 else min(len(self.levels) - 1, int(math.floor(math.log2(1 / scale))))
+        return k, self.levels[k]
+
+
+def resize_from_level(img, size):
+    """金字塔层到最终尺寸 size=(宽, 高) 的缩放：缩小时 INTER_AREA（比例不超过 2 倍，按面积加权），放大时 INTER_CUBIC"""
+    if size == (img.shape[1], img.shape[0]):
+        return img
+    shrink = size[0] <= img.shape[1] and size[1] <= img.shape[0]
+    interpolation = cv2.INTER_AREA if shrink else cv2.INTER_CUBIC
+    return _premultiplied(lambda x: cv2.resize(x, size, interpolation=interpolation), img)
+
+
+def rotate_sprite(img, angle):
+    """逆时针旋转 angle 度，画布扩大到能容纳整张小图，空白处全透明；几何与 PIL rotate(expand=True) 相同"""
+    if angle % 360 == 0:
+        return img
+    h, w = img.shape[:2]
+    rad = -math.radians(angle)
+    cos, sin = round(math.cos(rad), 15), round(math.sin(rad), 15)
+    a = np.array([[cos, sin], [-sin, cos]])  # 输出坐标 -> 输入坐标
+    center = np.array([w / 2, h / 2])
+    new_w, new_h = rotated_size(w, h, angle)
+    # 输入 = a @ (输出 + offset - center) + center（PIL 以像素边角为原点），换成 OpenCV 以像素中心为原点的坐标
+    offset = np.array([w - new_w, h - new_h]) / 2
+    m = np.hstack([a, (a @ (offset - center + 0.5) + center - 0.5)[:, None]])
+    return _premultiplied(lambda x: cv2.warpAffine(x, m, (new_w, new_h), flags=cv2.INTER_CUBIC | cv2.WARP_INVERSE_MAP,
+                                                   borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0, 0)), img)
+
+
+class SpriteCache:
+    """
+    线程安全的小图缓存：路径 -> SpritePyramid，总字节数超过 max_bytes 时淘汰最久未使用的小图
+    """
+
+    def __init__(self, max_bytes=512 * 2 ** 20, min_size=16, telemetry=None, trim=True):
+        """
+        :param max_bytes: 缓存字节预算（包括金字塔各层）
+        :param min_size: 金字塔最小一层的短边
+        :param trim: 加载时裁掉四周的透明边（见 SpritePyramid）
+        :param telemetry: Telemetry 实例，记录 sprite_decode 阶段与命中/未命中次数
+        """
+        self.max_bytes = max_bytes
+        self.min_size = min_size
+        self.trim = trim
+        self.telemetry = telemetry or NULL_TELEMETRY
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, path):
+        """解码、裁掉透明边并生成金字塔，子类可改写"""
+        return SpritePyramid(read_sprite(path), self.min_size, trim=self.trim)
+
+    def get(self, path):
+        with self._lock:
+            pyramid = self._items.get(path)
+            if pyramid is not None:
+                self._items.move_to_end(path)
+                self.hits += 1
+                self.telemetry.count('sprite_cache_hits')
+                return pyramid
+            self.misses += 1
+        self.telemetry.count('sprite_cache_misses')
+
+        # 解码在锁外进行，读取线程可以并行解码不同的小图
+        with self.telemetry.stage('sprite_decode'):
+            pyramid = self.load(path)
+
+        with self._lock:
+            if path not in self._items:
+                self._items[path] = pyramid
+                self.nbytes += pyramid.nbytes
+                # 至少保留刚放入的一张，单张超出预算时也能使用
+                while self.nbytes > self.max_bytes and len(self._items) > 1:
+                    _, evicted = self._items.popitem(last=False)
+                    self.nbytes -= evicted.nbytes
+        return pyramid
+
+    def __len__(self):
+        return len(self._items)
@@ -0,0 +1,225 @@
+'''
+    可选的分阶段耗时与吞吐遥测，用于长时间运行的批处理
+    记录各阶段（解码、小图增强、缩放/旋转、合成、全局增强、编码、写盘、建目录等）的次数与耗时，
+    流水线的排队深度和进程峰值内存；后台线程定期把快照追加到 JSON Lines 文件，结束时写入并打印汇总，
+    用来判断任务卡在磁盘、LANCZOS 缩放还是 ElasticTransform 上
+
+    用法:
+        batch_overlay(..., telemetry='overlay_telemetry.jsonl')   # 传路径：函数内部创建并在结束时汇总
+
+        tm = Telemetry('run.jsonl', interval=30)                    # 或自行创建，多个函数共用
+        with tm.stage('decode'):
+            img = cv2.imread(path)
+        tm.count('images')
+        tm.gauge('write_queue', n)
+        tm.close()
+'''
+import json
+import os
+import threading
+import time
+
+
+def current_rss():
+    """当前进程常驻内存（字节）：优先 psutil，其次 Linux /proc，都不可用时返回 None"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class _Stage:
+    __slots__ = ('telemetry', 'name', 'start')
+
+    def __init__(self, telemetry, name):
+        self.telemetry = telemetry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.telemetry.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Telemetry:
+    """
+    线程安全的阶段计时器 + 计数器 + 排队深度 + 峰值内存
+    path 为 None 时只在内存中统计，close() 时打印汇总；enabled=False 时所有记录都是空操作
+    """
+
+    def __init__(self, path=None, interval=10.0, enabled=True):
+        """
+        :param path: 快照与汇总写入的 JSON Lines 文件，None 为不写文件
+        :param interval: 快照间隔（秒）
+        :param enabled: False 时不做任何记录，供未开启遥测时使用
+        """
+        self.path = path
+        self.interval = interval
+        self.enabled = enabled
+        self.stages = {}    # 阶段名 -> [次数, 总耗时, 最大耗时]
+        self.counters = {}  # 计数器名 -> 累计值
+        self.gauges = {}    # 指标名 -> [最新值, 最大值, 累加值, 采样数]
+        self.peak_rss = None
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._file = None
+        if not enabled:
+            return
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._file = open(path, 'a', encoding='utf-8')
+        self._thread = threading.Thread(target=self._run, name='telemetry', daemon=True)
+        self._thread.start()
+
+    def stage(self, name):
+        """计时上下文：with tm.stage('decode'): ..."""
+        return _Stage(self, name) if self.enabled else _NULL_STAGE
+
+    def add_time(self, name, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            stat = self.stages.get(name)
+            if stat is None:
+                self.stages[name] = [1, seconds, seconds]
+            else:
+                stat[0] += 1
+                stat[1] += seconds
+                stat[2] = max(stat[2], seconds)
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        """记录瞬时值（如排队深度），汇总其最新值、最大值和平均值"""
+        if not self.enabled:
+            return
+        with self._lock:
+            stat = self.gauges.get(name)
+            if stat is None:
+                self.gauges[name] = [value, value, value, 1]
+            else:
+                stat[0] = value
+                stat[1] = max(stat[1], value)
+                stat[2] += value
+                stat[3] += 1
+
+    def _sample_memory(self):
+        rss = current_rss()
+        if rss is not None:
+            self.peak_rss = rss if self.peak_rss is None else max(self.peak_rss, rss)
+        return rss
+
+    def _run(self):
+        # 内存采样比快照频繁，峰值才不会漏掉
+        next_snapshot = time.perf_counter() + self.interval
+        while not self._stop.wait(min(0.5, self.interval)):
+            self._sample_memory()
+            if time.perf_counter() >= next_snapshot:
+                self._write(self.snapshot('snapshot'))
+                next_snapshot += self.interval
+
+    def snapshot(self, kind='snapshot'):
+        """当前统计的字典：各阶段次数/总耗时/平均/最大、计数器与吞吐、排队深度、内存"""
+        rss = self._sample_memory()
+        elapsed = time.perf_counter() - self._start
+        with self._lock:
+            stages = {name: {'count': n, 'total_s': round(total, 4), 'mean_ms': round(total / n * 1000, 3),
+                             'max_ms': round(peak * 1000, 3)}
+                      for name, (n, total, peak) in self.stages.items()}
+            counters = dict(self.counters)
+            gauges = {name: {'last': last, 'max': peak, 'mean': round(total / n, 3)}
+                      for name, (last, peak, total, n) in self.gauges.items()}
+        return {
+            'type': kind,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'elapsed_s': round(elapsed, 3),
+            'stages': stages,
+            'counters': counters,
+            'rates_per_s': {name: round(value / elapsed, 3) for name, value in counters.items()} if elapsed > 0 else {},
+            'gauges': gauges,
+            'rss_mb': round(rss / 2 ** 20, 1) if rss else None,
+            'peak_rss_mb': round(self.peak_rss / 2 ** 20, 1) if self.peak_rss else None,
+        }
+
+    def _write(self, record):
+        if self._file is None:
+            return
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._file.flush()
+
+    def close(self, title=None):
+        """停止快照线程，写入并打印汇总；返回汇总字典"""
+        if not self.enabled:
+            return None
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        summary = self.snapshot('summary')
+        self._write(summary)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        print_summary(summary, title)
+        return summary
+
+
+def print_summary(summary, title=None):
+    """按总耗时从高到低打印各阶段；读写线程与计算并行，各阶段耗时之和可能大于总时长"""
+    print(f"—— 遥测汇总{f'：{title}' if title else ''}（总时长 {summary['elapsed_s']:.1f} s，"
+          f"峰值内存 {summary['peak_rss_mb']} MB）——")
+    stages = sorted(summary['stages'].items(), key=lambda item: item[1]['total_s'], reverse=True)
+    for name, s in stages:
+        print(f"  {name:24s} {s['total_s']:>10.2f} s  {s['count']:>8d} 次  平均 {s['mean_ms']:>9.2f} ms  "
+              f"最大 {s['max_ms']:>9.2f} ms")
+    for name, value in summary['counters'].items():
+        print(f"  {name:24s} {value:>10d}    {summary['rates_per_s'].get(name, 0):.2f} /s")
+    for name, g in summary['gauges'].items():
+        print(f"  {name:24s} 平均 {g['mean']:.2f}  最大 {g['max']}")
+
+
+NULL_TELEMETRY = Telemetry(enabled=False)
+
+
+def open_telemetry(telemetry):
+    """
+    统一处理函数的 telemetry 参数
+    :param telemetry: None / False 为关闭；True 为只打印汇总；字符串为 JSON Lines 路径，新建一个；
+                      Telemetry 实例原样使用
+    :return: (Telemetry, 是否由调用方负责 close)
+    """
+    if not telemetry:
+        return NULL_TELEMETRY, False
+    if isinstance(telemetry, Telemetry):
+        return telemetry, False
+    return Telemetry(None if telemetry is True else telemetry), True
@@ -1,7 +1,16 @@
 import albumentations as A
 import cv2
 import os
+import random
+import numpy as np
 from tqdm import tqdm
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from functools import partial
+from pipeline import run_pipeline
+from seeding import task_seed
+from manifest import Manifest, PendingRecord, imwrite_or_raise, write_atomic
+from telemetry import NULL_TELEMETRY, open_telemetry
+from background_store import SharedBackgroundStore, attach_background
 
 # 定义增强变换管道
 train_transform = A.Compose(
@@ -131,98 +140,261 @@ output_dir = {
     }
 }
 
-def process_split(split_name, augment=True,Au_num = 10):
-    """处理单个数据集分割"""
+def process_split(split_name, augment=True,Au_num = 10, io_threads=4, resume=False, telemetry=None,
+                  workers=1, seed=None):
+    """
+    处理单个数据集分割
+    io_threads: 读取、写入线程数，图片/标签的读写与增强计算重叠执行（见 pipeline.py）；0 为串行
+    resume: 在输出图片目录下维护清单（见 manifest.py），跳过图片和标签都未变、且输出仍在的样本
+    telemetry: 分阶段耗时遥测（见 telemetry.py）：JSON Lines 路径、True（只打印汇总）或 Telemetry 实例
+    workers: 并行进程数，1 为单进程，None 为 CPU 核数。多进程时按 (图片, 副本序号) 分发任务，
+             每张图片只解码一次、放进共享内存供它的所有副本使用（见 _split_parallel）；遥测只记录整体吞吐
+    seed: 全局随机种子：每个 (图片, 副本序号) 的结果由它唯一确定，与进程数无关（见 seeding.task_seed）；
+          None 时单进程沿用全局随机状态，多进程随机选取一个并打印出来
+    """
+    tm, own_telemetry = open_telemetry(telemetry)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
     # 创建输出目录
-    os.makedirs(output_dir['images'][split_name], exist_ok=True)
-    os.makedirs(output_dir['labels'][split_name], exist_ok=True)
+    with tm.stage('mkdir'):
+        os.makedirs(output_dir['images'][split_name], exist_ok=True)
+        os.makedirs(output_dir['labels'][split_name], exist_ok=True)
     
     # 选择变换器
     transform = train_transform if augment else val_transform
     
     # 遍历原始图像
     img_folder = base_dir['images'][split_name]
-    total_files = len(os.listdir(img_folder))
-    
-    with tqdm(total=total_files, desc=f'Processing {split_name}', unit='img') as pbar:
-        for img_file in os.listdir(img_folder):
-            if not img_file.lower().endswith(('.png', '.jpg', '.jpeg')):
-                continue
+    img_files = [f for f in os.listdir(img_folder) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
 
-            # 构造路径
-            img_path = os.path.join(img_folder, img_file)
-            base_name = os.path.splitext(img_file)[0]
-            txt_path = os.path.join(base_dir['labels'][split_name], base_name + '.txt')
-
-            # 读取数据
-            image = cv2.cvtColor(cv2.imread(img_path), cv2.COLOR_BGR2RGB)
-            height, width = image.shape[:2]
-            
-            # 读取标签
-            bboxes = []
-            if os.path.exists(txt_path):
-                with open(txt_path, 'r') as f:
-                    for line in f:
-                        class_id, xc, yc, w, h = map(float, line.strip().split())
-                        bboxes.append([xc, yc, w, h, int(class_id)])
-            
-            # 应用增强
-            try:
-                augmented = transform(image=image, bboxes=bboxes)
-            except Exception as e:
-                print(f"\nError processing {img_file}: {str(e)}")
-                continue
+    manifest = Manifest(output_dir['images'][split_name]) if resume else None
+    # 显式指定的种子也参与清单比对，换种子后重新生成
+    params = {'split': split_name, 'augment': augment, 'Au_num': Au_num}
+    if seed is not None:
+        params['seed'] = seed
+    if seed is None and workers > 1:
+        seed = random.SystemRandom().randrange(2 ** 32)
+        print(f"随机种子: {seed}（传入 seed={seed} 可复现本次结果）")
+
+    def label_path(img_file):
+        return os.path.join(base_dir['labels'][split_name], os.path.splitext(img_file)[0] + '.txt')
+
+    def sources(img_file):
+        # 图片和标签都作为源文件，任一修改都会重新生成
+        txt_path = label_path(img_file)
+        return [os.path.join(img_folder, img_file)] + ([txt_path] if os.path.exists(txt_path) else [])
+
+    if manifest is not None:
+        img_files = [f for f in img_files if not manifest.is_done(sources(f), params)]
+
+    def read(img_file):
+        # 读取数据
+        with tm.stage('decode'):
+            image = read_rgb(os.path.join(img_folder, img_file))
+        
+        # 读取标签
+        with tm.stage('labels'):
+            bboxes = read_labels(label_path(img_file))
+        return image, bboxes
+
+    def seeded(img_file, copy_idx):
+        # 指定种子时每个副本的随机状态由 (种子, 分割, 图片, 副本序号) 决定，与多进程模式的结果相同
+        if seed is not None:
+            transform.set_random_seed(task_seed(seed, split_name, img_file, copy_idx))
+        return transform
+
+    def compute(img_file, data):
+        pbar.update(1)
+        image, bboxes = data
+
+        # 应用增强
+        try:
+            with tm.stage('augment'):
+                augmented = seeded(img_file, 0)(image=image, bboxes=bboxes)
+        except Exception as e:
+            print(f"\nError processing {img_file}: {str(e)}")
+            return
+
+        # 保存增强结果（全部副本由写线程写成功后才记入清单）
+        pending = PendingRecord(manifest, sources(img_file), params)
+        if augment or len(augmented['bboxes']) > 0:  # 验证集保留所有样本
+            pending.add(*output_paths(img_file, split_name, 0))
+            yield augmented['image'], augmented['bboxes'], img_file, split_name, 0, pending
+
+            # 随机生成增强副本
+            if augment:
+                for copy_idx in range(Au_num):  # 每个样本生成Au_num个增强副本
+                    with tm.stage('augment'):
+                        augmented_copy = seeded(img_file, copy_idx + 1)(image=image, bboxes=bboxes)
+                    pending.add(*output_paths(img_file, split_name, copy_idx + 1))
+                    yield augmented_copy['image'], augmented_copy['bboxes'], img_file, split_name, copy_idx+1, pending
+
+        pending.seal()
+
+    def write(job):
+        *sample, pending = job
+        save_augmented(*sample, telemetry=tm)
+        pending.done()
+
+    def on_error(img_file, e):
+        print(f"\nError processing {img_file}: {str(e)}")
 
-            # 保存增强结果
-            if augment or len(augmented['bboxes']) > 0:  # 验证集保留所有样本
-                save_augmented(
-                    augmented['image'],
-                    augmented['bboxes'],
-                    img_file,
-                    split_name,
-                    copy_number=0
-                )
-
-                # 随机生成增强副本
-                if augment:
-                    for copy_idx in range(Au_num):  # 每个样本生成2个增强副本
-                        augmented_copy = train_transform(image=image, bboxes=bboxes)
-                        save_augmented(
-                            augmented_copy['image'],
-                            augmented_copy['bboxes'],
-                            img_file,
-                            split_name,
-                            copy_number=copy_idx+1
-                        )
-
-            pbar.update(1)
-
-def save_augmented(image, bboxes, orig_filename, split_name, copy_number=0):
-    """保存增强后的数据"""
+    try:
+        if workers > 1:
+            _split_parallel(img_files, img_folder, label_path, sources, split_name, augment, Au_num,
+                            seed, workers, manifest, params, tm)
+        else:
+            with tqdm(total=len(img_files), desc=f'Processing {split_name}', unit='img') as pbar:
+                run_pipeline(img_files, read=read, compute=compute,
+                             write=write,
+                             readers=io_threads, writers=io_threads, on_error=on_error, telemetry=tm)
+    finally:
+        if manifest is not None:
+            manifest.close()
+        if own_telemetry:
+            tm.close(f'process_split({split_name})')
+
+def output_paths(orig_filename, split_name, copy_number=0):
+    """增强结果的 (图片路径, 标签路径)"""
     # 生成唯一文件名
     base_name = os.path.splitext(orig_filename)[0]
     suffix = f"_aug{copy_number}" if copy_number > 0 else ""
-    new_filename = f"{base_name}{suffix}.jpg"
+    return (os.path.join(output_dir['images'][split_name], f"{base_name}{suffix}.jpg"),
+            os.path.join(output_dir['labels'][split_name], f"{base_name}{suffix}.txt"))
+
+def save_augmented(image, bboxes, orig_filename, split_name, copy_number=0, telemetry=None):
+    """保存增强后的数据（图片和标签都先写临时文件再改名，中断时不会留下半个文件）"""
+    write_sample(image, bboxes, *output_paths(orig_filename, split_name, copy_number), telemetry=telemetry)
+
+def write_sample(image, bboxes, img_path, txt_path, telemetry=None):
+    """把 RGB 图像和 YOLO 标签分别原子地写到 img_path、txt_path；图片编码失败时抛出异常，不写标签"""
+    tm = telemetry or NULL_TELEMETRY
     
     # 保存图像
-    cv2.imwrite(
-        os.path.join(output_dir['images'][split_name], new_filename),
-        cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-    )
+    imwrite_or_raise(img_path, cv2.cvtColor(image, cv2.COLOR_RGB2BGR), telemetry=tm)
     
     # 保存标签
-    with open(os.path.join(output_dir['labels'][split_name], f"{base_name}{suffix}.txt"), 'w') as f:
-        for bbox in bboxes:
-            class_id = int(bbox[4])
-            coords = [f"{x:.6f}" for x in bbox[:4]]
-            f.write(f"{class_id} {' '.join(coords)}\n")
+    with tm.stage('write'):
+        write_atomic(txt_path, label_text(bboxes).encode())
+
+def read_rgb(img_path):
+    """读取图片为 RGB 数组，读取失败时抛出异常"""
+    image = cv2.imread(img_path)
+    if image is None:
+        raise ValueError(f"无法读取图片: {img_path}")
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+def read_labels(txt_path):
+    """
+    读取 YOLO 标签（每行 class xc yc w h）为 [[xc, yc, w, h, class_id], ...]，文件不存在或为空时为 []
+    列数不是 5（如带置信度、分割多边形或某行缺列）或含非数字时抛出 ValueError，指明文件和行号
+    """
+    if not os.path.exists(txt_path):
+        return []
+    bboxes = []
+    with open(txt_path, 'r') as f:
+        for line_no, line in enumerate(f, 1):
+            values = line.split()
+            if not values:
+                continue
+            if len(values) != 5:
+                raise ValueError(f"标签格式错误: {txt_path} 第 {line_no} 行有 {len(values)} 列，应为 class xc yc w h")
+            try:
+                class_id, xc, yc, w, h = map(float, values)
+            except ValueError:
+                raise ValueError(f"标签格式错误: {txt_path} 第 {line_no} 行不是数字: {line.strip()}") from None
+            bboxes.append([xc, yc, w, h, int(class_id)])
+    return bboxes
+
+def label_text(bboxes):
+    """[[xc, yc, w, h, class_id], ...] -> YOLO 标签文本"""
+    return ''.join(f"{int(bbox[4])} {' '.join(f'{x:.6f}' for x in bbox[:4])}\n" for bbox in bboxes)
+
+def _init_split_worker():
+    # 每个进程只保留一个 OpenCV 线程，避免 进程数 × OpenCV线程数 的过度订阅
+    cv2.setNumThreads(1)
+
+def _augment_task(task, split_name, augment, seed):
+    """子进程中执行一个 (图片, 副本序号)：从共享内存取图、增强并直接写盘，只把结果状态传回主进程"""
+    handle, img_file, bboxes, copy_idx, img_path, txt_path = task
+    try:
+        # 共享内存中的图片是只读视图，复制一份交给增强管道
+        image = np.array(attach_background(handle))
+        transform = train_transform if augment else val_transform
+        transform.set_random_seed(task_seed(seed, split_name, img_file, copy_idx))
+        augmented = transform(image=image, bboxes=bboxes)
+        if not augment and len(augmented['bboxes']) == 0:  # 与单进程相同：不增强时只保留有目标的样本
+            return task, False, None
+        write_sample(augmented['image'], augmented['bboxes'], img_path, txt_path)
+    except Exception as e:
+        return task, False, str(e)
+    return task, True, None
+
+def _split_parallel(img_files, img_folder, label_path, sources, split_name, augment, Au_num,
+                    seed, workers, manifest, params, tm):
+    """
+    process_split 的多进程模式：任务为 (图片, 副本序号)，子进程增强并直接写盘，输出命名与单进程相同（_augN）。
+    每张图片在主进程中只解码一次，放进共享内存（见 background_store.py），它的所有副本零拷贝共用；
+    任务按图片顺序限量提交，一张图片的副本全部完成后立即释放。图片的全部副本都成功后才写入清单
+    """
+    copy_ids = list(range(Au_num + 1)) if augment else [0]
+    run_task = partial(_augment_task, split_name=split_name, augment=augment, seed=seed)
+    max_in_flight = workers * 4
+    in_flight = set()
+    # 图片文件名 -> [未完成的副本数, {副本序号: 输出路径}, 是否有失败]
+    state = {}
+
+    def collect(futures):
+        for future in futures:
+            (_, img_file, _, copy_idx, img_path, txt_path), kept, error = future.result()
+            store.release(os.path.join(img_folder, img_file))
+            item = state[img_file]
+            item[0] -= 1
+            if error is not None:
+                print(f"\nError processing {img_file} (copy {copy_idx}): {error}")
+                item[2] = True
+            elif kept:
+                item[1][copy_idx] = (img_path, txt_path)
+            if item[0] == 0:
+                finish(img_file)
+
+    def finish(img_file):
+        _, outputs, failed = state.pop(img_file)
+        pbar.update(1)
+        tm.count('items')
+        tm.count('outputs', len(outputs))
+        if manifest is not None and not failed:
+            manifest.record(sources(img_file), params, [p for idx in sorted(outputs) for p in outputs[idx]])
+
+    with tqdm(total=len(img_files), desc=f'Processing {split_name} ({workers} 进程)', unit='img') as pbar, \
+            SharedBackgroundStore(telemetry=tm, loader=read_rgb) as store, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_split_worker) as executor:
+        for img_file in img_files:
+            try:
+                with tm.stage('labels'):
+                    bboxes = read_labels(label_path(img_file))
+                # 一次占上该图片全部副本的引用，最后一个副本完成时释放
+                handle = store.acquire(os.path.join(img_folder, img_file), count=len(copy_ids))
+            except Exception as e:
+                print(f"\nError processing {img_file}: {str(e)}")
+                pbar.update(1)
+                continue
+            state[img_file] = [len(copy_ids), {}, False]
+            for copy_idx in copy_ids:
+                if len(in_flight) >= max_in_flight:
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(finished)
+                paths = output_paths(img_file, split_name, copy_idx)
+                in_flight.add(executor.submit(run_task, (handle, img_file, bboxes, copy_idx) + paths))
+        collect(as_completed(in_flight))
 
 # 执行处理
 if __name__ == "__main__":
     # 训练集增强（生成10个增强版本）
-    process_split('train', augment=True , Au_num = 10)
+    process_split('train', augment=True , Au_num = 10, resume=True)
     
     # 验证集原样复制（可选）
-    process_split('val', augment=True , Au_num = 10)
+    process_split('val', augment=True , Au_num = 10, resume=True)
     
     print("All data processed!")
\ No newline at end of file